@@ -1,30 +1,460 @@
 import os
-import rasterio
 import numpy as np
-import json
-from psycopg2.extras import execute_batch
-from .verify_point_locale import is_point_in_polygon
-from concurrent.futures import ThreadPoolExecutor
+import shapely
+import threading
+from collections import namedtuple
+from .verify_point_locale import points_in_polygon, locate_points
+from .bulk_loader import upsert_points
+from .clip_mask import build_raster_clip_mask, window_clip_mask, mask_codes
+from .connection_pool import get_connection
+from .pipeline import run_pipeline
+from .checkpoint import window_id, prepare_checkpoints, mark_window_committed
+from . import metrics
+from . import sinks
+from .reference_cache import get_reference_index, get_reference_code_column
+from . import grid_ids
+from .config import AGGREGATIONS
 
 
-def read_raster_in_blocks(file_path):
+# Lote colunar de pontos amostrados: arrays de x (longitude), y (latitude) e valor
+PointBatch = namedtuple("PointBatch", ["x", "y", "value", "code"], defaults=(None,))
+
+# Lado aproximado, em pixels, das janelas lidas na agregação
+AGGREGATION_WINDOW_SIZE = 512
+
+# Conjuntos de dados já avisados de pontos na mesma célula (ver `check_cell_collisions`)
+_COLLISION_WARNED = set()
+_COLLISION_LOCK = threading.Lock()
+
+
+def check_cell_collisions(batch, name, srid=4326):
+    """
+    Verifica se pontos amostrados de um mesmo bloco caem na mesma célula da grade de referência.
+
+    No esquema "cell", dois pixels com o mesmo id seriam mesclados em um único
+    registro na gravação, perdendo um dos valores. Isso acontece quando a grade
+    é mais grossa que o raster amostrado; a contagem vai para as métricas
+    (`cell_collisions`) e um aviso é impresso uma vez por conjunto de dados.
+
+    :param batch: PointBatch (ou LayeredBatch) com os pontos amostrados.
+    :param name: Nome do dado, usado nas métricas e no aviso.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :return: Quantidade de pontos que caem na célula de outro ponto do bloco.
+    """
+
+    if not grid_ids.uses_cell_ids() or not len(batch.x):
+        return 0
+
+    collisions = grid_ids.count_cell_collisions(grid_ids.cell_ids(batch.x, batch.y, srid))
+    if collisions:
+        metrics.count(name, "cell_collisions", collisions)
+        with _COLLISION_LOCK:
+            warn = name not in _COLLISION_WARNED
+            _COLLISION_WARNED.add(name)
+        if warn:
+            print(f"⚠️ {name}: {collisions} pontos caem na célula de outro ponto e serão mesclados; "
+                  f"a grade de referência (GRID_CELL_SIZE) é mais grossa que o raster amostrado.")
+    return collisions
+
+def roi_windows(windows, transform, reference):
+    """
+    Mantém apenas as janelas que tocam a caixa envolvente de algum polígono de referência.
+
+    As caixas de todas as janelas são consultadas de uma vez no STRtree, que
+    compara caixas envolventes; as janelas descartadas não teriam nenhum ponto
+    dentro dos polígonos, então o resultado da carga não muda.
+
+    :param windows: Lista de janelas (rasterio.windows.Window).
+    :param transform: Transformação do raster.
+    :param reference: Tupla (geometrias, STRtree) retornada por `get_reference_index`.
+    :return: Lista das janelas mantidas, na ordem original.
+    """
+
+    if not windows:
+        return windows
+
+    from rasterio.windows import bounds as window_bounds
+
+    _, tree = reference
+    edges = np.array([window_bounds(window, transform) for window in windows])
+    boxes = shapely.box(edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3])
+    window_index, _ = tree.query(boxes)
+    keep = np.zeros(len(windows), dtype=bool)
+    keep[window_index] = True
+    return [window for window, kept in zip(windows, keep) if kept]
+
+def aggregation_window_size(sampling_stride=10):
+    """
+    Lado, em pixels, das janelas lidas na agregação: o múltiplo de
+    `sampling_stride` mais próximo de `AGGREGATION_WINDOW_SIZE` (por baixo).
+    """
+
+    return sampling_stride * max(1, AGGREGATION_WINDOW_SIZE // sampling_stride)
+
+def window_shape(src, sampling_stride=10, aggregation=None):
+    """
+    Dimensões da maior janela que `raster_windows` produz para um raster.
+
+    :param src: Raster aberto com rasterio.
+    :param sampling_stride: Passo de amostragem (lado das células agregadas).
+    :param aggregation: Método de agregação, ou None para os blocos do arquivo.
+    :return: Tupla (linhas, colunas).
+    """
+
+    if aggregation:
+        size = aggregation_window_size(sampling_stride)
+        return min(size, src.height), min(size, src.width)
+    return src.block_shapes[0]
+
+def raster_windows(src, sampling_stride=10, aggregation=None, skip_windows=None, roi=None):
+    """
+    Lista as janelas a ler de um raster aberto.
+
+    Na amostragem são os blocos do próprio arquivo. Na agregação são janelas
+    quadradas com lado múltiplo de `sampling_stride`, alinhadas à grade do
+    raster, para que nenhuma célula agregada fique dividida entre janelas.
+
+    :param src: Raster aberto com rasterio.
+    :param sampling_stride: Passo de amostragem (lado das células agregadas).
+    :param aggregation: Método de agregação (ver `AGGREGATIONS`), ou None para amostrar.
+    :param skip_windows: Identificadores de janelas que não devem ser lidas (ver `checkpoint.window_id`).
+    :param roi: Polígonos de referência (ver `roi_windows`); se informado, lê só as janelas que os tocam.
+    :return: Lista de janelas.
+    """
+
+    if aggregation:
+        from rasterio.windows import Window
+
+        size = aggregation_window_size(sampling_stride)
+        windows = [
+            Window(col_off, row_off, min(size, src.width - col_off), min(size, src.height - row_off))
+            for row_off in range(0, src.height, size)
+            for col_off in range(0, src.width, size)
+        ]
+    else:
+        windows = [window for _, window in src.block_windows(1)]
+
+    if roi is not None:
+        windows = roi_windows(windows, src.transform, roi)
+
+    if skip_windows:
+        windows = [window for window in windows if window_id(window) not in skip_windows]
+    return windows
+
+def load_roi(shp_table):
+    """
+    Carrega os polígonos de referência para o modo de região de interesse.
+
+    :param shp_table: Nome da tabela de polígonos de referência.
+    :return: Tupla (geometrias, STRtree) (ver `get_reference_index`).
+    """
+
+    with sinks.sink_connection() as (conn, cursor):
+        return get_reference_index(cursor, shp_table)
+
+def read_raster_in_blocks(file_path, skip_windows=None, name=None, sampling_stride=10, aggregation=None, roi=None):
     """
     Lê um arquivo raster em blocos.
 
     :param file_path: Caminho do arquivo raster.
-    :return: Um gerador que produz blocos de dados do raster.
+    :param skip_windows: Identificadores de janelas que não devem ser lidas (ver `checkpoint.window_id`).
+    :param name: Nome do dado, usado nas métricas (opcional).
+    :param sampling_stride: Passo de amostragem (lado das células agregadas).
+    :param aggregation: Método de agregação, ou None para ler os blocos do arquivo (ver `raster_windows`).
+    :param roi: Polígonos de referência; se informado, lê só as janelas que os tocam.
+    :return: Um gerador que produz tuplas (dados, transformação, janela, nodata) para cada bloco.
     """
 
     # Verifica se o arquivo existe
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Arquivo não encontrado: {file_path}")
 
+    import rasterio
+
     # Abre o arquivo raster e lê os dados em blocos
     with rasterio.open(file_path) as src:
         transform = src.transform
-        for window in src.block_windows(1):
-            window_data = src.read(1, window=window[1])
-            yield window_data, transform, window[1]
+        nodata = src.nodata
+        windows = raster_windows(src, sampling_stride, aggregation, skip_windows, roi)
+        metrics.set_total(name, len(windows))
+        for window in windows:
+            with metrics.stage(name, "read"):
+                window_data = src.read(1, window=window)
+            yield window_data, transform, window, nodata
+
+def sampling_offsets(window, sampling_stride):
+    """
+    Calcula a primeira linha e coluna do bloco que caem na grade de amostragem.
+
+    :param window: Janela do raster.
+    :param sampling_stride: Passo de amostragem para os dados.
+    :return: Tupla (linha inicial, coluna inicial) relativas ao bloco.
+    """
+
+    return -window.row_off % sampling_stride, -window.col_off % sampling_stride
+
+def sampled_coordinates(rows, cols, transform, window, sampling_stride):
+    """
+    Converte índices de um bloco já amostrado em coordenadas do raster.
+
+    :param rows: Índices de linha no bloco amostrado.
+    :param cols: Índices de coluna no bloco amostrado.
+    :param transform: Transformação do raster.
+    :param window: Janela do raster.
+    :param sampling_stride: Passo de amostragem para os dados.
+    :return: Tupla (x, y) de arrays de coordenadas.
+    """
+
+    row_start, col_start = sampling_offsets(window, sampling_stride)
+    rows = rows * sampling_stride + row_start + window.row_off
+    cols = cols * sampling_stride + col_start + window.col_off
+
+    # Mesma ordem de operações de `transform * (col, row)`
+    x = cols * transform.a + rows * transform.b + transform.c
+    y = cols * transform.d + rows * transform.e + transform.f
+    return x, y
+
+def sample_block(values, transform, window, scale, sampling_stride=10, nodata=None, clip_mask=None):
+    """
+    Amostra um bloco raster de forma vetorizada.
+
+    Seleciona um pixel a cada `sampling_stride` linhas e colunas do raster,
+    descarta os valores NaN, nodata e fora da máscara de recorte, e converte os
+    índices dos pixels em coordenadas pela transformação afim do raster.
+
+    O passo é alinhado à grade do raster inteiro (linha e coluna múltiplas de
+    `sampling_stride`), então os pontos amostrados não dependem do formato dos
+    blocos (faixas de uma linha no ASC ou tiles no GeoTIFF em cache).
+
+    :param values: Dados do bloco raster.
+    :param transform: Transformação do raster.
+    :param window: Janela do raster.
+    :param scale: Fator de escala para o valor.
+    :param sampling_stride: Passo de amostragem para os dados.
+    :param nodata: Valor declarado como nodata no raster (None se não houver).
+    :param clip_mask: Máscara de recorte de todo o raster (opcional). Se for uma LabelMask, o
+        código do polígono de cada ponto vai junto no lote.
+    :return: PointBatch com os pontos válidos do bloco.
+    """
+
+    row_start, col_start = sampling_offsets(window, sampling_stride)
+
+    sampled = values[row_start::sampling_stride, col_start::sampling_stride]
+
+    valid = ~np.isnan(sampled)
+    if nodata is not None:
+        valid &= sampled != nodata
+    if clip_mask is not None:
+        block_mask = window_clip_mask(clip_mask, window, values.shape)
+        valid &= block_mask[row_start::sampling_stride, col_start::sampling_stride]
+
+    rows, cols = np.nonzero(valid)
+    x, y = sampled_coordinates(rows, cols, transform, window, sampling_stride)
+    codes = mask_codes(clip_mask, window, rows * sampling_stride + row_start, cols * sampling_stride + col_start)
+
+    return PointBatch(x, y, sampled[valid] * scale, codes)
+
+def _majority(cells):
+    """
+    Calcula o valor mais frequente de cada linha, ignorando NaN. Nos empates vence o menor valor.
+
+    Percorre as colunas dos valores ordenados contando o tamanho de cada
+    sequência de valores iguais, com todas as linhas processadas de uma vez.
+
+    :param cells: Array 2D (células, pixels de cada célula).
+    :return: Array com o valor mais frequente de cada célula (NaN se não houver valores válidos).
+    """
+
+    ordered = np.sort(cells, axis=1)
+    best_value = np.full(len(ordered), np.nan)
+    best_count = np.zeros(len(ordered), dtype=np.int64)
+    run = np.zeros(len(ordered), dtype=np.int64)
+
+    for column in range(ordered.shape[1]):
+        current = ordered[:, column]
+        if column:
+            run = np.where(current == ordered[:, column - 1], run + 1, 1)
+        else:
+            run = np.ones(len(ordered), dtype=np.int64)
+        better = (run > best_count) & ~np.isnan(current)
+        best_value = np.where(better, current, best_value)
+        best_count = np.where(better, run, best_count)
+
+    return best_value
+
+def aggregate_block(values, transform, window, scale, sampling_stride=10, nodata=None, clip_mask=None, aggregation="mean"):
+    """
+    Resume cada célula de `sampling_stride` x `sampling_stride` pixels de um bloco em um único ponto.
+
+    Os pixels NaN, nodata e fora da máscara de recorte são ignorados. As
+    células são reduzidas de uma vez, reorganizando o bloco em um array
+    (linhas, colunas, pixels da célula). O ponto de cada célula fica no mesmo
+    pixel que a amostragem usaria, então os pontos agregados e amostrados de
+    dados diferentes caem nos mesmos registros.
+
+    A janela deve estar alinhada à grade de células (ver `raster_windows`).
+
+    :param values: Dados do bloco raster.
+    :param transform: Transformação do raster.
+    :param window: Janela do raster.
+    :param scale: Fator de escala para o valor.
+    :param sampling_stride: Lado das células, em pixels.
+    :param nodata: Valor declarado como nodata no raster (None se não houver).
+    :param clip_mask: Máscara de recorte de todo o raster (opcional).
+    :param aggregation: "mean", "min", "max" ou "majority" (valor mais frequente, para dados categóricos).
+    :return: PointBatch com um ponto por célula com algum pixel válido.
+    """
+
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Método de agregação não suportado: {aggregation}")
+
+    height, width = values.shape
+    data = values.astype(np.float64)
+    invalid = np.isnan(data)
+    if nodata is not None:
+        invalid |= data == nodata
+    block_mask = None
+    if clip_mask is not None:
+        block_mask = window_clip_mask(clip_mask, window, values.shape)
+        invalid |= ~block_mask
+    data[invalid] = np.nan
+
+    # Completa com NaN as células incompletas da borda do raster
+    rows = -(-height // sampling_stride)
+    cols = -(-width // sampling_stride)
+    padded = np.full((rows * sampling_stride, cols * sampling_stride), np.nan)
+    padded[:height, :width] = data
+    cells = (
+        padded.reshape(rows, sampling_stride, cols, sampling_stride)
+        .transpose(0, 2, 1, 3)
+        .reshape(rows, cols, sampling_stride * sampling_stride)
+    )
+
+    empty = np.isnan(cells)
+    count = (~empty).sum(axis=2)
+    if aggregation == "mean":
+        result = np.where(empty, 0.0, cells).sum(axis=2) / np.maximum(count, 1)
+    elif aggregation == "min":
+        result = np.where(empty, np.inf, cells).min(axis=2)
+    elif aggregation == "max":
+        result = np.where(empty, -np.inf, cells).max(axis=2)
+    else:
+        result = _majority(cells.reshape(rows * cols, -1)).reshape(rows, cols)
+
+    keep = count > 0
+    if block_mask is not None:
+        # Como na amostragem, o ponto da célula deve estar dentro dos polígonos
+        keep &= block_mask[::sampling_stride, ::sampling_stride]
+
+    cell_rows, cell_cols = np.nonzero(keep)
+    x, y = sampled_coordinates(cell_rows, cell_cols, transform, window, sampling_stride)
+    codes = mask_codes(clip_mask, window, cell_rows * sampling_stride, cell_cols * sampling_stride)
+    return PointBatch(x, y, result[keep] * scale, codes)
+
+def reduce_block(values, transform, window, scale, sampling_stride=10, nodata=None, clip_mask=None, aggregation=None):
+    """
+    Converte um bloco raster em pontos, amostrando (`sample_block`) ou agregando (`aggregate_block`).
+
+    :param aggregation: Método de agregação, ou None para amostrar.
+    :return: PointBatch com os pontos do bloco.
+    """
+
+    if aggregation:
+        return aggregate_block(values, transform, window, scale, sampling_stride, nodata, clip_mask, aggregation)
+    return sample_block(values, transform, window, scale, sampling_stride, nodata, clip_mask)
+
+def filter_batch_by_query(cursor, batch, shp_table, srid=4326):
+    """
+    Mantém apenas os pontos do lote que estão dentro dos polígonos, com uma consulta ao banco por lote.
+
+    Com a coluna de código dos polígonos definida, a mesma consulta traz o
+    código do polígono de cada ponto (ver `locate_points`).
+
+    :param cursor: Cursor do banco de dados.
+    :param batch: PointBatch a ser filtrado.
+    :param shp_table: Nome da tabela de polígonos para verificação espacial.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :return: PointBatch com os pontos dentro dos polígonos.
+    """
+
+    code_column = get_reference_code_column()
+    if code_column is None:
+        inside = points_in_polygon(cursor, batch.x, batch.y, shp_table, srid)
+        return PointBatch(batch.x[inside], batch.y[inside], batch.value[inside])
+
+    inside, codes = locate_points(cursor, batch.x, batch.y, shp_table, code_column, srid)
+    return PointBatch(batch.x[inside], batch.y[inside], batch.value[inside], codes[inside])
+
+def write_point_batch(
+        cursor,
+        conn,
+        table_name,
+        batch,
+        name,
+        measure,
+        execution_date,
+        batch_size=1000,
+        srid=4326,
+        layout="jsonb"
+):
+    """
+    Insere os pontos de um PointBatch no banco de dados, confirmando a cada lote.
+
+    Nos destinos sem banco (ver `sinks`), os pontos são entregues ao destino
+    configurado e `cursor` e `conn` podem ser None.
+
+    :param cursor: Cursor do banco de dados.
+    :param conn: Conexão com o banco de dados.
+    :param table_name: Nome da tabela onde os dados serão inseridos.
+    :param batch: PointBatch com os pontos a inserir.
+    :param name: Nome do dado a ser inserido.
+    :param measure: Unidade de medida do dado.
+    :param execution_date: Data de execução para o registro.
+    :param batch_size: Tamanho do lote para inserção no banco de dados.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    :return: Tupla (pontos gravados, pontos cujo lote falhou).
+    """
+
+    if not sinks.uses_database():
+        return sinks.write_points(batch, name, measure, execution_date, srid)
+
+    written = 0
+    failed = 0
+    xs = batch.x.tolist()
+    ys = batch.y.tolist()
+    points_values = batch.value.tolist()
+    codes = batch.code.tolist() if batch.code is not None else None
+
+    for start in range(0, len(xs), batch_size):
+        end = start + batch_size
+        try:
+            with metrics.stage(name, "upsert"):
+                batch_written = upsert_points(
+                    cursor,
+                    table_name,
+                    xs[start:end],
+                    ys[start:end],
+                    points_values[start:end],
+                    name,
+                    measure,
+                    execution_date,
+                    srid,
+                    layout,
+                    codes[start:end] if codes is not None else None
+                )
+                conn.commit()
+            written += batch_written
+            metrics.count(name, "points_written", batch_written)
+            metrics.count(name, "batches_committed")
+        except Exception as e:
+            print(f"Erro ao inserir no PostGIS: {e}")
+            conn.rollback()
+            failed += len(xs[start:end])
+            metrics.count(name, "points_failed", len(xs[start:end]))
+            metrics.count(name, "batches_failed")
+
+    return written, failed
 
 def process_chunk(
         cursor,
@@ -40,7 +470,11 @@ def process_chunk(
         shp_table,
         sampling_stride = 10,
         batch_size=1000,
-        srid=4326
+        srid=4326,
+        clip_mask=None,
+        nodata=None,
+        layout="jsonb",
+        aggregation=None
 ):
     """
     Processa um bloco de dados raster e insere no banco de dados.
@@ -59,66 +493,61 @@ def process_chunk(
     :param sampling_stride: Passo de amostragem para os dados.
     :param batch_size: Tamanho do lote para inserção no banco de dados.
     :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param clip_mask: Máscara de recorte do raster. Se None, cada ponto é verificado no banco.
+    :param nodata: Valor declarado como nodata no raster (None se não houver).
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    :param aggregation: Método de agregação das células (ver `aggregate_block`), ou None para amostrar.
+    :return: Tupla (pontos gravados, pontos cujo lote falhou).
     """
 
-    # Inicializa variáveis
-    rows, cols = values.shape
-    inserts = []
-
-    for i in range(0, rows, sampling_stride):
-        for j in range(0, cols, sampling_stride):
-            x, y = transform * (j + window.col_off, i + window.row_off)
-            value = values[i, j]
-
-            if np.isnan(value) or value == -9999:
-                continue
-
-            if not is_point_in_polygon(cursor, x, y, shp_table):
-                continue
-
-            value = value * scale
-            doc_id = f"{x},{y}"
-            new_data = {
-                execution_date: {
-                    name: {
-                        "valor": float(value),
-                        "medida": measure
-                    }
-                }
-            }
-
-            inserts.append((doc_id, f"SRID=4326;POINT({x} {y})", json.dumps(new_data)))
-
-            if len(inserts) >= batch_size:
-                try:
-                    execute_batch(cursor, f"""
-                        INSERT INTO {table_name} (id, geom, raster)
-                        VALUES (%s, ST_GeomFromText(%s, {srid}), %s)
-                        ON CONFLICT (id) DO UPDATE SET
-                        raster = jsonb_strip_nulls(
-                            jsonb_deep_merge({table_name}.raster, EXCLUDED.raster)
-                        );
-                    """, inserts)
-                    conn.commit()
-                    inserts.clear()
-                except Exception as e:
-                    print(f"Erro ao inserir no PostGIS: {e}")
-                    conn.rollback()
-
-    if inserts:
-        try:
-            execute_batch(cursor, f"""
-                INSERT INTO {table_name} (id, geom, raster)
-                VALUES (%s, ST_GeomFromText(%s, {srid}), %s)
-                ON CONFLICT (id) DO UPDATE SET
-                raster = jsonb_strip_nulls(
-                    jsonb_deep_merge({table_name}.raster, EXCLUDED.raster)
-                );
-            """, inserts)
-            conn.commit()
-        except Exception as e:
-            print(f"Erro ao inserir final no PostGIS: {e}")
-            conn.rollback()
+    # Amostra (ou agrega) o bloco inteiro de uma vez
+    with metrics.stage(name, "sample"):
+        batch = reduce_block(values, transform, window, scale, sampling_stride, nodata, clip_mask, aggregation)
+    metrics.count(name, "points_sampled", len(batch.x))
+    check_cell_collisions(batch, name, srid)
+
+    # Sem máscara, os pontos são verificados no banco
+    if clip_mask is None:
+        with metrics.stage(name, "clip"):
+            sampled = len(batch.x)
+            batch = filter_batch_by_query(cursor, batch, shp_table, srid)
+        metrics.count(name, "points_clipped", sampled - len(batch.x))
+
+    return write_point_batch(
+        cursor, conn, table_name, batch, name, measure, execution_date, batch_size, srid, layout
+    )
+
+def pipeline_queue_size(raster_paths, max_memory_mb, default=8, sampling_stride=10, aggregation=None):
+    """
+    Calcula a capacidade das filas do pipeline para respeitar um teto de memória.
+
+    O teto é dividido entre as duas filas, considerando que cada item ocupa no
+    máximo a maior janela lida (ver `window_shape`): um bloco do arquivo na
+    amostragem ou uma janela de agregação, somada em todas as camadas lidas juntas.
+
+    :param raster_paths: Caminho do arquivo raster, ou lista com os caminhos das camadas lidas juntas.
+    :param max_memory_mb: Teto de memória, em MB, para os blocos em fila (None para usar o padrão).
+    :param default: Capacidade usada quando não há teto de memória.
+    :param sampling_stride: Passo de amostragem (lado das células agregadas).
+    :param aggregation: Método de agregação, ou None para amostrar.
+    :return: Capacidade de cada fila.
+    """
+
+    if not max_memory_mb:
+        return default
+
+    import rasterio
+
+    if isinstance(raster_paths, (str, os.PathLike)):
+        raster_paths = [raster_paths]
+
+    item_bytes = 0
+    for raster_path in raster_paths:
+        with rasterio.open(raster_path) as src:
+            height, width = window_shape(src, sampling_stride, aggregation)
+            item_bytes += height * width * np.dtype(src.dtypes[0]).itemsize
+
+    return max(1, int(max_memory_mb * 1024 * 1024) // (2 * item_bytes))
 
 def process_raster_in_chunks(
         name,
@@ -128,15 +557,34 @@ def process_raster_in_chunks(
         table_name,
         shp_table,
         execution_date,
-        conn,
-        cursor,
         sampling_stride=10,
         batch_size=1000,
-        srid=4326
+        srid=4326,
+        clip_mode="mask",
+        chunk_workers=8,
+        transform_workers=2,
+        queue_size=8,
+        max_memory_mb=None,
+        resume=False,
+        layout="jsonb",
+        aggregation=None,
+        roi=False
     ):
     """
     Processa um arquivo raster em blocos e insere os dados no banco de dados.
 
+    Os blocos passam por um pipeline com filas limitadas: uma thread lê os
+    blocos, `transform_workers` threads os amostram e recortam, e
+    `chunk_workers` threads gravam os pontos, cada uma com a sua conexão.
+
+    Cada janela cujos lotes foram todos confirmados é registrada em
+    `etl_checkpoint`; com `resume`, as janelas já registradas não são lidas.
+
+    Com `roi`, só são lidas as janelas que tocam a caixa envolvente de algum
+    polígono de referência. Com `aggregation`, cada célula de
+    `sampling_stride` x `sampling_stride` pixels vira um ponto com o resumo
+    dos seus pixels, em vez do valor do pixel amostrado.
+
     :param name: Nome do dado a ser inserido.
     :param raster_path: Caminho do arquivo raster.
     :param scale: Fator de escala para o valor.
@@ -144,40 +592,82 @@ def process_raster_in_chunks(
     :param table_name: Nome da tabela onde os dados serão inseridos.
     :param shp_table: Nome da tabela de polígonos para verificação espacial.
     :param execution_date: Data de execução para o registro.
-    :param conn: Conexão com o banco de dados.
-    :param cursor: Cursor do banco de dados.
     :param sampling_stride: Passo de amostragem para os dados.
     :param batch_size: Tamanho do lote para inserção no banco de dados.
     :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param clip_mode: "mask" para recortar com a máscara em memória ou "query" para consultar os pontos no banco, uma consulta por lote.
+    :param chunk_workers: Quantidade de threads que gravam os pontos, cada uma com sua conexão.
+    :param transform_workers: Quantidade de threads que amostram e recortam os blocos.
+    :param queue_size: Capacidade de cada fila do pipeline.
+    :param max_memory_mb: Teto de memória, em MB, para os blocos em fila. Se definido, substitui `queue_size`.
+    :param resume: Se True, pula as janelas já gravadas em uma execução anterior da mesma data.
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    :param aggregation: Método de agregação das células ("mean", "min", "max" ou "majority"), ou None para amostrar.
+    :param roi: Se True, lê apenas as janelas que tocam os polígonos de referência.
+    :return: Tupla (pontos gravados, pontos cujo lote falhou).
     """
 
+    # Verifica se o arquivo existe
+    if not os.path.exists(raster_path):
+        raise FileNotFoundError(f"Arquivo não encontrado: {raster_path}")
+
     print(f"Iniciando processamento de {name}...")
 
+    # Carrega os polígonos de referência uma única vez por arquivo
+    clip_mask = None
+    if clip_mode == "mask":
+        with metrics.stage(name, "clip_mask"), sinks.sink_connection() as (conn, cursor):
+            clip_mask = build_raster_clip_mask(conn, cursor, raster_path, shp_table)
+
+    # Janelas já gravadas, na retomada
+    skip_windows = prepare_checkpoints(table_name, name, execution_date, resume)
+
+    # Polígonos de referência, para ler só as janelas que os tocam
+    reference = load_roi(shp_table) if roi else None
+
+    def transform_block(block):
+        values, transform, window, nodata = block
+        with metrics.stage(name, "sample"):
+            batch = reduce_block(values, transform, window, scale, sampling_stride, nodata, clip_mask, aggregation)
+        metrics.count(name, "points_sampled", len(batch.x))
+        check_cell_collisions(batch, name, srid)
+
+        # Sem máscara, os pontos são verificados no banco
+        if clip_mask is None and len(batch.x):
+            sampled = len(batch.x)
+            with metrics.stage(name, "clip"), get_connection() as (conn, cursor):
+                batch = filter_batch_by_query(cursor, batch, shp_table, srid)
+            metrics.count(name, "points_clipped", sampled - len(batch.x))
+
+        return window, batch
 
+    totals = {"written": 0, "failed": 0}
+    totals_lock = threading.Lock()
 
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        futures = []
-        for values, transform, window in read_raster_in_blocks(raster_path):
-            future = executor.submit(
-                process_chunk,
-                cursor,
-                conn,
-                table_name,
-                values,
-                transform,
-                window,
-                name,
-                scale,
-                measure,
-                execution_date,
-                shp_table,
-                sampling_stride,
-                batch_size,
-                srid
+    def write_block(item):
+        window, batch = item
+        with sinks.sink_connection() as (conn, cursor):
+            written, failed = write_point_batch(
+                cursor, conn, table_name, batch, name, measure, execution_date, batch_size, srid, layout
             )
-            futures.append(future)
+            if not failed and sinks.uses_database():
+                with metrics.stage(name, "checkpoint"):
+                    mark_window_committed(
+                        conn, cursor, table_name, name, execution_date, window, {name: written}
+                    )
+        with totals_lock:
+            totals["written"] += written
+            totals["failed"] += failed
+        metrics.advance(name)
 
-        for future in futures:
-            future.result()
+    run_pipeline(
+        read_raster_in_blocks(raster_path, skip_windows, name, sampling_stride, aggregation, reference),
+        transform_block,
+        write_block,
+        transform_workers=transform_workers,
+        write_workers=chunk_workers,
+        queue_size=pipeline_queue_size(raster_path, max_memory_mb, queue_size, sampling_stride, aggregation)
+    )
 
     print(f"Finalizado processamento de {name}.")
+    return totals["written"], totals["failed"]
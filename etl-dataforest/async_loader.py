@@ -0,0 +1,263 @@
+import asyncio
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .asc_functions import reduce_block, raster_windows, load_roi, process_raster_in_chunks, check_cell_collisions
+from .bulk_loader import staging_columns, encode_rows, staging_table_name, staging_table_sql, apply_staging_sql, point_rows
+from .checkpoint import window_id, prepare_checkpoints
+from .clip_mask import build_raster_clip_mask
+from .connection_pool import get_connection, get_connection_settings
+from . import metrics
+
+
+async def mark_window_committed_async(conn, table_name, dataset, execution_date, window, row_counts=None):
+    """
+    Versão assíncrona de `checkpoint.mark_window_committed`, para conexões asyncpg.
+
+    :param conn: Conexão asyncpg.
+    :param table_name: Nome da tabela onde os dados são inseridos.
+    :param dataset: Nome do conjunto de dados.
+    :param execution_date: Data de execução da carga.
+    :param window: Janela do raster (rasterio.windows.Window).
+    :param row_counts: Dicionário {nome do dado: pontos gravados na janela}.
+    """
+
+    try:
+        await conn.execute("""
+            INSERT INTO etl_checkpoint (table_name, dataset, execution_date, window_id, row_counts)
+            VALUES ($1, $2, $3, $4, $5::jsonb)
+            ON CONFLICT DO NOTHING;
+        """, table_name, dataset, execution_date, window_id(window), json.dumps(row_counts or {}))
+    except Exception as e:
+        print(f"Erro ao registrar checkpoint de {dataset}: {e}")
+
+async def copy_batch(conn, table_name, encoded, srid=4326, layout="jsonb"):
+    """
+    Envia um lote já codificado em CSV com COPY e o aplica na tabela de destino,
+    em uma transação própria.
+
+    :param conn: Conexão asyncpg.
+    :param table_name: Nome da tabela (ou nome base das tabelas, no layout "narrow").
+    :param encoded: Bytes do lote em CSV (ver `encode_window`).
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    """
+
+    columns = staging_columns(layout)
+    staging_table = staging_table_name(layout)
+    async with conn.transaction():
+        await conn.execute(staging_table_sql(staging_table, columns))
+        await conn.copy_to_table(
+            staging_table,
+            source=io.BytesIO(encoded),
+            columns=[name for name, _ in columns],
+            format="csv"
+        )
+        await conn.execute(apply_staging_sql(table_name, staging_table, srid, layout))
+
+def process_raster_async(
+        name,
+        raster_path,
+        scale,
+        measure,
+        table_name,
+        shp_table,
+        execution_date,
+        sampling_stride=10,
+        batch_size=1000,
+        srid=4326,
+        clip_mode="mask",
+        connections=4,
+        decode_workers=2,
+        queue_size=8,
+        resume=False,
+        layout="jsonb",
+        aggregation=None,
+        roi=False
+    ):
+    """
+    Processa um arquivo raster com um laço asyncio: a leitura, a amostragem e a
+    montagem do CSV de cada janela rodam em threads, enquanto vários lotes são
+    enviados com COPY ao mesmo tempo em `connections` conexões asyncpg.
+
+    Assim o banco grava um lote enquanto as threads já decodificam os
+    próximos, e o tempo total se aproxima do maior entre leitura e escrita,
+    em vez da soma dos dois.
+
+    O recorte é feito com a máscara em memória; se ela não puder ser
+    construída, o arquivo é processado por `process_raster_in_chunks`.
+
+    :param name: Nome do dado a ser inserido.
+    :param raster_path: Caminho do arquivo raster.
+    :param scale: Fator de escala para o valor.
+    :param measure: Unidade de medida do dado.
+    :param table_name: Nome da tabela onde os dados serão inseridos.
+    :param shp_table: Nome da tabela de polígonos para verificação espacial.
+    :param execution_date: Data de execução para o registro.
+    :param sampling_stride: Passo de amostragem para os dados.
+    :param batch_size: Tamanho do lote para inserção no banco de dados.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param clip_mode: Modo de recorte; "query" usa `process_raster_in_chunks`.
+    :param connections: Quantidade de conexões asyncpg, isto é, de lotes enviados ao mesmo tempo.
+    :param decode_workers: Quantidade de threads que leem e codificam as janelas.
+    :param queue_size: Quantidade de janelas codificadas aguardando envio.
+    :param resume: Se True, pula as janelas já gravadas em uma execução anterior da mesma data.
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    :param aggregation: Método de agregação das células ("mean", "min", "max" ou "majority"), ou None para amostrar.
+    :param roi: Se True, lê apenas as janelas que tocam os polígonos de referência.
+    :return: Tupla (pontos gravados, pontos cujo lote falhou).
+    """
+
+    # Verifica se o arquivo existe
+    if not os.path.exists(raster_path):
+        raise FileNotFoundError(f"Arquivo não encontrado: {raster_path}")
+
+    import asyncpg
+    import rasterio
+
+    clip_mask = None
+    if clip_mode == "mask":
+        with metrics.stage(name, "clip_mask"), get_connection() as (conn, cursor):
+            clip_mask = build_raster_clip_mask(conn, cursor, raster_path, shp_table)
+
+    if clip_mask is None:
+        print(f"{name}: o modo async exige a máscara de recorte, usando o modo thread.")
+        return process_raster_in_chunks(
+            name, raster_path, scale, measure, table_name, shp_table, execution_date,
+            sampling_stride, batch_size, srid, clip_mode, connections,
+            transform_workers=decode_workers, queue_size=queue_size, resume=resume, layout=layout,
+            aggregation=aggregation, roi=roi
+        )
+
+    # Janelas já gravadas, na retomada
+    skip_windows = prepare_checkpoints(table_name, name, execution_date, resume)
+
+    reference = load_roi(shp_table) if roi else None
+    with rasterio.open(raster_path) as src:
+        windows = raster_windows(src, sampling_stride, aggregation, skip_windows, reference)
+    metrics.set_total(name, len(windows))
+
+    print(f"Iniciando processamento assíncrono de {name}...")
+
+    # Cada thread de decodificação mantém o seu próprio handle do raster
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def encode_window(window):
+        """
+        Lê, amostra e codifica em CSV uma janela, em partes de `batch_size` pontos.
+        """
+
+        src = getattr(local, "src", None)
+        if src is None:
+            src = local.src = rasterio.open(raster_path)
+            with handles_lock:
+                handles.append(src)
+
+        with metrics.stage(name, "read"):
+            values = src.read(1, window=window)
+        with metrics.stage(name, "sample"):
+            batch = reduce_block(
+                values, src.transform, window, scale, sampling_stride, src.nodata, clip_mask, aggregation
+            )
+        metrics.count(name, "points_sampled", len(batch.x))
+        check_cell_collisions(batch, name, srid)
+
+        xs = batch.x.tolist()
+        ys = batch.y.tolist()
+        points_values = batch.value.tolist()
+        codes = batch.code.tolist() if batch.code is not None else None
+        parts = []
+        with metrics.stage(name, "encode"):
+            for start in range(0, len(xs), batch_size):
+                end = start + batch_size
+                rows = point_rows(
+                    xs[start:end], ys[start:end], points_values[start:end],
+                    name, measure, execution_date, srid, layout,
+                    codes[start:end] if codes is not None else None
+                )
+                buffer, count = encode_rows(rows)
+                parts.append((buffer.getvalue().encode(), count))
+        return window, parts
+
+    settings = get_connection_settings()
+    executor = ThreadPoolExecutor(max_workers=decode_workers)
+    totals = {"written": 0, "failed": 0}
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        encoded_queue = asyncio.Queue(maxsize=queue_size)
+        decode_slots = asyncio.Semaphore(decode_workers)
+
+        async def decode(window):
+            try:
+                item = await loop.run_in_executor(executor, encode_window, window)
+                await encoded_queue.put(item)
+            finally:
+                decode_slots.release()
+
+        async def produce():
+            tasks = []
+            try:
+                for window in windows:
+                    await decode_slots.acquire()
+                    tasks.append(asyncio.create_task(decode(window)))
+                await asyncio.gather(*tasks)
+            finally:
+                for _ in range(connections):
+                    await encoded_queue.put(None)
+
+        async def consume(pool):
+            while True:
+                item = await encoded_queue.get()
+                if item is None:
+                    return
+                window, parts = item
+                window_written = 0
+                window_failed = 0
+                async with pool.acquire() as conn:
+                    for encoded, count in parts:
+                        try:
+                            with metrics.stage(name, "upsert"):
+                                await copy_batch(conn, table_name, encoded, srid, layout)
+                            totals["written"] += count
+                            window_written += count
+                            metrics.count(name, "points_written", count)
+                            metrics.count(name, "batches_committed")
+                        except Exception as e:
+                            print(f"Erro ao inserir no PostGIS: {e}")
+                            window_failed += count
+                            metrics.count(name, "points_failed", count)
+                            metrics.count(name, "batches_failed")
+
+                    if not window_failed:
+                        with metrics.stage(name, "checkpoint"):
+                            await mark_window_committed_async(
+                                conn, table_name, name, execution_date, window, {name: window_written}
+                            )
+                totals["failed"] += window_failed
+                metrics.advance(name)
+
+        async with asyncpg.create_pool(
+            min_size=connections,
+            max_size=connections,
+            database=settings["dbname"],
+            user=settings["user"],
+            password=settings["password"],
+            host=settings["host"],
+            port=int(settings["port"])
+        ) as pool:
+            await asyncio.gather(produce(), *(consume(pool) for _ in range(connections)))
+
+    try:
+        asyncio.run(run())
+    finally:
+        executor.shutdown()
+        for src in handles:
+            src.close()
+
+    print(f"Finalizado processamento de {name}.")
+    return totals["written"], totals["failed"]
@@ -0,0 +1,84 @@
+import argparse
+import os
+import time
+import numpy as np
+import psycopg2
+import rasterio
+from dotenv import load_dotenv
+from ..clip_mask import load_reference_shapes, build_clip_mask
+from ..verify_point_locale import is_point_in_polygon
+
+
+def sample_points(src, sampling_stride, max_points):
+    """
+    Seleciona os pixels amostrados do raster, na mesma grade de `sample_block`.
+
+    :param src: Raster aberto com rasterio.
+    :param sampling_stride: Passo de amostragem para os dados.
+    :param max_points: Quantidade máxima de pontos retornados.
+    :return: Lista de tuplas (linha, coluna, x, y).
+    """
+
+    points = []
+    for row in range(0, src.height, sampling_stride):
+        for col in range(0, src.width, sampling_stride):
+            x, y = src.transform * (col, row)
+            points.append((row, col, x, y))
+            if len(points) >= max_points:
+                return points
+    return points
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compara a máscara de recorte com a consulta ponto a ponto no PostGIS."
+    )
+    parser.add_argument("raster_path", help="Caminho do arquivo .asc.")
+    parser.add_argument("--table", default=os.getenv("SHP_TABLE_NAME", "brasil"))
+    parser.add_argument("--stride", type=int, default=10)
+    parser.add_argument("--max-points", type=int, default=5000)
+    parser.add_argument("--srid", type=int, default=4326)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        dbname=os.getenv("EXTERNAL_DB_NAME", "reflorestamento"),
+        user=os.getenv("EXTERNAL_DB_USER", "dataforest"),
+        password=os.getenv("EXTERNAL_DB_PASSWORD", "dataforest"),
+        host=os.getenv("EXTERNAL_DB_HOST", "localhost"),
+        port=os.getenv("EXTERNAL_DB_PORT", "5432")
+    )
+    cursor = conn.cursor()
+
+    with rasterio.open(args.raster_path) as src:
+        points = sample_points(src, args.stride, args.max_points)
+
+        # Consulta ponto a ponto
+        start = time.perf_counter()
+        query_result = [
+            bool(is_point_in_polygon(cursor, x, y, args.table, args.srid))
+            for _, _, x, y in points
+        ]
+        query_time = time.perf_counter() - start
+
+        # Máscara em memória
+        start = time.perf_counter()
+        shapes = load_reference_shapes(cursor, args.table)
+        clip_mask = build_clip_mask(shapes, (src.height, src.width), src.transform)
+        rows = np.array([p[0] for p in points])
+        cols = np.array([p[1] for p in points])
+        mask_result = clip_mask[rows, cols].tolist()
+        mask_time = time.perf_counter() - start
+
+    divergent = sum(1 for a, b in zip(query_result, mask_result) if a != b)
+
+    print(f"Pontos comparados: {len(points)}")
+    print(f"Consulta por ponto: {query_time:.3f}s ({len(points) / query_time:.0f} pontos/s)")
+    print(f"Máscara (carga + rasterização + filtro): {mask_time:.3f}s")
+    print(f"Aceleração: {query_time / mask_time:.1f}x")
+    print(f"Pontos divergentes: {divergent}")
+
+    cursor.close()
+    conn.close()
+
+if __name__ == "__main__":
+    load_dotenv()
+    main()
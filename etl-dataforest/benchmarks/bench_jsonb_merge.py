@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import time
+from datetime import date, timedelta
+import psycopg2
+from dotenv import load_dotenv
+
+
+def build_documents(dates, datasets):
+    """
+    Monta o documento acumulado de um ponto e o documento de uma nova carga.
+
+    :param dates: Quantidade de datas de execução já acumuladas no ponto.
+    :param datasets: Quantidade de dados por data.
+    :return: Tupla (documento acumulado, documento da nova carga), em JSON.
+    """
+
+    start = date(2024, 1, 1)
+    accumulated = {
+        (start + timedelta(days=day)).isoformat(): {
+            f"dado_{i}": {"valor": day * 0.5 + i, "medida": "mm"}
+            for i in range(datasets)
+        }
+        for day in range(dates)
+    }
+
+    # A nova carga traz um dado de uma data já existente e uma data nova
+    last_date = (start + timedelta(days=dates - 1)).isoformat()
+    new_date = (start + timedelta(days=dates)).isoformat()
+    incoming = {
+        last_date: {"dado_0": {"valor": -1.0, "medida": "mm"}},
+        new_date: {"dado_0": {"valor": 1.0, "medida": "mm"}},
+    }
+    return json.dumps(accumulated), json.dumps(incoming)
+
+def time_merge(cursor, function, repeat):
+    """
+    Mede o tempo de mesclagem de todas as linhas da tabela de teste.
+
+    :param cursor: Cursor do banco de dados.
+    :param function: Nome da função de mesclagem.
+    :param repeat: Quantidade de repetições; o menor tempo é retornado.
+    :return: Tempo em segundos.
+    """
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(f"SELECT count({function}(a, b)) FROM bench_jsonb_merge")
+        cursor.fetchone()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compara o jsonb_deep_merge atual com a versão recursiva legada."
+    )
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--datasets", type=int, default=7)
+    parser.add_argument("--dates", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        dbname=os.getenv("EXTERNAL_DB_NAME", "reflorestamento"),
+        user=os.getenv("EXTERNAL_DB_USER", "dataforest"),
+        password=os.getenv("EXTERNAL_DB_PASSWORD", "dataforest"),
+        host=os.getenv("EXTERNAL_DB_HOST", "localhost"),
+        port=os.getenv("EXTERNAL_DB_PORT", "5432")
+    )
+    cursor = conn.cursor()
+
+    for dates in args.dates:
+        accumulated, incoming = build_documents(dates, args.datasets)
+        cursor.execute("DROP TABLE IF EXISTS bench_jsonb_merge")
+        cursor.execute("""
+            CREATE TEMP TABLE bench_jsonb_merge AS
+            SELECT %s::jsonb AS a, %s::jsonb AS b
+            FROM generate_series(1, %s)
+        """, (accumulated, incoming, args.rows))
+
+        # Casos de borda: lados nulos, vazios e valores que não são objetos
+        cursor.execute("""
+            INSERT INTO bench_jsonb_merge (a, b) VALUES
+                (NULL, %s::jsonb),
+                (%s::jsonb, NULL),
+                ('{}', '{}'),
+                ('{"x": {}}', '{"x": {}}'),
+                ('{"x": 1}', '{"x": {"y": 2}}'),
+                ('{"x": {"y": 2}}', '{"x": null}')
+        """, (incoming, accumulated))
+
+        cursor.execute("""
+            SELECT count(*)
+            FROM bench_jsonb_merge
+            WHERE jsonb_deep_merge(a, b) IS DISTINCT FROM jsonb_deep_merge_legado(a, b)
+        """)
+        divergent = cursor.fetchone()[0]
+
+        legacy_time = time_merge(cursor, "jsonb_deep_merge_legado", args.repeat)
+        current_time = time_merge(cursor, "jsonb_deep_merge", args.repeat)
+
+        print(f"Datas acumuladas: {dates}")
+        print(f"  Legado: {legacy_time / args.rows * 1e6:.1f} µs/linha")
+        print(f"  Atual: {current_time / args.rows * 1e6:.1f} µs/linha")
+        print(f"  Aceleração: {legacy_time / current_time:.1f}x")
+        print(f"  Linhas divergentes: {divergent}")
+
+    conn.rollback()
+    cursor.close()
+    conn.close()
+
+if __name__ == "__main__":
+    load_dotenv()
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import os
+import random
+import statistics
+import time
+import psycopg2
+from dotenv import load_dotenv
+from ..verify_point_locale import containment_sql
+
+
+def random_points(cursor, table, count, seed):
+    """
+    Sorteia pontos dentro da caixa envolvente dos polígonos de referência.
+
+    :param cursor: Cursor do banco de dados.
+    :param table: Nome da tabela com os polígonos de referência.
+    :param count: Quantidade de pontos.
+    :param seed: Semente do gerador aleatório.
+    :return: Lista de tuplas (x, y).
+    """
+
+    cursor.execute(f"""
+        SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e)
+        FROM (SELECT ST_Extent(geom) AS e FROM {table}) AS extent
+    """)
+    xmin, ymin, xmax, ymax = cursor.fetchone()
+    rng = random.Random(seed)
+    return [(rng.uniform(xmin, xmax), rng.uniform(ymin, ymax)) for _ in range(count)]
+
+def time_containment(cursor, query, points, srid):
+    """
+    Executa a consulta de verificação para cada ponto e mede a latência.
+
+    :param cursor: Cursor do banco de dados.
+    :param query: Consulta com os parâmetros (x, y, srid).
+    :param points: Lista de tuplas (x, y).
+    :param srid: SRID do sistema de referência espacial.
+    :return: Tupla (resultados, latências em milissegundos).
+    """
+
+    results = []
+    latencies = []
+    for x, y in points:
+        start = time.perf_counter()
+        cursor.execute(query, (x, y, srid))
+        results.append(cursor.fetchone()[0])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, latencies
+
+def report(label, latencies):
+    """
+    Imprime a média, a mediana e o percentil 95 das latências.
+
+    :param label: Descrição da consulta.
+    :param latencies: Latências em milissegundos.
+    """
+
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0
+    print(f"{label}: média {statistics.mean(latencies):.3f} ms, mediana {statistics.median(latencies):.3f} ms, p95 {p95:.3f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compara a latência da verificação de ponto no polígono na tabela original e na subdividida."
+    )
+    parser.add_argument("--table", default=os.getenv("SH_TABLE_NAME", "brasil"))
+    parser.add_argument("--points", type=int, default=2000)
+    parser.add_argument("--srid", type=int, default=4326)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        dbname=os.getenv("EXTERNAL_DB_NAME", "reflorestamento"),
+        user=os.getenv("EXTERNAL_DB_USER", "dataforest"),
+        password=os.getenv("EXTERNAL_DB_PASSWORD", "dataforest"),
+        host=os.getenv("EXTERNAL_DB_HOST", "localhost"),
+        port=os.getenv("EXTERNAL_DB_PORT", "5432")
+    )
+    cursor = conn.cursor()
+
+    points = random_points(cursor, args.table, args.points, args.seed)
+
+    original_results, original_latencies = time_containment(cursor, f"""
+        SELECT EXISTS (
+            SELECT 1 FROM {args.table}
+            WHERE ST_Contains(geom, ST_SetSRID(ST_MakePoint(%s, %s), %s))
+        )
+    """, points, args.srid)
+
+    source, condition = containment_sql(args.table, "pt.geom")
+    subdivided_results, subdivided_latencies = time_containment(cursor, f"""
+        SELECT EXISTS (
+            SELECT 1
+            FROM (SELECT ST_SetSRID(ST_MakePoint(%s, %s), %s) AS geom) pt, {source}
+            WHERE {condition}
+        )
+    """, points, args.srid)
+
+    divergent = sum(1 for a, b in zip(original_results, subdivided_results) if a != b)
+
+    print(f"Pontos consultados: {len(points)}")
+    report("Tabela original (ST_Contains)", original_latencies)
+    report("Tabela subdividida (filtro das partes + ST_Contains)", subdivided_latencies)
+    print(f"Aceleração: {sum(original_latencies) / sum(subdivided_latencies):.1f}x")
+    print(f"Pontos divergentes: {divergent}")
+
+    cursor.close()
+    conn.close()
+
+if __name__ == "__main__":
+    load_dotenv()
+    main()
@@ -0,0 +1,479 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+import geopandas as gpd
+import numpy as np
+import rasterio
+import shapely
+from dotenv import load_dotenv
+from .synthetic import write_ascii_grid, write_boundary_shapefile, grid_bounds
+from .. import metrics
+from .. import sinks
+from ..asc_functions import sample_block, process_chunk
+from ..bulk_loader import upsert_points
+from ..checkpoint import create_checkpoint_table
+from ..clip_mask import build_clip_mask, build_raster_clip_mask
+from ..connection_pool import init_pool, get_connection, close_pool
+from ..create_table import create_table, create_index, create_jsonb_merge_function, create_subdivided_table
+from ..manifest import create_manifest_table
+from ..raster_process_pool import shutdown_process_executor
+from ..reference_cache import init_reference_cache, get_reference_index, points_in_reference, export_reference_shapefile
+from ..send_shp_files_to_postgis import send_shp_files_to_postgis
+from ..verify_file_type import verify_file_type
+from ..verify_point_locale import is_point_in_polygon, points_in_polygon
+
+
+# Arquivo padrão dos resultados, um JSON por linha
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+# Tabelas descartáveis usadas pelos benchmarks com banco
+BENCH_TABLE = "bench_dados"
+BENCH_SHP_TABLE = "bench_limites"
+
+DB_FREE_BENCHMARKS = ("sample_block", "clip_mask", "reference_strtree", "full_null", "full_geoparquet")
+DB_BENCHMARKS = ("process_chunk", "is_point_in_polygon", "points_in_polygon", "upsert", "jsonb_merge", "full")
+
+
+def git_commit():
+    """
+    Identifica o commit atual do repositório.
+
+    :return: Tupla (hash do commit, True se há alterações não commitadas), ou (None, None) fora de um repositório git.
+    """
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        return commit, bool(status)
+    except Exception:
+        return None, None
+
+def peak_rss_mb():
+    """
+    Retorna o pico de memória residente deste processo e do maior processo filho, em MB.
+
+    O pico é acumulado desde o início do processo, então cada resultado reflete
+    também os benchmarks executados antes dele.
+    """
+
+    # No Linux ru_maxrss é medido em KB
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return round(own, 1), round(children, 1)
+
+def record(results_path, benchmark, params, seconds, points):
+    """
+    Registra o resultado de um benchmark no arquivo de resultados e o imprime.
+
+    :param results_path: Caminho do arquivo de resultados (JSON por linha).
+    :param benchmark: Nome do benchmark.
+    :param params: Parâmetros da execução.
+    :param seconds: Tempo gasto, em segundos.
+    :param points: Quantidade de pontos processados.
+    :return: Resultado registrado.
+    """
+
+    commit, dirty = git_commit()
+    own_rss, children_rss = peak_rss_mb()
+    result = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "dirty": dirty,
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "benchmark": benchmark,
+        "params": params,
+        "seconds": round(seconds, 4),
+        "points": int(points),
+        "points_per_s": round(points / seconds, 1) if seconds > 0 else None,
+        "peak_rss_mb": own_rss,
+        "peak_rss_children_mb": children_rss,
+    }
+
+    with open(results_path, "a") as file:
+        file.write(json.dumps(result) + "\n")
+
+    print(
+        f"{benchmark:<20} {seconds:>9.3f}s {int(points):>10} pontos "
+        f"{result['points_per_s'] or 0:>12.0f} pontos/s  pico {own_rss:.0f} MB"
+    )
+    return result
+
+def sample_points(raster_path, sampling_stride):
+    """
+    Amostra todos os blocos do raster, sem recorte.
+
+    :return: Tupla (x, y) com as coordenadas de todos os pontos válidos.
+    """
+
+    xs = []
+    ys = []
+    with rasterio.open(raster_path) as src:
+        for _, window in src.block_windows(1):
+            values = src.read(1, window=window)
+            batch = sample_block(values, src.transform, window, 1, sampling_stride, src.nodata)
+            xs.append(batch.x)
+            ys.append(batch.y)
+    return np.concatenate(xs), np.concatenate(ys)
+
+def bench_sample_block(raster_path, sampling_stride):
+    """
+    Amostragem vetorizada de todos os blocos, sem banco.
+
+    :return: Tupla (segundos, pontos).
+    """
+
+    points = 0
+    start = time.perf_counter()
+    with rasterio.open(raster_path) as src:
+        for _, window in src.block_windows(1):
+            values = src.read(1, window=window)
+            points += len(sample_block(values, src.transform, window, 1, sampling_stride, src.nodata).x)
+    return time.perf_counter() - start, points
+
+def bench_clip_mask(raster_path, shp_path):
+    """
+    Leitura do contorno e rasterização da máscara de recorte de toda a grade.
+
+    :return: Tupla (segundos, pontos).
+    """
+
+    start = time.perf_counter()
+    shapes = gpd.read_file(shp_path).geometry.to_numpy()
+    with rasterio.open(raster_path) as src:
+        clip_mask = build_clip_mask(shapes, (src.height, src.width), src.transform)
+    return time.perf_counter() - start, clip_mask.size
+
+def bench_reference_strtree(shp_path, xs, ys):
+    """
+    Construção do STRtree do contorno e verificação de todos os pontos amostrados.
+
+    :return: Tupla (segundos, pontos).
+    """
+
+    start = time.perf_counter()
+    geometries = gpd.read_file(shp_path).geometry.to_numpy()
+    shapely.prepare(geometries)
+    reference = (geometries, shapely.STRtree(geometries))
+    points_in_reference(xs, ys, reference)
+    return time.perf_counter() - start, len(xs)
+
+def bench_process_chunk(raster_path, sampling_stride, batch_size, execution_date):
+    """
+    `process_chunk` em todos os blocos, com a máscara de recorte, em uma conexão.
+
+    :return: Tupla (segundos, pontos).
+    """
+
+    points = 0
+    with get_connection() as (conn, cursor):
+        clip_mask = build_raster_clip_mask(conn, cursor, raster_path, BENCH_SHP_TABLE)
+        start = time.perf_counter()
+        with rasterio.open(raster_path) as src:
+            for _, window in src.block_windows(1):
+                values = src.read(1, window=window)
+                written, _ = process_chunk(
+                    cursor, conn, BENCH_TABLE, values, src.transform, window, "bench_chunk", 1, "un",
+                    execution_date, BENCH_SHP_TABLE, sampling_stride, batch_size, 4326, clip_mask, src.nodata
+                )
+                points += written
+    return time.perf_counter() - start, points
+
+def bench_is_point_in_polygon(xs, ys):
+    """
+    Uma consulta `is_point_in_polygon` por ponto.
+
+    :return: Tupla (segundos, pontos).
+    """
+
+    with get_connection() as (conn, cursor):
+        start = time.perf_counter()
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            is_point_in_polygon(cursor, x, y, BENCH_SHP_TABLE)
+    return time.perf_counter() - start, len(xs)
+
+def bench_points_in_polygon(xs, ys):
+    """
+    Os mesmos pontos verificados em lote com `points_in_polygon`.
+
+    :return: Tupla (segundos, pontos).
+    """
+
+    with get_connection() as (conn, cursor):
+        start = time.perf_counter()
+        points_in_polygon(cursor, xs, ys, BENCH_SHP_TABLE)
+    return time.perf_counter() - start, len(xs)
+
+def bench_upsert(xs, ys, batch_size, execution_date, name="bench_upsert"):
+    """
+    Upsert dos pontos em lotes de `batch_size`, confirmando cada lote.
+
+    :return: Tupla (segundos, pontos).
+    """
+
+    values = np.arange(len(xs), dtype=np.float64).tolist()
+    xs = xs.tolist()
+    ys = ys.tolist()
+    with get_connection() as (conn, cursor):
+        start = time.perf_counter()
+        for offset in range(0, len(xs), batch_size):
+            end = offset + batch_size
+            upsert_points(
+                cursor, BENCH_TABLE, xs[offset:end], ys[offset:end], values[offset:end], name, "un", execution_date
+            )
+            conn.commit()
+    return time.perf_counter() - start, len(xs)
+
+def bench_jsonb_merge(xs, ys, batch_size, dates):
+    """
+    Acumula `dates` datas nos mesmos pontos e mede o upsert da data seguinte,
+    em que todo ponto passa pelo `jsonb_deep_merge`.
+
+    :return: Tupla (segundos, pontos).
+    """
+
+    for day in range(dates):
+        bench_upsert(xs, ys, batch_size, f"2000-01-{day + 1:02d}", "bench_merge")
+    return bench_upsert(xs, ys, batch_size, f"2000-02-{dates % 28 + 1:02d}", "bench_merge")
+
+def bench_full(asc_path, sampling_stride, batch_size, execution_mode, chunk_workers):
+    """
+    Executa o caminho completo de `verify_file_type` para o ASC sintético.
+
+    :return: Tupla (segundos, pontos gravados segundo as métricas).
+    """
+
+    metrics.init_metrics(True)
+    value = {"path": asc_path, "escala": 1, "medida": "un"}
+    start = time.perf_counter()
+    verify_file_type(
+        "bench_full",
+        value,
+        datetime.now().strftime("%Y-%m-%d"),
+        BENCH_TABLE,
+        BENCH_SHP_TABLE,
+        sampling_stride,
+        batch_size,
+        4326,
+        "mask",
+        chunk_workers,
+        execution_mode,
+        force=True
+    )
+    seconds = time.perf_counter() - start
+    shutdown_process_executor()
+    points = metrics.run_report()["totals"].get("points_written", 0)
+    metrics.init_metrics(False)
+    return seconds, points
+
+def bench_full_sink(asc_path, shp_path, workdir, sink, sampling_stride, batch_size, execution_mode, chunk_workers):
+    """
+    Executa o caminho completo de `verify_file_type` sem banco, com o destino
+    "null" (apenas conta os pontos) ou "geoparquet".
+
+    :return: Tupla (segundos, pontos gravados segundo as métricas).
+    """
+
+    init_reference_cache(os.path.join(workdir, "reference"))
+    export_reference_shapefile(BENCH_SHP_TABLE, shp_path)
+    sinks.init_sink(sink, os.path.join(workdir, "geoparquet"))
+    try:
+        metrics.init_metrics(True)
+        value = {"path": asc_path, "escala": 1, "medida": "un"}
+        start = time.perf_counter()
+        verify_file_type(
+            f"bench_full_{sink}",
+            value,
+            datetime.now().strftime("%Y-%m-%d"),
+            BENCH_TABLE,
+            BENCH_SHP_TABLE,
+            sampling_stride,
+            batch_size,
+            4326,
+            "mask",
+            chunk_workers,
+            execution_mode
+        )
+        sinks.flush_sink()
+        seconds = time.perf_counter() - start
+        shutdown_process_executor()
+        points = metrics.run_report()["totals"].get("points_written", 0)
+        metrics.init_metrics(False)
+    finally:
+        sinks.init_sink("postgis")
+    return seconds, points
+
+def setup_database(shp_path):
+    """
+    Cria as tabelas descartáveis dos benchmarks e carrega o contorno sintético.
+    """
+
+    with get_connection() as (conn, cursor):
+        create_table(conn, cursor, BENCH_TABLE)
+        create_index(conn, cursor, BENCH_TABLE)
+        create_jsonb_merge_function(conn, cursor)
+        create_manifest_table(conn, cursor)
+        create_checkpoint_table(conn, cursor)
+        cursor.execute(f"TRUNCATE {BENCH_TABLE}")
+        conn.commit()
+        send_shp_files_to_postgis(conn, cursor, shp_path, BENCH_SHP_TABLE)
+        create_subdivided_table(conn, cursor, BENCH_SHP_TABLE, rebuild=True)
+
+def teardown_database():
+    """
+    Remove as tabelas e os registros de manifesto e checkpoints dos benchmarks.
+    """
+
+    with get_connection() as (conn, cursor):
+        cursor.execute(f"""
+            DROP TABLE IF EXISTS {BENCH_TABLE};
+            DROP TABLE IF EXISTS {BENCH_SHP_TABLE}_subdividida;
+            DROP TABLE IF EXISTS {BENCH_SHP_TABLE};
+            DELETE FROM etl_manifest WHERE table_name = %s;
+            DELETE FROM etl_checkpoint WHERE table_name = %s;
+        """, (BENCH_TABLE, BENCH_TABLE))
+        conn.commit()
+
+def compare_results(results_path, last=10):
+    """
+    Imprime a evolução de cada benchmark entre commits, a partir do arquivo de resultados.
+
+    :param results_path: Caminho do arquivo de resultados.
+    :param last: Quantidade de resultados mais recentes exibidos por benchmark.
+    """
+
+    by_benchmark = {}
+    with open(results_path, "r") as file:
+        for line in file:
+            if line.strip():
+                result = json.loads(line)
+                by_benchmark.setdefault(result["benchmark"], []).append(result)
+
+    for benchmark, results in by_benchmark.items():
+        print(benchmark)
+        for result in results[-last:]:
+            commit = (result["commit"] or "?")[:10] + ("*" if result["dirty"] else "")
+            print(
+                f"  {result['timestamp'][:19]}  {commit:<11} {result['points_per_s'] or 0:>12.0f} pontos/s"
+                f"  pico {result['peak_rss_mb']:.0f} MB  {json.dumps(result['params'], sort_keys=True)}"
+            )
+
+def main(argv=None):
+    """
+    Executa a suíte de benchmarks.
+
+    :param argv: Argumentos da linha de comando (default é sys.argv).
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Executa os benchmarks com dados sintéticos e registra os resultados por commit."
+    )
+    parser.add_argument("--rows", type=int, default=2000, help="Linhas da grade ASC sintética.")
+    parser.add_argument("--cols", type=int, default=2000, help="Colunas da grade ASC sintética.")
+    parser.add_argument("--nodata-fraction", type=float, default=0.1)
+    parser.add_argument("--vertices", type=int, default=5000, help="Vértices do contorno sintético.")
+    parser.add_argument("--stride", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--query-points", type=int, default=2000, help="Pontos das verificações de ponto no polígono.")
+    parser.add_argument("--merge-dates", type=int, default=10, help="Datas acumuladas antes do upsert medido em jsonb_merge.")
+    parser.add_argument("--mode", choices=["thread", "process", "async"], default="thread")
+    parser.add_argument("--chunk-workers", type=int, default=4)
+    parser.add_argument("--no-db", action="store_true", help="Executa apenas os benchmarks que não usam o banco.")
+    parser.add_argument("--only", nargs="+", choices=DB_FREE_BENCHMARKS + DB_BENCHMARKS)
+    parser.add_argument("--workdir", default=None, help="Diretório dos dados sintéticos (default é um diretório temporário).")
+    parser.add_argument("--results", default=RESULTS_PATH)
+    parser.add_argument("--keep", action="store_true", help="Mantém as tabelas dos benchmarks no banco.")
+    parser.add_argument("--compare", action="store_true", help="Apenas imprime a comparação dos resultados registrados.")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare_results(args.results)
+        return
+
+    selected = args.only or (DB_FREE_BENCHMARKS if args.no_db else DB_FREE_BENCHMARKS + DB_BENCHMARKS)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="etl-bench-")
+    params = {
+        "rows": args.rows,
+        "cols": args.cols,
+        "nodata_fraction": args.nodata_fraction,
+        "vertices": args.vertices,
+        "stride": args.stride,
+        "batch_size": args.batch_size,
+    }
+
+    print(f"Gerando dados sintéticos em {workdir}...")
+    asc_path = write_ascii_grid(
+        os.path.join(workdir, "grade.asc"), args.rows, args.cols, nodata_fraction=args.nodata_fraction
+    )
+    shp_path = write_boundary_shapefile(
+        os.path.join(workdir, "contorno.shp"), grid_bounds(args.rows, args.cols), args.vertices
+    )
+    xs, ys = sample_points(asc_path, args.stride)
+    rng = np.random.default_rng(42)
+    query_index = rng.choice(len(xs), size=min(args.query_points, len(xs)), replace=False)
+    query_xs, query_ys = xs[query_index], ys[query_index]
+
+    if "sample_block" in selected:
+        record(args.results, "sample_block", params, *bench_sample_block(asc_path, args.stride))
+    if "clip_mask" in selected:
+        record(args.results, "clip_mask", params, *bench_clip_mask(asc_path, shp_path))
+    if "reference_strtree" in selected:
+        record(args.results, "reference_strtree", params, *bench_reference_strtree(shp_path, xs, ys))
+    for sink in ("null", "geoparquet"):
+        if f"full_{sink}" in selected:
+            record(args.results, f"full_{sink}", {**params, "mode": args.mode}, *bench_full_sink(
+                asc_path, shp_path, workdir, sink, args.stride, args.batch_size, args.mode, args.chunk_workers
+            ))
+
+    if not any(name in DB_BENCHMARKS for name in selected):
+        return
+
+    init_pool(
+        args.chunk_workers + 2,
+        dbname=os.getenv("BENCH_DB_NAME", os.getenv("EXTERNAL_DB_NAME", "reflorestamento")),
+        user=os.getenv("BENCH_DB_USER", os.getenv("EXTERNAL_DB_USER", "dataforest")),
+        password=os.getenv("BENCH_DB_PASSWORD", os.getenv("EXTERNAL_DB_PASSWORD", "dataforest")),
+        host=os.getenv("BENCH_DB_HOST", os.getenv("EXTERNAL_DB_HOST", "localhost")),
+        port=os.getenv("BENCH_DB_PORT", os.getenv("EXTERNAL_DB_PORT", "5432"))
+    )
+    init_reference_cache(None)
+
+    try:
+        setup_database(shp_path)
+        with get_connection() as (conn, cursor):
+            get_reference_index(cursor, BENCH_SHP_TABLE)
+
+        execution_date = "2000-01-01"
+        if "process_chunk" in selected:
+            record(args.results, "process_chunk", params,
+                   *bench_process_chunk(asc_path, args.stride, args.batch_size, execution_date))
+        if "is_point_in_polygon" in selected:
+            record(args.results, "is_point_in_polygon", params, *bench_is_point_in_polygon(query_xs, query_ys))
+        if "points_in_polygon" in selected:
+            record(args.results, "points_in_polygon", params, *bench_points_in_polygon(query_xs, query_ys))
+        if "upsert" in selected:
+            record(args.results, "upsert", params, *bench_upsert(xs, ys, args.batch_size, execution_date))
+        if "jsonb_merge" in selected:
+            record(args.results, "jsonb_merge", {**params, "dates": args.merge_dates},
+                   *bench_jsonb_merge(query_xs, query_ys, args.batch_size, args.merge_dates))
+        if "full" in selected:
+            record(args.results, "full", {**params, "mode": args.mode},
+                   *bench_full(asc_path, args.stride, args.batch_size, args.mode, args.chunk_workers))
+    finally:
+        if not args.keep:
+            teardown_database()
+        close_pool()
+
+if __name__ == "__main__":
+    load_dotenv()
+    main()
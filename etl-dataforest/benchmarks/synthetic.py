@@ -0,0 +1,111 @@
+import os
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import Polygon
+
+
+# Quantidade de linhas geradas e gravadas de cada vez no arquivo ASC
+ROWS_PER_WRITE = 256
+
+
+def write_ascii_grid(
+        path,
+        rows,
+        cols,
+        cellsize=0.01,
+        xllcorner=-74.0,
+        yllcorner=-34.0,
+        nodata_fraction=0.1,
+        nodata_value=-9999,
+        seed=42
+):
+    """
+    Gera um arquivo ESRI ASCII grid sintético.
+
+    Os valores formam um campo suave (soma de senos) com ruído, e uma fração
+    dos pixels é marcada como nodata. A grade é escrita em faixas, então
+    arquivos grandes não precisam caber em memória.
+
+    :param path: Caminho do arquivo .asc a criar.
+    :param rows: Quantidade de linhas.
+    :param cols: Quantidade de colunas.
+    :param cellsize: Tamanho do pixel, em graus.
+    :param xllcorner: Longitude do canto inferior esquerdo.
+    :param yllcorner: Latitude do canto inferior esquerdo.
+    :param nodata_fraction: Fração dos pixels com nodata (entre 0 e 1).
+    :param nodata_value: Valor de nodata.
+    :param seed: Semente do gerador aleatório.
+    :return: Caminho do arquivo criado.
+    """
+
+    rng = np.random.default_rng(seed)
+    col_phase = np.sin(np.arange(cols) / max(cols, 1) * 4 * np.pi)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(f"ncols {cols}\n")
+        file.write(f"nrows {rows}\n")
+        file.write(f"xllcorner {xllcorner}\n")
+        file.write(f"yllcorner {yllcorner}\n")
+        file.write(f"cellsize {cellsize}\n")
+        file.write(f"NODATA_value {nodata_value}\n")
+
+        for start in range(0, rows, ROWS_PER_WRITE):
+            end = min(start + ROWS_PER_WRITE, rows)
+            row_phase = np.cos(np.arange(start, end) / max(rows, 1) * 3 * np.pi)
+            values = 100 + 50 * (row_phase[:, None] + col_phase[None, :])
+            values += rng.normal(0, 5, values.shape)
+            values[rng.random(values.shape) < nodata_fraction] = nodata_value
+            np.savetxt(file, values, fmt="%.3f")
+
+    return path
+
+def grid_bounds(rows, cols, cellsize=0.01, xllcorner=-74.0, yllcorner=-34.0):
+    """
+    Calcula a extensão de uma grade gerada por `write_ascii_grid`.
+
+    :return: Tupla (xmin, ymin, xmax, ymax).
+    """
+
+    return xllcorner, yllcorner, xllcorner + cols * cellsize, yllcorner + rows * cellsize
+
+def write_boundary_shapefile(path, bounds, vertices=5000, parts=1, srid=4326, seed=42):
+    """
+    Gera um shapefile sintético de polígonos de contorno, no estilo do contorno do Brasil.
+
+    Cada parte é um polígono estrelado com o raio variando ao longo do
+    contorno, centrado em uma faixa da extensão, para que pontos de toda a
+    grade caiam dentro e fora dos polígonos.
+
+    :param path: Caminho do arquivo .shp a criar.
+    :param bounds: Extensão (xmin, ymin, xmax, ymax) a cobrir.
+    :param vertices: Quantidade de vértices de cada polígono.
+    :param parts: Quantidade de polígonos, lado a lado.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param seed: Semente do gerador aleatório.
+    :return: Caminho do arquivo criado.
+    """
+
+    rng = np.random.default_rng(seed)
+    xmin, ymin, xmax, ymax = bounds
+    width = (xmax - xmin) / parts
+    height = ymax - ymin
+
+    polygons = []
+    for part in range(parts):
+        center_x = xmin + width * (part + 0.5)
+        center_y = ymin + height / 2
+        angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+        radius = 0.75 + 0.15 * np.sin(angles * 7) + rng.uniform(-0.05, 0.05, vertices)
+        xs = center_x + radius * width / 2 * np.cos(angles)
+        ys = center_y + radius * height / 2 * np.sin(angles)
+        polygons.append(Polygon(zip(xs, ys)).buffer(0))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    gdf = gpd.GeoDataFrame(
+        {"codigo": [f"R{part}" for part in range(parts)]},
+        geometry=polygons,
+        crs=f"EPSG:{srid}"
+    )
+    gdf.to_file(path)
+    return path
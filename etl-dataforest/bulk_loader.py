@@ -0,0 +1,382 @@
+import csv
+import io
+import json
+from . import grid_ids
+from .config import STORAGE_LAYOUTS
+
+
+
+def staging_columns(layout="jsonb"):
+    """
+    Retorna as colunas da tabela temporária de um lote no layout escolhido.
+
+    :param layout: "jsonb" para o documento por ponto ou "narrow" para o layout normalizado.
+    :return: Lista de tuplas (nome, tipo).
+    """
+
+    if layout == "narrow":
+        return [
+            ("id", grid_ids.id_sql_type()),
+            ("x", "DOUBLE PRECISION"),
+            ("y", "DOUBLE PRECISION"),
+            ("dataset", "TEXT"),
+            ("execution_date", "DATE"),
+            ("valor", "DOUBLE PRECISION"),
+            ("valor_texto", "TEXT"),
+            ("medida", "TEXT"),
+            ("ref_codigo", "TEXT"),
+        ]
+    return [
+        ("id", grid_ids.id_sql_type()),
+        ("x", "DOUBLE PRECISION"),
+        ("y", "DOUBLE PRECISION"),
+        ("raster", "JSONB"),
+        ("ref_codigo", "TEXT"),
+    ]
+
+def encode_rows(rows):
+    """
+    Codifica as linhas de um lote em CSV, o formato enviado pelo COPY.
+
+    :param rows: Iterável de tuplas.
+    :return: Tupla (buffer de texto posicionado no início, quantidade de linhas).
+    """
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    buffer.seek(0)
+    return buffer, count
+
+def staging_table_name(layout="jsonb"):
+    """
+    Retorna o nome da tabela temporária dos lotes de uma conexão.
+
+    A tabela é criada uma vez por conexão e reaproveitada em todos os lotes:
+    criar e descartar uma tabela a cada lote grava no catálogo (pg_class,
+    pg_attribute) milhares de vezes em um raster grande. O nome inclui o
+    layout e o tipo do id, que definem as colunas.
+
+    :param layout: "jsonb" para o documento por ponto ou "narrow" para o layout normalizado.
+    """
+
+    return f"etl_staging_{layout}_{grid_ids.id_sql_type().lower()}"
+
+def staging_table_sql(staging_table, columns):
+    """
+    Monta o comando que prepara a tabela temporária de um lote.
+
+    A tabela tem uma coluna `seq` com a ordem de chegada das linhas. Ela só é
+    criada se ainda não existir na conexão, e é esvaziada no commit e antes de
+    cada lote (para o caso de dois lotes na mesma transação).
+
+    :param staging_table: Nome da tabela temporária (ver `staging_table_name`).
+    :param columns: Lista de tuplas (nome, tipo) das colunas.
+    :return: Comando SQL.
+    """
+
+    column_definitions = ",\n".join(f"{name} {type_}" for name, type_ in columns)
+    return f"""
+        CREATE TEMP TABLE IF NOT EXISTS {staging_table} (
+            seq BIGSERIAL,
+            {column_definitions}
+        ) ON COMMIT DELETE ROWS;
+
+        DELETE FROM {staging_table};
+    """
+
+def _copy_to_staging(cursor, columns, rows, layout="jsonb"):
+    """
+    Prepara a tabela temporária da conexão e a preenche com COPY.
+
+    :param cursor: Cursor do banco de dados.
+    :param columns: Lista de tuplas (nome, tipo) das colunas.
+    :param rows: Iterável de tuplas na ordem de `columns`.
+    :param layout: "jsonb" para o documento por ponto ou "narrow" para o layout normalizado.
+    :return: Tupla (nome da tabela temporária, quantidade de linhas), ou (None, 0) se o lote estiver vazio.
+    """
+
+    buffer, count = encode_rows(rows)
+    if count == 0:
+        return None, 0
+
+    staging_table = staging_table_name(layout)
+    cursor.execute(staging_table_sql(staging_table, columns))
+
+    column_names = ", ".join(name for name, _ in columns)
+    cursor.copy_expert(
+        f"COPY {staging_table} ({column_names}) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+    return staging_table, count
+
+def staged_points_sql(staging_table, with_raster=True):
+    """
+    Monta a consulta que reduz o lote a uma linha por id, como o upsert linha a linha faria.
+
+    Um id se repete no lote quando vários dados de um ponto são gravados
+    juntos (ver `upsert_layered_points`) ou quando pontos diferentes caem na
+    mesma célula (ver `grid_ids`). Nesses casos os documentos são mesclados
+    em ordem de chegada com `jsonb_deep_merge_agg`, a geometria é a da
+    primeira linha e o código de referência é o último informado. Os ids
+    únicos, a maioria, passam direto, sem a mescla.
+
+    :param staging_table: Nome da tabela temporária com o lote.
+    :param with_raster: Se True, inclui a coluna `raster` (layout "jsonb").
+    :return: Consulta SQL com as colunas id, x, y, [raster,] ref_codigo.
+    """
+
+    raster = "raster, " if with_raster else ""
+    merged_raster = "jsonb_deep_merge_agg(raster ORDER BY seq), " if with_raster else ""
+    return f"""
+        WITH lote AS (
+            SELECT *, count(*) OVER (PARTITION BY id) AS repeticoes
+            FROM {staging_table}
+        )
+        SELECT id, x, y, {raster}ref_codigo
+        FROM lote
+        WHERE repeticoes = 1
+        UNION ALL
+        SELECT
+            id,
+            (array_agg(x ORDER BY seq))[1],
+            (array_agg(y ORDER BY seq))[1],
+            {merged_raster}(array_agg(ref_codigo ORDER BY seq DESC) FILTER (WHERE ref_codigo IS NOT NULL))[1]
+        FROM lote
+        WHERE repeticoes > 1
+        GROUP BY id
+    """
+
+def apply_staging_sql(table_name, staging_table, srid=4326, layout="jsonb"):
+    """
+    Monta os comandos que aplicam o lote da tabela temporária na tabela de destino.
+
+    O lote é antes reduzido a uma linha por ponto (ver `staged_points_sql`).
+    No layout "narrow", um mesmo dado e data repetido em um ponto fica com o
+    último valor, como na mescla dos documentos. O código do polígono de
+    referência (`ref_codigo`) de um ponto já gravado só é substituído por um
+    código informado: lotes sem código o mantêm.
+
+    :param table_name: Nome da tabela (ou nome base das tabelas, no layout "narrow").
+    :param staging_table: Nome da tabela temporária com o lote.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param layout: "jsonb" para o documento por ponto ou "narrow" para o layout normalizado.
+    :return: Comando SQL.
+    """
+
+    if layout == "narrow":
+        return f"""
+            INSERT INTO medidas (medida)
+            SELECT DISTINCT medida FROM {staging_table}
+            WHERE medida IS NOT NULL
+            ON CONFLICT (medida) DO NOTHING;
+
+            INSERT INTO {table_name}_pontos (id, geom, ref_codigo)
+            SELECT id, ST_SetSRID(ST_MakePoint(x, y), {srid}), ref_codigo
+            FROM ({staged_points_sql(staging_table, with_raster=False)}) pontos
+            ON CONFLICT (id) DO UPDATE SET
+                ref_codigo = EXCLUDED.ref_codigo
+            WHERE EXCLUDED.ref_codigo IS NOT NULL
+                AND {table_name}_pontos.ref_codigo IS DISTINCT FROM EXCLUDED.ref_codigo;
+
+            INSERT INTO {table_name}_valores (point_id, dataset, execution_date, valor, valor_texto, medida_id)
+            SELECT DISTINCT ON (s.id, s.dataset, s.execution_date)
+                s.id, s.dataset, s.execution_date, s.valor, s.valor_texto, m.id
+            FROM {staging_table} s
+            LEFT JOIN medidas m ON m.medida = s.medida
+            ORDER BY s.id, s.dataset, s.execution_date, s.seq DESC
+            ON CONFLICT (point_id, dataset, execution_date) DO UPDATE SET
+                valor = EXCLUDED.valor,
+                valor_texto = EXCLUDED.valor_texto,
+                medida_id = EXCLUDED.medida_id;
+        """
+
+    return f"""
+        INSERT INTO {table_name} (id, geom, raster, ref_codigo)
+        SELECT id, ST_SetSRID(ST_MakePoint(x, y), {srid}), raster, ref_codigo
+        FROM ({staged_points_sql(staging_table)}) pontos
+        ON CONFLICT (id) DO UPDATE SET
+        raster = jsonb_strip_nulls(
+            jsonb_deep_merge({table_name}.raster, EXCLUDED.raster)
+        ),
+        ref_codigo = COALESCE(EXCLUDED.ref_codigo, {table_name}.ref_codigo);
+    """
+
+def copy_upsert(cursor, table_name, rows, srid=4326):
+    """
+    Insere um lote de pontos com COPY em uma tabela temporária e aplica o lote
+    na tabela de destino com um único INSERT ... SELECT ... ON CONFLICT.
+
+    O resultado é o mesmo do upsert linha a linha com `jsonb_deep_merge`: os
+    documentos de um id repetido no lote são mesclados em ordem de chegada
+    antes do upsert (ver `staged_points_sql`).
+
+    A transação não é confirmada aqui; o chamador deve executar `conn.commit()`.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela onde os dados serão inseridos.
+    :param rows: Iterável de tuplas (id, x, y, raster em JSON, código do polígono de referência ou None);
+        o id segue o esquema de `grid_ids`.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :return: Quantidade de linhas enviadas.
+    """
+
+    staging_table, count = _copy_to_staging(cursor, staging_columns("jsonb"), rows, "jsonb")
+
+    if count == 0:
+        return 0
+
+    cursor.execute(apply_staging_sql(table_name, staging_table, srid, "jsonb"))
+
+    return count
+
+def copy_upsert_narrow(cursor, table_name, rows, srid=4326):
+    """
+    Insere um lote de pontos no layout normalizado (`{table_name}_pontos`,
+    `{table_name}_valores` e `medidas`) com COPY e três comandos set-based.
+
+    Equivale ao upsert com `jsonb_deep_merge`: a geometria de um ponto já
+    existente é mantida e o valor de um mesmo dado e data é substituído.
+
+    A transação não é confirmada aqui; o chamador deve executar `conn.commit()`.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome base das tabelas do layout normalizado.
+    :param rows: Iterável de tuplas (id, x, y, dado, data de execução, valor numérico, valor textual, medida,
+        código do polígono de referência ou None).
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :return: Quantidade de linhas enviadas.
+    """
+
+    staging_table, count = _copy_to_staging(cursor, staging_columns("narrow"), rows, "narrow")
+
+    if count == 0:
+        return 0
+
+    cursor.execute(apply_staging_sql(table_name, staging_table, srid, "narrow"))
+
+    return count
+
+def point_rows(xs, ys, values, name, measure, execution_date, srid=4326, layout="jsonb", codes=None):
+    """
+    Monta as linhas de um lote de pontos de um dado, nas colunas de `staging_columns(layout)`.
+
+    :param xs: Lista de coordenadas x (longitude).
+    :param ys: Lista de coordenadas y (latitude).
+    :param values: Lista de valores (números ou textos).
+    :param name: Nome do dado a ser inserido.
+    :param measure: Unidade de medida do dado.
+    :param execution_date: Data de execução para o registro.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param layout: "jsonb" para o documento por ponto ou "narrow" para o layout normalizado.
+    :param codes: Lista com o código do polígono de referência de cada ponto (opcional).
+    :return: Gerador de tuplas.
+    """
+
+    ids = grid_ids.point_ids(xs, ys, srid)
+    codes = codes if codes is not None else [None] * len(ids)
+
+    if layout == "narrow":
+        return (
+            (
+                point_id,
+                x,
+                y,
+                name,
+                execution_date,
+                value if isinstance(value, (int, float)) else None,
+                None if isinstance(value, (int, float)) else str(value),
+                measure,
+                code
+            )
+            for point_id, x, y, value, code in zip(ids, xs, ys, values, codes)
+        )
+
+    return (
+        (
+            point_id,
+            x,
+            y,
+            json.dumps({execution_date: {name: {"valor": value, "medida": measure}}}),
+            code
+        )
+        for point_id, x, y, value, code in zip(ids, xs, ys, values, codes)
+    )
+
+def upsert_points(cursor, table_name, xs, ys, values, name, measure, execution_date, srid=4326, layout="jsonb", codes=None):
+    """
+    Monta as linhas de um lote de pontos no formato do layout escolhido e as grava.
+
+    A transação não é confirmada aqui; o chamador deve executar `conn.commit()`.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela (ou nome base das tabelas, no layout "narrow").
+    :param xs: Lista de coordenadas x (longitude).
+    :param ys: Lista de coordenadas y (latitude).
+    :param values: Lista de valores (números ou textos).
+    :param name: Nome do dado a ser inserido.
+    :param measure: Unidade de medida do dado.
+    :param execution_date: Data de execução para o registro.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param layout: "jsonb" para o documento por ponto ou "narrow" para o layout normalizado.
+    :param codes: Lista com o código do polígono de referência de cada ponto (opcional).
+    :return: Quantidade de linhas enviadas.
+    """
+
+    rows = point_rows(xs, ys, values, name, measure, execution_date, srid, layout, codes)
+    if layout == "narrow":
+        return copy_upsert_narrow(cursor, table_name, rows, srid)
+    return copy_upsert(cursor, table_name, rows, srid)
+
+def upsert_layered_points(cursor, table_name, xs, ys, layers, execution_date, srid=4326, layout="jsonb", codes=None):
+    """
+    Grava um lote de pontos com os valores de vários dados de uma vez.
+
+    No layout "jsonb" o documento de cada ponto já é montado com todos os
+    dados, então cada ponto é escrito uma única vez por execução.
+
+    A transação não é confirmada aqui; o chamador deve executar `conn.commit()`.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela (ou nome base das tabelas, no layout "narrow").
+    :param xs: Lista de coordenadas x (longitude).
+    :param ys: Lista de coordenadas y (latitude).
+    :param layers: Lista de tuplas (nome do dado, medida, lista de valores, lista de booleanos indicando os valores válidos).
+    :param execution_date: Data de execução para o registro.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param layout: "jsonb" para o documento por ponto ou "narrow" para o layout normalizado.
+    :param codes: Lista com o código do polígono de referência de cada ponto (opcional).
+    :return: Quantidade de pontos enviados.
+    """
+
+    ids = grid_ids.point_ids(xs, ys, srid)
+    codes = codes if codes is not None else [None] * len(ids)
+
+    if layout == "narrow":
+        rows = (
+            (point_id, x, y, name, execution_date, value, None, measure, code)
+            for name, measure, values, valid in layers
+            for point_id, x, y, value, is_valid, code in zip(ids, xs, ys, values, valid, codes)
+            if is_valid
+        )
+        copy_upsert_narrow(cursor, table_name, rows, srid)
+        return len(xs)
+
+    rows = (
+        (
+            ids[i],
+            x,
+            y,
+            json.dumps({execution_date: {
+                name: {"valor": values[i], "medida": measure}
+                for name, measure, values, valid in layers
+                if valid[i]
+            }}),
+            codes[i]
+        )
+        for i, (x, y) in enumerate(zip(xs, ys))
+    )
+    return copy_upsert(cursor, table_name, rows, srid)
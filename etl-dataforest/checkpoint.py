@@ -0,0 +1,186 @@
+import json
+from .connection_pool import get_connection
+from . import sinks
+
+
+def create_checkpoint_table(conn, cursor, schema='public'):
+    """
+    Cria a tabela de checkpoints, que registra as janelas de raster já gravadas.
+
+    :param conn: Conexão com o banco de dados.
+    :param cursor: Cursor do banco de dados.
+    :param schema: Esquema da tabela a ser criada.
+    """
+
+    creation_query = f"""
+        CREATE SCHEMA IF NOT EXISTS {schema};
+
+        CREATE TABLE IF NOT EXISTS {schema}.etl_checkpoint (
+            table_name TEXT NOT NULL,
+            dataset TEXT NOT NULL,
+            execution_date TEXT NOT NULL,
+            window_id TEXT NOT NULL,
+            row_counts JSONB,
+            committed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (table_name, dataset, execution_date, window_id)
+        );
+
+        -- Tabelas criadas antes da contagem de pontos por janela
+        ALTER TABLE {schema}.etl_checkpoint ADD COLUMN IF NOT EXISTS row_counts JSONB;
+    """
+
+    try:
+        cursor.execute(creation_query)
+        conn.commit()
+    except Exception as e:
+        print(f"Erro ao criar tabela de checkpoints: {e}")
+        conn.rollback()
+        exit(1)
+
+def window_id(window):
+    """
+    Identifica uma janela do raster pela sua posição e tamanho.
+
+    :param window: Janela do raster (rasterio.windows.Window).
+    :return: Identificador textual da janela.
+    """
+
+    return f"{int(window.row_off)}:{int(window.col_off)}:{int(window.height)}:{int(window.width)}"
+
+def load_committed_windows(cursor, table_name, dataset, execution_date):
+    """
+    Busca as janelas já gravadas de um conjunto de dados em uma data de execução.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela onde os dados são inseridos.
+    :param dataset: Nome do conjunto de dados.
+    :param execution_date: Data de execução da carga.
+    :return: Conjunto de identificadores de janela (ver `window_id`).
+    """
+
+    cursor.execute("""
+        SELECT window_id
+        FROM etl_checkpoint
+        WHERE table_name = %s AND dataset = %s AND execution_date = %s
+    """, (table_name, dataset, execution_date))
+    return {row[0] for row in cursor.fetchall()}
+
+def count_committed_windows(cursor, table_name, execution_date):
+    """
+    Conta as janelas já gravadas de cada conjunto de dados em uma data de execução.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela onde os dados são inseridos.
+    :param execution_date: Data de execução da carga.
+    :return: Lista de tuplas (conjunto de dados, quantidade de janelas).
+    """
+
+    cursor.execute("""
+        SELECT dataset, count(*)
+        FROM etl_checkpoint
+        WHERE table_name = %s AND execution_date = %s
+        GROUP BY dataset
+        ORDER BY dataset
+    """, (table_name, execution_date))
+    return cursor.fetchall()
+
+def load_checkpointed_counts(table_name, dataset, execution_date):
+    """
+    Soma os pontos gravados nas janelas já registradas de um conjunto de dados,
+    para que o manifesto de uma carga retomada conte também as janelas puladas.
+
+    Janelas registradas antes da contagem por janela não são contadas.
+
+    :param table_name: Nome da tabela onde os dados são inseridos.
+    :param dataset: Nome do conjunto de dados (ou do grupo, no modo multicamada).
+    :param execution_date: Data de execução da carga.
+    :return: Dicionário {nome do dado: quantidade de pontos}.
+    """
+
+    with get_connection() as (conn, cursor):
+        cursor.execute("""
+            SELECT counts.key, sum(counts.value::bigint)
+            FROM etl_checkpoint, jsonb_each_text(row_counts) AS counts
+            WHERE table_name = %s AND dataset = %s AND execution_date = %s
+            GROUP BY counts.key
+        """, (table_name, dataset, execution_date))
+        return {name: int(count) for name, count in cursor.fetchall()}
+
+def mark_window_committed(conn, cursor, table_name, dataset, execution_date, window, row_counts=None):
+    """
+    Registra que todos os lotes de uma janela foram confirmados no banco.
+
+    Deve ser chamada depois do último commit da janela. Se o processo cair entre
+    esse commit e o checkpoint, a janela é refeita na retomada, o que é seguro
+    porque o upsert é idempotente.
+
+    :param conn: Conexão com o banco de dados.
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela onde os dados são inseridos.
+    :param dataset: Nome do conjunto de dados.
+    :param execution_date: Data de execução da carga.
+    :param window: Janela do raster (rasterio.windows.Window).
+    :param row_counts: Dicionário {nome do dado: pontos gravados na janela}, usado na retomada
+        (ver `load_checkpointed_counts`).
+    """
+
+    try:
+        cursor.execute("""
+            INSERT INTO etl_checkpoint (table_name, dataset, execution_date, window_id, row_counts)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT DO NOTHING;
+        """, (table_name, dataset, execution_date, window_id(window), json.dumps(row_counts or {})))
+        conn.commit()
+    except Exception as e:
+        print(f"Erro ao registrar checkpoint de {dataset}: {e}")
+        conn.rollback()
+
+def clear_checkpoints(conn, cursor, table_name, dataset, execution_date):
+    """
+    Remove os checkpoints de um conjunto de dados em uma data de execução,
+    antes de uma carga que não é retomada.
+
+    :param conn: Conexão com o banco de dados.
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela onde os dados são inseridos.
+    :param dataset: Nome do conjunto de dados.
+    :param execution_date: Data de execução da carga.
+    """
+
+    try:
+        cursor.execute("""
+            DELETE FROM etl_checkpoint
+            WHERE table_name = %s AND dataset = %s AND execution_date = %s
+        """, (table_name, dataset, execution_date))
+        conn.commit()
+    except Exception as e:
+        print(f"Erro ao limpar checkpoints de {dataset}: {e}")
+        conn.rollback()
+
+def prepare_checkpoints(table_name, dataset, execution_date, resume):
+    """
+    Prepara os checkpoints no início da carga de um raster.
+
+    Na retomada, retorna as janelas já gravadas para que sejam puladas; caso
+    contrário, descarta os checkpoints anteriores da mesma data. Nos destinos
+    sem banco não há checkpoints, e nenhuma janela é pulada.
+
+    :param table_name: Nome da tabela onde os dados são inseridos.
+    :param dataset: Nome do conjunto de dados.
+    :param execution_date: Data de execução da carga.
+    :param resume: Se True, retoma a carga a partir dos checkpoints.
+    :return: Conjunto de identificadores de janela a pular.
+    """
+
+    if not sinks.uses_database():
+        return set()
+
+    with get_connection() as (conn, cursor):
+        if resume:
+            committed = load_committed_windows(cursor, table_name, dataset, execution_date)
+            if committed:
+                print(f"Retomando {dataset}: {len(committed)} janelas já gravadas serão puladas.")
+            return committed
+
+        clear_checkpoints(conn, cursor, table_name, dataset, execution_date)
+        return set()
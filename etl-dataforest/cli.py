@@ -0,0 +1,280 @@
+import argparse
+from .config import load_config, STORAGE_LAYOUTS, AGGREGATIONS, ID_SCHEMES, SINKS
+
+
+# Argumentos do comando `run` e o campo do Config que cada um sobrescreve
+RUN_OVERRIDES = {
+    "mode": "execution_mode",
+    "workers": "raster_workers",
+    "force": "force",
+    "resume": "resume",
+    "layout": "layout",
+    "multi_layer": "multi_layer",
+    "aggregation": "aggregation",
+    "roi": "roi",
+    "shp_spacing": "shp_spacing_km",
+    "reference_code": "reference_code_column",
+    "id_scheme": "id_scheme",
+    "migrate_ids": "migrate_ids",
+    "sink": "sink",
+    "output_dir": "sink_output_dir",
+    "metrics": "metrics",
+    "progress": "progress",
+    "files": "files_path",
+}
+
+
+def build_parser():
+    """
+    Monta o parser da linha de comando, com um subcomando por tarefa.
+
+    Os argumentos omitidos ficam como None e mantêm o valor do .env.
+    """
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--env-file", default=None, help="Arquivo .env (default é o .env do diretório atual).")
+
+    parser = argparse.ArgumentParser(prog="etl-dataforest", description="ETL Data Forest")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", parents=[common], help="Carrega os arquivos do files.json.")
+    run.add_argument(
+        "--files",
+        help="Arquivo JSON com a lista de arquivos a carregar (default é FILES_PATH)."
+    )
+    run.add_argument(
+        "--mode",
+        choices=["thread", "process", "async"],
+        help="Modo de execução dos arquivos ASC."
+    )
+    run.add_argument(
+        "--workers",
+        type=int,
+        help="Quantidade de processos no modo process (default é a quantidade de núcleos)."
+    )
+    run.add_argument(
+        "--force",
+        action="store_true",
+        default=None,
+        help="Processa todos os arquivos, mesmo os que não mudaram desde a última carga."
+    )
+    run.add_argument(
+        "--resume",
+        action="store_true",
+        default=None,
+        help="Retoma uma carga interrompida, pulando as janelas de raster já gravadas hoje."
+    )
+    run.add_argument(
+        "--layout",
+        choices=STORAGE_LAYOUTS,
+        help="Layout de armazenamento dos pontos."
+    )
+    run.add_argument(
+        "--multi-layer",
+        action="store_true",
+        default=None,
+        help="Processa juntos os arquivos ASC com a mesma grade, gravando cada ponto uma única vez."
+    )
+    run.add_argument(
+        "--aggregation",
+        choices=AGGREGATIONS,
+        help="Resume cada célula de pixels com a média, o mínimo, o máximo ou o valor mais frequente, em vez de amostrar."
+    )
+    run.add_argument(
+        "--roi",
+        action="store_true",
+        default=None,
+        help="Lê apenas as janelas dos arquivos ASC que tocam os polígonos de referência."
+    )
+    run.add_argument(
+        "--shp-spacing",
+        type=float,
+        help="Espaçamento, em km, da reamostragem dos contornos dos arquivos SHP (default 0: mantém os vértices originais)."
+    )
+    run.add_argument(
+        "--reference-code",
+        help="Coluna do shapefile de referência gravada em ref_codigo de cada ponto (ex.: o código do município)."
+    )
+    run.add_argument(
+        "--id-scheme",
+        choices=ID_SCHEMES,
+        help="Identificador dos pontos: o texto \"x,y\" ou o número da célula da grade de referência."
+    )
+    run.add_argument(
+        "--migrate-ids",
+        action="store_true",
+        default=None,
+        help="Com --id-scheme cell, migra a tabela existente com ids em texto para ids de célula."
+    )
+    run.add_argument(
+        "--sink",
+        choices=SINKS,
+        help="Destino dos pontos: o PostGIS, arquivos GeoParquet ou nenhum (apenas conta os pontos)."
+    )
+    run.add_argument(
+        "--output-dir",
+        help="Diretório dos arquivos GeoParquet."
+    )
+    run.add_argument(
+        "--metrics",
+        action="store_true",
+        default=None,
+        help="Registra tempos por etapa e contadores e grava o relatório da execução em JSON."
+    )
+    run.add_argument(
+        "--progress",
+        action="store_true",
+        default=None,
+        help="Mostra o progresso e a estimativa de término de cada arquivo (liga as métricas)."
+    )
+
+    reference = commands.add_parser(
+        "load-reference",
+        parents=[common],
+        help="Carrega o shapefile de referência e exporta os polígonos para o cache."
+    )
+    reference.add_argument("--shapefile", help="Shapefile de referência (default é SH_FILE).")
+    reference.add_argument("--table", help="Tabela dos polígonos de referência (default é SH_TABLE_NAME).")
+    reference.add_argument(
+        "--reference-code",
+        help="Coluna do shapefile de referência gravada em ref_codigo de cada ponto."
+    )
+    reference.add_argument(
+        "--sink",
+        choices=SINKS,
+        help="Com um destino sem banco, apenas exporta o shapefile para o cache."
+    )
+
+    commands.add_parser(
+        "bench",
+        parents=[common],
+        add_help=False,
+        help="Executa a suíte de benchmarks (os demais argumentos vão para benchmarks.run_suite)."
+    )
+
+    status = commands.add_parser(
+        "status",
+        parents=[common],
+        help="Mostra as cargas registradas no manifesto e os checkpoints de uma data."
+    )
+    status.add_argument("--date", help="Data de execução dos checkpoints (default é hoje).")
+
+    return parser
+
+def run_command(args):
+    """
+    Executa o comando `run`: a carga dos arquivos do files.json.
+    """
+
+    from .main import run
+
+    overrides = {
+        field: getattr(args, name)
+        for name, field in RUN_OVERRIDES.items()
+        if getattr(args, name) is not None
+    }
+    run(load_config(args.env_file, **overrides))
+
+def load_reference_command(args):
+    """
+    Executa o comando `load-reference`: carrega o shapefile de referência no
+    PostGIS (ou apenas no cache, nos destinos sem banco).
+    """
+
+    from .connection_pool import close_pool
+    from .main import configure, init_database, load_reference, prepare_reference
+    from . import sinks
+
+    overrides = {"shp_file_path": args.shapefile, "shp_table_name": args.table,
+                 "reference_code_column": args.reference_code, "sink": args.sink}
+    config = load_config(args.env_file, **{field: value for field, value in overrides.items() if value is not None})
+
+    configure(config)
+    if not sinks.uses_database():
+        prepare_reference(config)
+        print(f"Polígonos de referência de {config.shp_table_name} exportados para o cache.")
+        return
+
+    if not config.shp_file_path:
+        print("Nenhum shapefile informado (SH_FILE ou --shapefile); a tabela existente será usada.")
+
+    # Uma conexão basta: o carregamento é sequencial
+    init_database(config, pool_size=1)
+    try:
+        load_reference(config)
+    finally:
+        close_pool()
+
+def bench_command(args, extra):
+    """
+    Executa o comando `bench`, repassando os demais argumentos à suíte de benchmarks.
+    """
+
+    from dotenv import load_dotenv
+    from .benchmarks.run_suite import main as run_suite
+
+    load_dotenv(args.env_file)
+    run_suite(extra)
+
+def status_command(args):
+    """
+    Executa o comando `status`: lista o manifesto e os checkpoints da data.
+    """
+
+    from .connection_pool import get_connection, close_pool
+    from .manifest import list_manifest
+    from .checkpoint import count_committed_windows
+    from .main import current_execution_date, init_database
+
+    config = load_config(args.env_file)
+    execution_date = args.date or current_execution_date()
+
+    init_database(config, pool_size=1)
+    try:
+        with get_connection() as (conn, cursor):
+            try:
+                loads = list_manifest(cursor, config.asc_table_name)
+                windows = count_committed_windows(cursor, config.asc_table_name, execution_date)
+            except Exception as e:
+                print(f"Erro ao consultar o manifesto: {e}")
+                return
+    finally:
+        close_pool()
+
+    print(f"Cargas registradas em {config.asc_table_name}:")
+    if not loads:
+        print("  nenhuma")
+    for dataset, loaded_date, row_count, updated_at in loads:
+        print(f"  {dataset:<30} {loaded_date}  {row_count or 0:>12} pontos  (atualizado em {updated_at:%Y-%m-%d %H:%M})")
+
+    print(f"Janelas gravadas em {execution_date}:")
+    if not windows:
+        print("  nenhuma")
+    for dataset, count in windows:
+        print(f"  {dataset:<30} {count:>8} janelas")
+
+def main(argv=None):
+    """
+    Ponto de entrada da linha de comando `etl-dataforest`.
+
+    :param argv: Argumentos da linha de comando (default é sys.argv).
+    """
+
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+
+    if args.command == "bench":
+        bench_command(args, extra)
+        return
+    if extra:
+        parser.error(f"argumentos não reconhecidos: {' '.join(extra)}")
+
+    if args.command == "run":
+        run_command(args)
+    elif args.command == "load-reference":
+        load_reference_command(args)
+    elif args.command == "status":
+        status_command(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import json
+from collections import namedtuple
+import numpy as np
+from .reference_cache import get_reference_index, get_reference_codes
+
+
+# Máscara de recorte que também identifica o polígono de cada pixel: `labels` guarda a
+# posição do polígono em `codes` mais um (0 fora de todos) e `codes` o código de cada polígono
+LabelMask = namedtuple("LabelMask", ["labels", "codes"])
+
+
+def load_reference_shapes(cursor, table_name):
+    """
+    Carrega os polígonos da tabela de referência uma única vez.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela que contém os polígonos.
+    :return: Lista de geometrias no formato GeoJSON.
+    """
+
+    cursor.execute(f"""
+        SELECT ST_AsGeoJSON(geom)
+        FROM {table_name}
+        WHERE geom IS NOT NULL
+    """)
+    return [json.loads(row[0]) for row in cursor.fetchall()]
+
+def build_clip_mask(shapes, out_shape, transform, labels=False):
+    """
+    Rasteriza os polígonos em uma máscara booleana alinhada à grade do raster.
+
+    A amostragem de `process_chunk` usa o canto superior esquerdo de cada pixel
+    (`transform * (col, row)`), enquanto a rasterização testa o centro do pixel.
+    Por isso a grade é deslocada em meio pixel: assim o ponto testado na máscara
+    é o mesmo ponto que seria enviado para `is_point_in_polygon`.
+
+    :param shapes: Geometrias dos polígonos de referência.
+    :param out_shape: Dimensões (linhas, colunas) da máscara.
+    :param transform: Transformação do raster.
+    :param labels: Se True, cada pixel recebe a posição do polígono que o contém mais um (0 fora de todos).
+    :return: Máscara booleana, verdadeira onde o ponto está dentro de algum polígono, ou, com `labels`,
+        array inteiro com o polígono de cada pixel.
+    """
+
+    if len(shapes) == 0:
+        return np.zeros(out_shape, dtype="uint32" if labels else bool)
+
+    from rasterio.features import rasterize
+    from rasterio.transform import Affine
+
+    shifted_transform = transform * Affine.translation(-0.5, -0.5)
+    mask = rasterize(
+        ((shape, position + 1 if labels else 1) for position, shape in enumerate(shapes)),
+        out_shape=out_shape,
+        transform=shifted_transform,
+        fill=0,
+        dtype=("uint16" if len(shapes) < 2 ** 16 else "uint32") if labels else "uint8"
+    )
+    return mask if labels else mask.astype(bool)
+
+def build_raster_clip_mask(conn, cursor, raster_path, table_name):
+    """
+    Constrói a máscara de recorte para toda a grade de um arquivo raster.
+
+    Os polígonos vêm do cache de referência (ver `reference_cache`), então só
+    são buscados no banco quando a tabela ainda não está em cache.
+
+    Com a coluna de código dos polígonos definida (ver
+    `reference_cache.init_reference_cache`), retorna uma LabelMask, da qual
+    sai também o código do polígono de cada ponto amostrado.
+
+    Em caso de erro retorna None, e o chamador deve usar `points_in_polygon`
+    como alternativa.
+
+    :param conn: Conexão com o banco de dados (None nos destinos sem banco).
+    :param cursor: Cursor do banco de dados (None nos destinos sem banco).
+    :param raster_path: Caminho do arquivo raster.
+    :param table_name: Nome da tabela que contém os polígonos.
+    :return: Máscara booleana (ou LabelMask) com as dimensões do raster, ou None.
+    """
+
+    import rasterio
+
+    try:
+        shapes, _ = get_reference_index(cursor, table_name)
+        codes = get_reference_codes(cursor, table_name)
+        with rasterio.open(raster_path) as src:
+            if codes is None:
+                return build_clip_mask(shapes, (src.height, src.width), src.transform)
+            labels = build_clip_mask(shapes, (src.height, src.width), src.transform, labels=True)
+            return LabelMask(labels, codes)
+    except Exception as e:
+        print(f"Erro ao construir máscara de recorte, usando consulta por ponto: {e}")
+        if conn is not None:
+            conn.rollback()
+        return None
+
+def window_clip_mask(clip_mask, window, shape):
+    """
+    Recorta a máscara de todo o raster para a janela de um bloco.
+
+    :param clip_mask: Máscara de recorte de todo o raster (booleana ou LabelMask).
+    :param window: Janela do raster correspondente ao bloco.
+    :param shape: Dimensões (linhas, colunas) do bloco.
+    :return: Máscara booleana do bloco.
+    """
+
+    rows, cols = shape
+    if isinstance(clip_mask, LabelMask):
+        return clip_mask.labels[
+            window.row_off:window.row_off + rows,
+            window.col_off:window.col_off + cols
+        ] > 0
+    return clip_mask[
+        window.row_off:window.row_off + rows,
+        window.col_off:window.col_off + cols
+    ]
+
+def mask_codes(clip_mask, window, rows, cols):
+    """
+    Retorna o código do polígono que contém cada pixel, a partir da mesma máscara usada no recorte.
+
+    :param clip_mask: Máscara de recorte de todo o raster.
+    :param window: Janela do raster correspondente ao bloco.
+    :param rows: Índices de linha dos pixels, relativos ao bloco (todos dentro de algum polígono).
+    :param cols: Índices de coluna dos pixels, relativos ao bloco.
+    :return: Array de códigos, ou None se a máscara não for uma LabelMask.
+    """
+
+    if not isinstance(clip_mask, LabelMask):
+        return None
+
+    labels = clip_mask.labels[window.row_off + rows, window.col_off + cols]
+    return clip_mask.codes[labels.astype(np.int64) - 1]
@@ -0,0 +1,166 @@
+import json
+import os
+from collections import namedtuple
+
+
+# Opções da linha de comando, mantidas aqui (sem numpy, shapely ou psycopg2) para que
+# a CLI seja leve; os módulos que as usam as importam deste módulo
+
+# Layouts de armazenamento suportados (ver create_table.create_narrow_tables)
+STORAGE_LAYOUTS = ("jsonb", "narrow")
+
+# Métodos de agregação das células de `sampling_stride` x `sampling_stride` pixels (ver `asc_functions.aggregate_block`)
+AGGREGATIONS = ("mean", "min", "max", "majority")
+
+# Identificadores dos pontos: "text" usa o texto "x,y" das coordenadas e
+# "cell" usa o número (BIGINT) da célula de uma grade de referência
+ID_SCHEMES = ("text", "cell")
+
+# Destinos dos pontos: "postgis" grava no banco (upsert), "geoparquet" grava
+# arquivos GeoParquet particionados e "null" apenas conta os pontos
+SINKS = ("postgis", "geoparquet", "null")
+
+# Arquivo padrão com a lista de arquivos a carregar, dentro do pacote
+DEFAULT_FILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "input_data", "files.json")
+
+# Configuração de uma execução do ETL, lida do .env e sobrescrita pela linha de comando
+Config = namedtuple("Config", [
+    "db_name",
+    "db_user",
+    "db_password",
+    "db_host",
+    "db_port",
+    "asc_table_name",
+    "asc_schema",
+    "srid",
+    "shp_table_name",
+    "shp_file_path",
+    "reference_subdivide_max_vertices",
+    "sampling_stride",
+    "shp_spacing_km",
+    "batch_size",
+    "clip_mode",
+    "layout",
+    "file_workers",
+    "chunk_workers",
+    "db_pool_size",
+    "execution_mode",
+    "raster_workers",
+    "async_connections",
+    "pipeline_options",
+    "raster_cache_dir",
+    "reference_cache_dir",
+    "reference_code_column",
+    "aggregation",
+    "roi",
+    "multi_layer",
+    "id_scheme",
+    "grid_origin_x",
+    "grid_origin_y",
+    "grid_cell_size",
+    "sink",
+    "sink_output_dir",
+    "metrics",
+    "metrics_report_path",
+    "progress",
+    "progress_interval",
+    "files_path",
+    "force",
+    "resume",
+    "migrate_ids",
+])
+
+
+def _flag(name, default="false"):
+    """
+    Lê uma variável de ambiente booleana ("1", "true" ou "sim").
+    """
+
+    return os.getenv(name, default).lower() in ("1", "true", "sim")
+
+def load_config(env_file=None, **overrides):
+    """
+    Monta a configuração da execução a partir das variáveis de ambiente.
+
+    O .env só é lido aqui, e não na importação do pacote, para que o ETL
+    possa ser usado em testes e notebooks com uma configuração própria.
+
+    :param env_file: Caminho do arquivo .env (default é o .env do diretório atual ou de um diretório acima).
+    :param overrides: Campos da configuração que substituem os valores do ambiente.
+    :return: Config com a configuração da execução.
+    """
+
+    from dotenv import load_dotenv
+
+    load_dotenv(env_file)
+
+    file_workers = int(os.getenv("FILE_WORKERS", 4))
+    chunk_workers = int(os.getenv("CHUNK_WORKERS", 8))
+
+    config = Config(
+        db_name=os.getenv("EXTERNAL_DB_NAME", "reflorestamento"),
+        db_user=os.getenv("EXTERNAL_DB_USER", "dataforest"),
+        db_password=os.getenv("EXTERNAL_DB_PASSWORD", "dataforest"),
+        db_host=os.getenv("EXTERNAL_DB_HOST", "localhost"),
+        db_port=os.getenv("EXTERNAL_DB_PORT", "5432"),
+        asc_table_name=os.getenv("ASC_TABLE_NAME", "dados_geoespaciais"),
+        asc_schema=os.getenv("ASC_SCHEMA", "public"),
+        srid=int(os.getenv("ASC_SRID", 4326)),
+        shp_table_name=os.getenv("SH_TABLE_NAME", "brasil"),
+        shp_file_path=os.getenv("SH_FILE", None),
+        # Máximo de vértices das partes da tabela {shp_table_name}_subdividida, usada nas verificações no banco
+        reference_subdivide_max_vertices=int(os.getenv("REFERENCE_SUBDIVIDE_MAX_VERTICES", 256)),
+        sampling_stride=int(os.getenv("ASC_SAMPLING_STRIDE", 10)),
+        # Espaçamento, em km, da reamostragem dos contornos dos arquivos SHP (0, o padrão, mantém os vértices originais)
+        shp_spacing_km=float(os.getenv("SHP_SPACING_KM", 0)),
+        batch_size=int(os.getenv("ASC_BATCH_SIZE", 1000)),
+        clip_mode=os.getenv("CLIP_MODE", "mask"),
+        layout=os.getenv("STORAGE_LAYOUT", "jsonb"),
+        file_workers=file_workers,
+        chunk_workers=chunk_workers,
+        # Cada thread de bloco usa sua própria conexão; a folga atende as threads de arquivo
+        db_pool_size=int(os.getenv("DB_POOL_SIZE", file_workers * chunk_workers + file_workers)),
+        execution_mode=os.getenv("EXECUTION_MODE", "thread"),
+        raster_workers=int(os.getenv("RASTER_WORKERS", 0)) or None,
+        async_connections=int(os.getenv("ASYNC_CONNECTIONS", 4)),
+        pipeline_options={
+            "transform_workers": int(os.getenv("PIPELINE_TRANSFORM_WORKERS", 2)),
+            "queue_size": int(os.getenv("PIPELINE_QUEUE_SIZE", 8)),
+            "max_memory_mb": int(os.getenv("PIPELINE_MAX_MEMORY_MB", 0)) or None,
+        },
+        raster_cache_dir=os.getenv("RASTER_CACHE_DIR", ".cache/rasters") or None,
+        reference_cache_dir=os.getenv("REFERENCE_CACHE_DIR", ".cache/reference") or None,
+        reference_code_column=os.getenv("REFERENCE_CODE_COLUMN", "") or None,
+        aggregation=os.getenv("AGGREGATION", "") or None,
+        roi=_flag("ROI_WINDOWS"),
+        multi_layer=_flag("MULTI_LAYER"),
+        id_scheme=os.getenv("ID_SCHEME", "text"),
+        grid_origin_x=float(os.getenv("GRID_ORIGIN_X", -180)),
+        grid_origin_y=float(os.getenv("GRID_ORIGIN_Y", -90)),
+        grid_cell_size=float(os.getenv("GRID_CELL_SIZE", 1 / 120)),
+        sink=os.getenv("SINK", "postgis"),
+        sink_output_dir=os.getenv("SINK_OUTPUT_DIR", "output"),
+        metrics=_flag("METRICS"),
+        metrics_report_path=os.getenv("METRICS_REPORT_PATH", "run_report.json"),
+        progress=_flag("PROGRESS"),
+        progress_interval=int(os.getenv("PROGRESS_INTERVAL", 10)),
+        files_path=os.getenv("FILES_PATH", "") or DEFAULT_FILES_PATH,
+        force=False,
+        resume=False,
+        migrate_ids=False,
+    )
+    return config._replace(**overrides)
+
+def load_files(path):
+    """
+    Lê a lista de arquivos a carregar (ver `input_data/files.json.example`).
+
+    :param path: Caminho do arquivo JSON.
+    :return: Dicionário {nome do dado: informações do arquivo}.
+    """
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Arquivo não encontrado: {path}")
+
+    with open(path, "r") as file:
+        return json.load(file)
@@ -0,0 +1,93 @@
+import threading
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+
+
+_POOL = None
+_POOL_SLOTS = None
+_SETTINGS = None
+
+
+def init_pool(pool_size, dbname, user, password, host, port):
+    """
+    Cria o pool de conexões compartilhado pelas threads do ETL.
+
+    :param pool_size: Quantidade máxima de conexões abertas ao mesmo tempo.
+    :param dbname: Nome do banco de dados.
+    :param user: Usuário do banco de dados.
+    :param password: Senha do banco de dados.
+    :param host: Host do banco de dados.
+    :param port: Porta do banco de dados.
+    """
+
+    global _POOL, _POOL_SLOTS, _SETTINGS
+
+    _SETTINGS = dict(dbname=dbname, user=user, password=password, host=host, port=port)
+    _POOL = ThreadedConnectionPool(
+        1,
+        pool_size,
+        dbname=dbname,
+        user=user,
+        password=password,
+        host=host,
+        port=port
+    )
+    # O ThreadedConnectionPool falha quando esgotado; o semáforo faz a thread esperar
+    _POOL_SLOTS = threading.BoundedSemaphore(pool_size)
+
+def get_connection_settings():
+    """
+    Retorna os parâmetros de conexão usados em `init_pool`.
+
+    Útil para que processos filhos abram as suas próprias conexões.
+
+    :return: Dicionário com dbname, user, password, host e port.
+    """
+
+    if _SETTINGS is None:
+        raise RuntimeError("Pool de conexões não inicializado. Chame init_pool() antes.")
+    return dict(_SETTINGS)
+
+@contextmanager
+def get_connection():
+    """
+    Empresta uma conexão do pool para a thread atual.
+
+    Cada thread trabalha na sua própria conexão e transação, então um
+    `conn.rollback()` não descarta o trabalho das outras threads. Ao devolver a
+    conexão, qualquer transação não confirmada é desfeita.
+
+    Não aninhe chamadas na mesma thread: com o pool cheio, a segunda chamada
+    esperaria para sempre.
+
+    :return: Tupla (conexão, cursor).
+    """
+
+    if _POOL is None:
+        raise RuntimeError("Pool de conexões não inicializado. Chame init_pool() antes.")
+
+    _POOL_SLOTS.acquire()
+    try:
+        conn = _POOL.getconn()
+        cursor = conn.cursor()
+        try:
+            yield conn, cursor
+        finally:
+            cursor.close()
+            if not conn.closed:
+                conn.rollback()
+            _POOL.putconn(conn)
+    finally:
+        _POOL_SLOTS.release()
+
+def close_pool():
+    """
+    Fecha todas as conexões do pool.
+    """
+
+    global _POOL, _POOL_SLOTS
+
+    if _POOL is not None:
+        _POOL.closeall()
+    _POOL = None
+    _POOL_SLOTS = None
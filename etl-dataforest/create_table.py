@@ -1,6 +1,8 @@
+from .grid_ids import cell_id_sql
+from .verify_point_locale import forget_subdivided_table
 
 
-def create_table(conn, cursor, table_name, schema='public', srid=4326):
+def create_table(conn, cursor, table_name, schema='public', srid=4326, id_type="TEXT"):
     """
     Cria uma tabela no banco de dados com o nome e esquema especificados.
 
@@ -8,6 +10,7 @@ def create_table(conn, cursor, table_name, schema='public', srid=4326):
     :param cursor: Cursor do banco de dados.
     :param table_name: Nome da tabela a ser criada.
     :param schema: Esquema da tabela a ser criada.
+    :param id_type: Tipo da coluna id: "TEXT" ("x,y") ou "BIGINT" (célula da grade; ver `grid_ids`).
     """
 
     creation_query = f"""
@@ -16,10 +19,13 @@ def create_table(conn, cursor, table_name, schema='public', srid=4326):
         CREATE EXTENSION IF NOT EXISTS postgis;
 
         CREATE TABLE IF NOT EXISTS {schema}.{table_name} (
-            id TEXT PRIMARY KEY,
+            id {id_type} PRIMARY KEY,
             geom GEOMETRY(Point, {srid}),
-            raster JSONB
+            raster JSONB,
+            ref_codigo TEXT
         );
+
+        ALTER TABLE {schema}.{table_name} ADD COLUMN IF NOT EXISTS ref_codigo TEXT;
     """
 
     try:
@@ -54,7 +60,20 @@ def create_index(conn, cursor, table_name, schema='public'):
 
 def create_jsonb_merge_function(conn, cursor):
     """
-    Cria uma função para mesclar dois objetos JSONB.
+    Cria as funções para mesclar dois objetos JSONB.
+
+    `jsonb_deep_merge` percorre apenas as chaves do segundo documento e aplica
+    cada uma com `||`, descendo só nos objetos presentes nos dois lados. Como o
+    documento de um upsert traz uma data e poucos dados, o custo não cresce com
+    a quantidade de datas já acumuladas no ponto.
+
+    `jsonb_deep_merge_legado` é a versão recursiva original, que faz um
+    `FULL OUTER JOIN` de todas as chaves dos dois lados em cada nível. Ela é
+    mantida para comparação; as duas retornam o mesmo resultado, inclusive o
+    NULL produzido quando os dois objetos estão vazios.
+
+    O agregado `jsonb_deep_merge_agg` mescla os documentos de um grupo na
+    ordem informada, e é usado na migração dos ids em texto para células.
 
     :param conn: Conexão com o banco de dados.
     :param cursor: Cursor do banco de dados.
@@ -62,7 +81,7 @@ def create_jsonb_merge_function(conn, cursor):
 
     creation_query = """
 
-        CREATE OR REPLACE FUNCTION jsonb_deep_merge(jsonb, jsonb)
+        CREATE OR REPLACE FUNCTION jsonb_deep_merge_legado(jsonb, jsonb)
         RETURNS jsonb LANGUAGE sql IMMUTABLE AS $$
         SELECT jsonb_object_agg(
             COALESCE(key1, key2),
@@ -70,7 +89,7 @@ def create_jsonb_merge_function(conn, cursor):
                 WHEN value1 ISNULL THEN value2
                 WHEN value2 ISNULL THEN value1
                 WHEN jsonb_typeof(value1) = 'object' AND jsonb_typeof(value2) = 'object'
-                    THEN jsonb_deep_merge(value1, value2)
+                    THEN jsonb_deep_merge_legado(value1, value2)
                 ELSE value2
             END
         )
@@ -81,6 +100,47 @@ def create_jsonb_merge_function(conn, cursor):
             ON key1 = key2;
         $$;
 
+        CREATE OR REPLACE FUNCTION jsonb_deep_merge(a jsonb, b jsonb)
+        RETURNS jsonb LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE AS $$
+        DECLARE
+            resultado jsonb := COALESCE(a, '{}'::jsonb);
+            chave text;
+            valor_a jsonb;
+            valor_b jsonb;
+        BEGIN
+            -- Sem nenhuma chave dos dois lados, o jsonb_object_agg da versão legada retorna NULL
+            IF resultado = '{}'::jsonb AND (b IS NULL OR b = '{}'::jsonb) THEN
+                RETURN NULL;
+            END IF;
+
+            IF b IS NULL THEN
+                RETURN resultado;
+            END IF;
+
+            FOR chave, valor_b IN SELECT key, value FROM jsonb_each(b) LOOP
+                valor_a := resultado -> chave;
+                IF jsonb_typeof(valor_a) = 'object' AND jsonb_typeof(valor_b) = 'object' THEN
+                    resultado := resultado || jsonb_build_object(chave, jsonb_deep_merge(valor_a, valor_b));
+                ELSE
+                    resultado := resultado || jsonb_build_object(chave, valor_b);
+                END IF;
+            END LOOP;
+
+            RETURN resultado;
+        END;
+        $$;
+
+        DO $$
+        BEGIN
+            CREATE AGGREGATE jsonb_deep_merge_agg(jsonb) (
+                SFUNC = jsonb_deep_merge,
+                STYPE = jsonb
+            );
+        EXCEPTION WHEN duplicate_function THEN
+            NULL;
+        END;
+        $$;
+
     """
     try:
         cursor.execute(creation_query)
@@ -89,3 +149,317 @@ def create_jsonb_merge_function(conn, cursor):
         print(f"Erro ao criar tabela ou índice: {e}")
         conn.rollback()
         exit(1)
+
+def create_narrow_tables(conn, cursor, table_name, schema='public', srid=4326, id_type="TEXT"):
+    """
+    Cria o layout normalizado, alternativo ao documento JSONB por ponto.
+
+    - `{table_name}_pontos`: um registro por ponto, com a geometria e o código do polígono de referência.
+    - `{table_name}_valores`: um registro por ponto, dado e data de execução.
+    - `medidas`: tabela de apoio com as unidades de medida.
+    - `{table_name}_jsonb`: visão de compatibilidade que apresenta os valores
+      no mesmo formato `{data: {dado: {valor, medida}}}` da coluna `raster`.
+
+    :param conn: Conexão com o banco de dados.
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome base das tabelas a serem criadas.
+    :param schema: Esquema das tabelas a serem criadas.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param id_type: Tipo do id dos pontos: "TEXT" ("x,y") ou "BIGINT" (célula da grade; ver `grid_ids`).
+    """
+
+    creation_query = f"""
+        CREATE SCHEMA IF NOT EXISTS {schema};
+
+        CREATE EXTENSION IF NOT EXISTS postgis;
+
+        CREATE TABLE IF NOT EXISTS {schema}.{table_name}_pontos (
+            id {id_type} PRIMARY KEY,
+            geom GEOMETRY(Point, {srid}),
+            ref_codigo TEXT
+        );
+
+        ALTER TABLE {schema}.{table_name}_pontos ADD COLUMN IF NOT EXISTS ref_codigo TEXT;
+
+        CREATE INDEX IF NOT EXISTS idx_{table_name}_pontos_geom
+            ON {schema}.{table_name}_pontos USING GIST (geom);
+
+        CREATE TABLE IF NOT EXISTS {schema}.medidas (
+            id SMALLSERIAL PRIMARY KEY,
+            medida TEXT NOT NULL UNIQUE
+        );
+
+        CREATE TABLE IF NOT EXISTS {schema}.{table_name}_valores (
+            point_id {id_type} NOT NULL,
+            dataset TEXT NOT NULL,
+            execution_date DATE NOT NULL,
+            valor DOUBLE PRECISION,
+            valor_texto TEXT,
+            medida_id SMALLINT REFERENCES {schema}.medidas (id),
+            PRIMARY KEY (point_id, dataset, execution_date)
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_{table_name}_valores_dataset
+            ON {schema}.{table_name}_valores (dataset, execution_date);
+
+        CREATE OR REPLACE VIEW {schema}.{table_name}_jsonb AS
+        SELECT p.id, p.geom, d.raster
+        FROM {schema}.{table_name}_pontos p
+        JOIN (
+            SELECT point_id, jsonb_object_agg(execution_date, datasets) AS raster
+            FROM (
+                SELECT
+                    v.point_id,
+                    to_char(v.execution_date, 'YYYY-MM-DD') AS execution_date,
+                    jsonb_object_agg(
+                        v.dataset,
+                        jsonb_strip_nulls(jsonb_build_object(
+                            'valor', COALESCE(to_jsonb(v.valor), to_jsonb(v.valor_texto)),
+                            'medida', m.medida
+                        ))
+                    ) AS datasets
+                FROM {schema}.{table_name}_valores v
+                LEFT JOIN {schema}.medidas m ON m.id = v.medida_id
+                GROUP BY v.point_id, v.execution_date
+            ) por_data
+            GROUP BY point_id
+        ) d ON d.point_id = p.id;
+    """
+
+    try:
+        cursor.execute(creation_query)
+        conn.commit()
+    except Exception as e:
+        print(f"Erro ao criar tabelas do layout normalizado: {e}")
+        conn.rollback()
+        exit(1)
+
+def create_reference_code_index(conn, cursor, table_name, schema='public', layout="jsonb"):
+    """
+    Cria o índice da coluna `ref_codigo`, com o código do polígono de referência
+    de cada ponto, para que as consultas por polígono (ex.: por município) não
+    precisem de junção espacial.
+
+    :param conn: Conexão com o banco de dados.
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela (ou nome base das tabelas, no layout "narrow").
+    :param schema: Esquema da tabela.
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    """
+
+    points_table = f"{table_name}_pontos" if layout == "narrow" else table_name
+    creation_query = f"""
+        CREATE INDEX IF NOT EXISTS idx_{points_table}_ref_codigo ON {schema}.{points_table} (ref_codigo);
+    """
+
+    try:
+        cursor.execute(creation_query)
+        conn.commit()
+    except Exception as e:
+        print(f"Erro ao criar índice do código de referência: {e}")
+        conn.rollback()
+        exit(1)
+
+def create_subdivided_table(conn, cursor, table_name, max_vertices=256, rebuild=False):
+    """
+    Cria a tabela derivada `{table_name}_subdividida`, com os polígonos de
+    referência divididos por `ST_Subdivide`, indexada e ordenada (CLUSTER)
+    pelo índice espacial.
+
+    Com polígonos pequenos o teste de caixa do índice GIST descarta quase
+    todas as partes, e cada verificação de ponto no polígono percorre poucos
+    vértices. As verificações no banco (ver `verify_point_locale`) usam essa
+    tabela como filtro e conferem os pontos sobre a borda das partes no
+    polígono original.
+
+    :param conn: Conexão com o banco de dados.
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela com os polígonos de referência.
+    :param max_vertices: Máximo de vértices de cada parte.
+    :param rebuild: Se True, recria a tabela mesmo que ela já exista (ex.: depois de carregar o shapefile).
+    """
+
+    subdivided_table = f"{table_name}_subdividida"
+
+    try:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (subdivided_table,))
+        if cursor.fetchone()[0] and not rebuild:
+            return
+
+        print(f"Criando tabela {subdivided_table}...")
+        cursor.execute(f"""
+            DROP TABLE IF EXISTS {subdivided_table};
+
+            CREATE TABLE {subdivided_table} AS
+            SELECT gid AS origem_gid, ST_Subdivide(geom, {int(max_vertices)}) AS geom
+            FROM {table_name}
+            WHERE geom IS NOT NULL;
+
+            ALTER TABLE {subdivided_table} ADD COLUMN id SERIAL PRIMARY KEY;
+            CREATE INDEX idx_{subdivided_table}_geom ON {subdivided_table} USING GIST (geom);
+            CLUSTER {subdivided_table} USING idx_{subdivided_table}_geom;
+            ANALYZE {subdivided_table};
+        """)
+        conn.commit()
+        forget_subdivided_table(table_name)
+    except Exception as e:
+        print(f"Erro ao criar tabela subdividida: {e}")
+        conn.rollback()
+
+def get_id_type(cursor, table_name, schema='public', layout="jsonb"):
+    """
+    Consulta o tipo da coluna de id da tabela de pontos já existente.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela (ou nome base das tabelas, no layout "narrow").
+    :param schema: Esquema da tabela.
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    :return: Tipo da coluna ("text", "bigint"...), ou None se a tabela não existe.
+    """
+
+    points_table = f"{table_name}_pontos" if layout == "narrow" else table_name
+    cursor.execute("""
+        SELECT data_type
+        FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s AND column_name = 'id'
+    """, (schema, points_table))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def migrate_to_cell_ids(conn, cursor, table_name, schema='public', srid=4326, layout="jsonb"):
+    """
+    Migra os pontos com id em texto ("x,y") para ids de célula da grade de referência (ver `grid_ids`).
+
+    A tabela nova é montada ao lado da atual e as duas trocam de nome no fim,
+    na mesma transação. Os pontos que caem na mesma célula viram um único
+    registro: no layout "jsonb" os documentos são mesclados com
+    `jsonb_deep_merge_agg`; no "narrow" fica um valor por célula, dado e data.
+    As tabelas antigas são mantidas com o sufixo `_texto`, para conferência.
+
+    Os índices e a visão do layout "narrow" são recriados em seguida por
+    `create_index`, `create_narrow_tables` e `create_reference_code_index`.
+
+    :param conn: Conexão com o banco de dados.
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela (ou nome base das tabelas, no layout "narrow").
+    :param schema: Esquema da tabela.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    """
+
+    if layout == "narrow":
+        migration_query = f"""
+            DROP VIEW IF EXISTS {schema}.{table_name}_jsonb;
+            DROP TABLE IF EXISTS {schema}.{table_name}_pontos_celulas, {schema}.{table_name}_valores_celulas;
+            ALTER TABLE {schema}.{table_name}_pontos ADD COLUMN IF NOT EXISTS ref_codigo TEXT;
+
+            CREATE TABLE {schema}.{table_name}_pontos_celulas (
+                id BIGINT PRIMARY KEY,
+                geom GEOMETRY(Point, {srid}),
+                ref_codigo TEXT
+            );
+
+            CREATE TEMP TABLE celulas_migracao ON COMMIT DROP AS
+            SELECT id, {cell_id_sql("geom", srid)} AS celula, geom, ref_codigo
+            FROM {schema}.{table_name}_pontos;
+
+            INSERT INTO {schema}.{table_name}_pontos_celulas (id, geom, ref_codigo)
+            SELECT DISTINCT ON (celula) celula, geom, ref_codigo
+            FROM celulas_migracao
+            ORDER BY celula, id;
+
+            CREATE TABLE {schema}.{table_name}_valores_celulas (
+                point_id BIGINT NOT NULL,
+                dataset TEXT NOT NULL,
+                execution_date DATE NOT NULL,
+                valor DOUBLE PRECISION,
+                valor_texto TEXT,
+                medida_id SMALLINT REFERENCES {schema}.medidas (id),
+                PRIMARY KEY (point_id, dataset, execution_date)
+            );
+
+            INSERT INTO {schema}.{table_name}_valores_celulas
+                (point_id, dataset, execution_date, valor, valor_texto, medida_id)
+            SELECT DISTINCT ON (c.celula, v.dataset, v.execution_date)
+                c.celula, v.dataset, v.execution_date, v.valor, v.valor_texto, v.medida_id
+            FROM {schema}.{table_name}_valores v
+            JOIN celulas_migracao c ON c.id = v.point_id
+            ORDER BY c.celula, v.dataset, v.execution_date, v.point_id DESC;
+
+            ALTER TABLE {schema}.{table_name}_pontos RENAME TO {table_name}_pontos_texto;
+            ALTER TABLE {schema}.{table_name}_valores RENAME TO {table_name}_valores_texto;
+            ALTER INDEX IF EXISTS {schema}.{table_name}_pontos_pkey RENAME TO {table_name}_pontos_texto_pkey;
+            ALTER INDEX IF EXISTS {schema}.{table_name}_valores_pkey RENAME TO {table_name}_valores_texto_pkey;
+            ALTER INDEX IF EXISTS {schema}.idx_{table_name}_pontos_geom RENAME TO idx_{table_name}_pontos_texto_geom;
+            ALTER INDEX IF EXISTS {schema}.idx_{table_name}_valores_dataset RENAME TO idx_{table_name}_valores_texto_dataset;
+            ALTER INDEX IF EXISTS {schema}.idx_{table_name}_pontos_ref_codigo RENAME TO idx_{table_name}_pontos_texto_ref_codigo;
+
+            ALTER TABLE {schema}.{table_name}_pontos_celulas RENAME TO {table_name}_pontos;
+            ALTER TABLE {schema}.{table_name}_valores_celulas RENAME TO {table_name}_valores;
+            ALTER INDEX {schema}.{table_name}_pontos_celulas_pkey RENAME TO {table_name}_pontos_pkey;
+            ALTER INDEX {schema}.{table_name}_valores_celulas_pkey RENAME TO {table_name}_valores_pkey;
+
+            ANALYZE {schema}.{table_name}_pontos;
+            ANALYZE {schema}.{table_name}_valores;
+        """
+    else:
+        migration_query = f"""
+            DROP TABLE IF EXISTS {schema}.{table_name}_celulas;
+            ALTER TABLE {schema}.{table_name} ADD COLUMN IF NOT EXISTS ref_codigo TEXT;
+
+            CREATE TABLE {schema}.{table_name}_celulas (
+                id BIGINT PRIMARY KEY,
+                geom GEOMETRY(Point, {srid}),
+                raster JSONB,
+                ref_codigo TEXT
+            );
+
+            INSERT INTO {schema}.{table_name}_celulas (id, geom, raster, ref_codigo)
+            SELECT
+                celula,
+                (array_agg(geom ORDER BY id))[1],
+                jsonb_strip_nulls(jsonb_deep_merge_agg(raster ORDER BY id)),
+                (array_agg(ref_codigo ORDER BY id) FILTER (WHERE ref_codigo IS NOT NULL))[1]
+            FROM (
+                SELECT {cell_id_sql("geom", srid)} AS celula, id, geom, raster, ref_codigo
+                FROM {schema}.{table_name}
+            ) AS origem
+            GROUP BY celula;
+
+            ALTER TABLE {schema}.{table_name} RENAME TO {table_name}_texto;
+            ALTER INDEX IF EXISTS {schema}.{table_name}_pkey RENAME TO {table_name}_texto_pkey;
+            ALTER INDEX IF EXISTS {schema}.idx_geom RENAME TO idx_{table_name}_texto_geom;
+            ALTER INDEX IF EXISTS {schema}.idx_{table_name}_ref_codigo RENAME TO idx_{table_name}_texto_ref_codigo;
+
+            ALTER TABLE {schema}.{table_name}_celulas RENAME TO {table_name};
+            ALTER INDEX {schema}.{table_name}_celulas_pkey RENAME TO {table_name}_pkey;
+
+            ANALYZE {schema}.{table_name};
+        """
+
+    # Pontos distintos que passam a dividir uma célula são mesclados; a contagem
+    # permite conferir se a grade de referência é compatível com os dados
+    points_table = f"{schema}.{table_name}_pontos" if layout == "narrow" else f"{schema}.{table_name}"
+    try:
+        cursor.execute(f"""
+            SELECT count(*), count(DISTINCT {cell_id_sql("geom", srid)})
+            FROM {points_table};
+        """)
+        points, cells = cursor.fetchone()
+        if points != cells:
+            print(f"⚠️ {points - cells} de {points} pontos de {table_name} caem na célula de outro ponto e serão mesclados.")
+    except Exception as e:
+        print(f"Erro ao verificar colisões de células: {e}")
+        conn.rollback()
+        exit(1)
+
+    try:
+        print(f"Migrando {table_name} para ids de célula...")
+        cursor.execute(migration_query)
+        conn.commit()
+    except Exception as e:
+        print(f"Erro ao migrar ids para células: {e}")
+        conn.rollback()
+        exit(1)
+
+    print("Migração concluída; os dados anteriores foram mantidos com o sufixo _texto.")
@@ -0,0 +1,107 @@
+import json
+import os
+import uuid
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyproj import CRS
+from .grid_ids import uses_cell_ids, cell_ids
+
+
+# WKB de um ponto 2D em little-endian: ordem dos bytes, tipo da geometria e coordenadas
+_WKB_POINT = np.dtype([("byte_order", "u1"), ("type", "<u4"), ("x", "<f8"), ("y", "<f8")])
+
+
+def wkb_points(x, y):
+    """
+    Monta, de forma vetorizada, o WKB de cada ponto.
+
+    :param x: Array de coordenadas x (longitude).
+    :param y: Array de coordenadas y (latitude).
+    :return: pyarrow.BinaryArray com um WKB de 21 bytes por ponto.
+    """
+
+    points = np.empty(len(x), dtype=_WKB_POINT)
+    points["byte_order"] = 1
+    points["type"] = 1
+    points["x"] = x
+    points["y"] = y
+
+    offsets = np.arange(len(x) + 1, dtype=np.int32) * _WKB_POINT.itemsize
+    return pa.Array.from_buffers(
+        pa.binary(),
+        len(x),
+        [None, pa.py_buffer(offsets), pa.py_buffer(points.tobytes())]
+    )
+
+def value_columns(values):
+    """
+    Separa os valores numéricos dos textuais (ex.: classes de solo dos shapefiles).
+
+    :return: Tupla (valores numéricos, valores textuais), com nulos onde o valor é do outro tipo.
+    """
+
+    values = np.asarray(values)
+    if values.dtype.kind in "biuf":
+        return pa.array(values.astype(np.float64)), pa.nulls(len(values), pa.string())
+
+    numeric = [v if isinstance(v, (int, float, np.number)) and not isinstance(v, bool) else None for v in values]
+    text = [None if n is not None or v is None else str(v) for n, v in zip(numeric, values)]
+    return pa.array(numeric, pa.float64()), pa.array(text, pa.string())
+
+def points_table(x, y, values, measure, srid=4326, codes=None):
+    """
+    Monta a tabela Arrow de um lote de pontos de um conjunto de dados. Com ids
+    de célula (ver `grid_ids`), inclui a coluna `cell_id`; com os códigos dos
+    polígonos de referência, a coluna `ref_codigo`.
+    """
+
+    valor, valor_texto = value_columns(values)
+    columns = {}
+    if uses_cell_ids():
+        columns["cell_id"] = pa.array(cell_ids(x, y, srid), pa.int64())
+    if codes is not None:
+        columns["ref_codigo"] = pa.array(codes, pa.string())
+    return pa.table({
+        **columns,
+        "x": pa.array(x, pa.float64()),
+        "y": pa.array(y, pa.float64()),
+        "valor": valor,
+        "valor_texto": valor_texto,
+        "medida": pa.array([measure] * len(x), pa.string()),
+        "geometry": wkb_points(x, y),
+    })
+
+def geo_metadata(table, srid):
+    """
+    Monta os metadados "geo" do GeoParquet 1.0 da coluna de geometria.
+    """
+
+    column = {"encoding": "WKB", "geometry_types": ["Point"]}
+    if len(table):
+        x = table.column("x").to_numpy()
+        y = table.column("y").to_numpy()
+        column["bbox"] = [float(x.min()), float(y.min()), float(x.max()), float(y.max())]
+    # Sem "crs" o GeoParquet assume OGC:CRS84, equivalente ao 4326 com longitude primeiro
+    if int(srid) != 4326:
+        column["crs"] = CRS.from_epsg(int(srid)).to_json_dict()
+
+    return {"version": "1.0.0", "primary_column": "geometry", "columns": {"geometry": column}}
+
+def write_geoparquet(output_dir, dataset, execution_date, tables, srid):
+    """
+    Grava os lotes acumulados de um conjunto de dados em um novo arquivo da partição
+    `dataset=<nome>/execution_date=<data>` de `output_dir`.
+    """
+
+    table = pa.concat_tables(tables)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"geo"] = json.dumps(geo_metadata(table, srid)).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    partition = os.path.join(output_dir, f"dataset={dataset}", f"execution_date={execution_date}")
+    os.makedirs(partition, exist_ok=True)
+    path = os.path.join(partition, f"part-{os.getpid()}-{uuid.uuid4().hex[:12]}.parquet")
+    temp_path = f"{path}.tmp"
+    pq.write_table(table, temp_path, compression="zstd")
+    os.replace(temp_path, path)
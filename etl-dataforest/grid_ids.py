@@ -0,0 +1,177 @@
+import threading
+import numpy as np
+from .config import ID_SCHEMES
+
+
+# Colunas por linha da grade: o id da célula é linha * CELL_COLUMNS + coluna
+CELL_COLUMNS = 2 ** 32
+
+# Distância máxima (em frações de célula) de um ponto a uma linha da grade para
+# que ele seja considerado sobre a linha. Os cantos dos pixels amostrados caem
+# exatamente nas linhas da grade, mas o ruído de ponto flutuante (ou um
+# cabeçalho com "cellsize 0.0083333333" em vez de 1/120) os deixa um pouco
+# antes ou depois delas; com o floor puro, metade deles mudaria de célula.
+SNAP_TOLERANCE = 1e-3
+
+_SCHEME = "text"
+# Grade de referência padrão: 30 segundos de arco (~1 km), como os rasters do AMBDATA
+_GRID = {"origin_x": -180.0, "origin_y": -90.0, "cell_size": 1 / 120, "srid": 4326}
+_LOCK = threading.Lock()
+
+
+def init_id_scheme(scheme="text", origin_x=-180.0, origin_y=-90.0, cell_size=1 / 120, srid=4326):
+    """
+    Define como são gerados os identificadores dos pontos.
+
+    No esquema "cell", o id é o número da célula da grade de referência que
+    contém o ponto, então o mesmo pixel vindo de rasters diferentes cai
+    sempre no mesmo registro, sem depender da formatação das coordenadas.
+
+    :param scheme: "text" ou "cell".
+    :param origin_x: Coordenada x do canto inferior esquerdo da grade de referência.
+    :param origin_y: Coordenada y do canto inferior esquerdo da grade de referência.
+    :param cell_size: Tamanho da célula, nas unidades do SRID.
+    :param srid: SRID da grade de referência (deve ser o mesmo dos pontos).
+    """
+
+    global _SCHEME
+
+    if scheme not in ID_SCHEMES:
+        raise ValueError(f"Esquema de identificadores não suportado: {scheme}")
+    if float(cell_size) <= 0:
+        raise ValueError("O tamanho da célula deve ser positivo.")
+
+    with _LOCK:
+        _SCHEME = scheme
+        _GRID.update(
+            origin_x=float(origin_x),
+            origin_y=float(origin_y),
+            cell_size=float(cell_size),
+            srid=int(srid)
+        )
+
+def get_id_settings():
+    """
+    Retorna o esquema e a grade de referência, para repassá-los aos processos filhos.
+
+    :return: Tupla (esquema, dicionário com origin_x, origin_y, cell_size e srid).
+    """
+
+    return _SCHEME, dict(_GRID)
+
+def id_scheme_signature():
+    """
+    Descreve o esquema de identificadores em texto, para o manifesto: no
+    esquema "cell" inclui a grade, porque outra grade muda todos os ids.
+
+    :return: "text" ou "cell:<origem x>:<origem y>:<tamanho da célula>:<srid>".
+    """
+
+    if _SCHEME != "cell":
+        return _SCHEME
+    return f"cell:{_GRID['origin_x']!r}:{_GRID['origin_y']!r}:{_GRID['cell_size']!r}:{_GRID['srid']}"
+
+def uses_cell_ids():
+    """
+    Indica se os pontos são identificados pelo número da célula da grade.
+    """
+
+    return _SCHEME == "cell"
+
+def id_sql_type():
+    """
+    Retorna o tipo da coluna de id no banco para o esquema atual.
+    """
+
+    return "BIGINT" if uses_cell_ids() else "TEXT"
+
+def _cell_index(offset):
+    """
+    Converte a distância à origem, em células, no índice da célula: os pontos
+    sobre uma linha da grade (a menos de `SNAP_TOLERANCE`) vão para o nó mais
+    próximo, os demais para a célula que os contém.
+    """
+
+    nearest = np.round(offset)
+    return np.where(np.abs(offset - nearest) <= SNAP_TOLERANCE, nearest, np.floor(offset))
+
+def cell_ids(x, y, srid=4326):
+    """
+    Calcula, de forma vetorizada, o número da célula da grade de referência de cada ponto.
+
+    Os pontos sobre uma linha da grade, como os cantos dos pixels de um raster
+    alinhado a ela, são arredondados para o nó mais próximo (ver
+    `SNAP_TOLERANCE`), então o mesmo pixel recebe sempre o mesmo id.
+
+    As coordenadas fora da faixa de 2^32 colunas ou linhas a partir da origem
+    são rejeitadas, para que dois pontos nunca compartilhem um id por estouro.
+
+    :param x: Array de coordenadas x (longitude).
+    :param y: Array de coordenadas y (latitude).
+    :param srid: SRID dos pontos (deve ser o mesmo da grade de referência).
+    :return: Array int64 com o id de cada ponto.
+    """
+
+    grid = _GRID
+    if int(srid) != grid["srid"]:
+        raise ValueError(f"Os pontos estão no SRID {srid}, mas a grade de referência está no SRID {grid['srid']}.")
+
+    columns = _cell_index((np.asarray(x, dtype=np.float64) - grid["origin_x"]) / grid["cell_size"])
+    rows = _cell_index((np.asarray(y, dtype=np.float64) - grid["origin_y"]) / grid["cell_size"])
+    if len(columns) and (
+        columns.min() < 0 or columns.max() >= CELL_COLUMNS or rows.min() < 0 or rows.max() >= 2 ** 31
+    ):
+        raise ValueError("Há pontos fora da grade de referência; ajuste a origem da grade (GRID_ORIGIN_X/Y).")
+
+    return rows.astype(np.int64) * CELL_COLUMNS + columns.astype(np.int64)
+
+def cell_id_sql(geom_column, srid=4326):
+    """
+    Monta a expressão SQL do número da célula de uma geometria, com a mesma
+    aritmética de `cell_ids`, usada na migração dos ids em texto.
+
+    :param geom_column: Nome da coluna de geometria (pontos).
+    :param srid: SRID dos pontos (deve ser o mesmo da grade de referência).
+    :return: Expressão SQL do tipo BIGINT.
+    """
+
+    grid = _GRID
+    if int(srid) != grid["srid"]:
+        raise ValueError(f"Os pontos estão no SRID {srid}, mas a grade de referência está no SRID {grid['srid']}.")
+
+    def index_sql(coordinate, origin):
+        offset = f"(({coordinate}({geom_column}) - {origin!r}::float8) / {grid['cell_size']!r}::float8)"
+        return (
+            f"(CASE WHEN abs({offset} - round({offset})) <= {SNAP_TOLERANCE!r}"
+            f" THEN round({offset}) ELSE floor({offset}) END)::bigint"
+        )
+
+    return f"({index_sql('ST_Y', grid['origin_y'])} * {CELL_COLUMNS} + {index_sql('ST_X', grid['origin_x'])})"
+
+def count_cell_collisions(ids):
+    """
+    Conta os pontos de um lote que caem na célula de outro ponto do mesmo lote.
+
+    Em um raster alinhado à grade, cada pixel amostrado deve ter a sua própria
+    célula; pontos repetidos seriam mesclados em um único registro na gravação.
+
+    :param ids: Array de ids de célula (ver `cell_ids`).
+    :return: Quantidade de pontos excedentes (0 quando todos os ids são únicos).
+    """
+
+    ids = np.asarray(ids)
+    return int(len(ids) - len(np.unique(ids)))
+
+def point_ids(xs, ys, srid=4326):
+    """
+    Gera os identificadores de um lote de pontos no esquema atual.
+
+    :param xs: Lista de coordenadas x (longitude).
+    :param ys: Lista de coordenadas y (latitude).
+    :param srid: SRID dos pontos.
+    :return: Lista de ids (textos "x,y" ou inteiros).
+    """
+
+    if uses_cell_ids():
+        return cell_ids(xs, ys, srid).tolist()
+    return [f"{x},{y}" for x, y in zip(xs, ys)]
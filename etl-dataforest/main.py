@@ -1,106 +1,305 @@
-import json
+import sys
 from concurrent.futures import ThreadPoolExecutor
-import os
-from dotenv import load_dotenv
 from datetime import datetime
 import pytz
-import psycopg2
+from .config import load_files
+from .connection_pool import init_pool, get_connection, close_pool
 from .verify_postgres_conection import is_postgis_enabled
-from .create_table import create_table, create_index, create_jsonb_merge_function
-from .send_shp_files_to_postgis import send_shp_files_to_postgis
-from .verify_file_type import verify_file_type
+from .create_table import create_table, create_index, create_jsonb_merge_function, create_narrow_tables, create_subdivided_table, get_id_type, migrate_to_cell_ids, create_reference_code_index
+from .manifest import create_manifest_table
+from .checkpoint import create_checkpoint_table
+from .verify_file_type import verify_file_type, verify_raster_group
+from .reference_cache import init_reference_cache, invalidate_reference_cache, get_reference_index, export_reference_shapefile, get_reference_code_column
+from . import metrics
+from . import sinks
+from .grid_ids import init_id_scheme, id_sql_type, uses_cell_ids
 
 
-# === Carrega variáveis de ambiente ===
-load_dotenv()
+# Importar este módulo não lê o .env, não abre conexões e não lê o files.json:
+# tudo vem do Config recebido por cada função (ver `config.load_config`).
 
-EXTERNAL_DB_NAME = os.getenv("EXTERNAL_DB_NAME", "reflorestamento")
-EXTERNAL_DB_USER = os.getenv("EXTERNAL_DB_USER", "dataforest")
-EXTERNAL_DB_PASSWORD = os.getenv("EXTERNAL_DB_PASSWORD", "dataforest")
-EXTERNAL_DB_HOST = os.getenv("EXTERNAL_DB_HOST", "localhost")
-EXTERNAL_DB_PORT = os.getenv("EXTERNAL_DB_PORT", "5432")
+def current_execution_date():
+    """
+    Retorna a data de execução da carga, no fuso de São Paulo.
 
-ASC_TABLE_NAME = os.getenv("ASC_TABLE_NAME", "dados_geoespaciais")
-ASC_SCHEMA = os.getenv("ASC_SCHEMA", "public")
-SRID = os.getenv("ASC_SRID", 4326)
+    :return: Data no formato AAAA-MM-DD.
+    """
 
-SHP_TABLE_NAME = os.getenv("SH_TABLE_NAME", "brasil")
-SHP_FILE_PATH = os.getenv("SH_FILE", None)
+    sao_paulo_tz = pytz.timezone("America/Sao_Paulo")
+    return datetime.now(sao_paulo_tz).strftime("%Y-%m-%d")
 
-ASC_SAMPLING_STRIDE = int(os.getenv("ASC_SAMPLING_STRIDE", 10))
-BATCH_SIZE = int(os.getenv("ASC_BATCH_SIZE", 1000))
+def configure(config):
+    """
+    Aplica a configuração aos módulos do ETL (identificadores, destino e cache de referência).
 
-# === Conexão com PostGIS ===
-CONN = psycopg2.connect(
-    dbname= EXTERNAL_DB_NAME,
-    user= EXTERNAL_DB_USER,
-    password= EXTERNAL_DB_PASSWORD,
-    host= EXTERNAL_DB_HOST,
-    port= EXTERNAL_DB_PORT
-)
-CURSOR = CONN.cursor()
+    :param config: Config da execução.
+    """
 
-with open("etl-dataforest/input_data/files.json", "r") as file:
-    FILES = json.load(file)
+    init_id_scheme(config.id_scheme, config.grid_origin_x, config.grid_origin_y, config.grid_cell_size, config.srid)
+    sinks.init_sink(config.sink, config.sink_output_dir)
+    init_reference_cache(config.reference_cache_dir, config.reference_code_column)
 
-def main():
-    sao_paulo_tz = pytz.timezone("America/Sao_Paulo")
-    execution_date = datetime.now(sao_paulo_tz).strftime("%Y-%m-%d")
-    print(execution_date)
+def init_database(config, pool_size=None):
+    """
+    Abre o pool de conexões com o PostGIS e verifica a extensão.
+
+    :param config: Config da execução.
+    :param pool_size: Quantidade máxima de conexões (default é `config.db_pool_size`).
+    """
+
+    init_pool(
+        pool_size or config.db_pool_size,
+        dbname=config.db_name,
+        user=config.db_user,
+        password=config.db_password,
+        host=config.db_host,
+        port=config.db_port
+    )
+
+    with get_connection() as (conn, cursor):
+        # Verifica a conexão com o banco de dados
+        is_postgis_enabled(cursor)
+
+def prepare_database(config):
+    """
+    Prepara o banco para a carga: cria as tabelas, carrega o shapefile de
+    referência e exporta os polígonos de referência para o cache.
+
+    :param config: Config da execução.
+    """
+
+    table_name, schema, layout = config.asc_table_name, config.asc_schema, config.layout
 
-    # Verifica a conexão com o banco de dados
-    is_postgis_enabled(CURSOR)
+    with get_connection() as (conn, cursor):
+        # Cria a função para mesclar JSONB
+        create_jsonb_merge_function(conn, cursor)
 
-    # Cria a tabela para os arquivos ASC
-    create_table(CONN, CURSOR, ASC_TABLE_NAME, ASC_SCHEMA, SRID)
-    # Cria o índice para os arquivos ASC
-    create_index(CONN, CURSOR, ASC_TABLE_NAME, ASC_SCHEMA)
-    # Cria a função para mesclar JSONB
-    create_jsonb_merge_function(CONN, CURSOR)
+        # Uma tabela com ids em texto precisa ser migrada antes de receber ids de célula
+        if uses_cell_ids() and get_id_type(cursor, table_name, schema, layout) == "text":
+            if not config.migrate_ids:
+                print(f"❌ A tabela {table_name} usa ids em texto. Execute com --migrate-ids para migrá-la para ids de célula.")
+                exit(1)
+            migrate_to_cell_ids(conn, cursor, table_name, schema, config.srid, layout)
+
+        if layout == "narrow":
+            # Cria as tabelas normalizadas e a visão de compatibilidade JSONB
+            create_narrow_tables(conn, cursor, table_name, schema, config.srid, id_sql_type())
+        else:
+            # Cria a tabela para os arquivos ASC
+            create_table(conn, cursor, table_name, schema, config.srid, id_sql_type())
+            # Cria o índice para os arquivos ASC
+            create_index(conn, cursor, table_name, schema)
+        # Indexa o código do polígono de referência de cada ponto
+        if get_reference_code_column():
+            create_reference_code_index(conn, cursor, table_name, schema, layout)
+        # Cria o manifesto das cargas já realizadas
+        create_manifest_table(conn, cursor, schema)
+        # Cria a tabela de checkpoints das janelas de raster
+        create_checkpoint_table(conn, cursor, schema)
+
+    load_reference(config)
+
+def load_reference(config):
+    """
+    Carrega o shapefile de referência (SH_FILE) no PostGIS, cria a tabela
+    subdividida de referência e exporta os polígonos para o cache.
+
+    :param config: Config da execução.
+    """
+
+    shp_table = config.shp_table_name
 
     # Cria a tabela para os arquivos SHP
+    loaded = False
+    if config.shp_file_path:
+        # O GeoPandas só é carregado quando há um shapefile a enviar
+        from .send_shp_files_to_postgis import send_shp_files_to_postgis
 
-    if SHP_FILE_PATH:
         # Envia o shapefile para o PostGIS
-        send_shp_files_to_postgis(
-            path=SHP_FILE_PATH,
-            table_name=SHP_TABLE_NAME,
-            db_host= EXTERNAL_DB_HOST,
-            db_name= EXTERNAL_DB_NAME,
-            db_port= EXTERNAL_DB_PORT,
-            db_user= EXTERNAL_DB_USER,
-            db_password= EXTERNAL_DB_PASSWORD,
-            srid=SRID
-        )
-        print(f"Tabela {SHP_TABLE_NAME} para o arquivo shapefile criada com sucesso!")
+        with get_connection() as (conn, cursor):
+            loaded = send_shp_files_to_postgis(
+                conn,
+                cursor,
+                path=config.shp_file_path,
+                table_name=shp_table,
+                srid=config.srid
+            )
+        if loaded:
+            print(f"Tabela {shp_table} para o arquivo shapefile criada com sucesso!")
+            # Os polígonos mudaram, então o cache de referência é descartado
+            invalidate_reference_cache(shp_table)
+
+    # Cria (ou recria, se o shapefile foi carregado) a tabela subdividida de referência
+    with get_connection() as (conn, cursor):
+        create_subdivided_table(conn, cursor, shp_table, config.reference_subdivide_max_vertices, rebuild=loaded)
+
+        # A coluna do código precisa existir na tabela de referência
+        code_column = get_reference_code_column()
+        if code_column:
+            cursor.execute("""
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = %s AND column_name = %s
+            """, (shp_table, code_column))
+            if cursor.fetchone() is None:
+                print(f"❌ A coluna {code_column} não existe na tabela {shp_table}.")
+                exit(1)
+
+    # Exporta os polígonos de referência para o cache, se ainda não estiverem lá
+    if config.clip_mode == "mask":
+        with get_connection() as (conn, cursor):
+            try:
+                get_reference_index(cursor, shp_table)
+            except Exception as e:
+                print(f"Erro ao carregar polígonos de referência: {e}")
+
+def prepare_reference(config):
+    """
+    Carrega os polígonos de referência sem o banco, para os destinos que não
+    gravam no PostGIS: do shapefile de referência, se informado, ou do cache.
+
+    :param config: Config da execução.
+    """
+
+    if config.clip_mode != "mask":
+        print(f"❌ CLIP_MODE={config.clip_mode} consulta o banco; use CLIP_MODE=mask com destinos sem banco.")
+        exit(1)
+
+    try:
+        if config.shp_file_path:
+            export_reference_shapefile(config.shp_table_name, config.shp_file_path, config.srid)
+        get_reference_index(None, config.shp_table_name)
+    except Exception as e:
+        print(f"❌ Erro ao carregar polígonos de referência: {e}")
+        print("Informe o shapefile em SH_FILE ou faça antes uma carga no PostGIS com REFERENCE_CACHE_DIR definido.")
+        exit(1)
+
+def run(config, files=None):
+    """
+    Executa a carga dos arquivos.
+
+    O pool de conexões só é aberto no destino "postgis", e o rasterio e o
+    GeoPandas só são importados se houver arquivos ASC ou SHP a processar.
+
+    :param config: Config da execução (ver `config.load_config`).
+    :param files: Dicionário {nome do dado: informações do arquivo}; se None, é lido de `config.files_path`.
+    """
+
+    if files is None:
+        files = load_files(config.files_path)
+
+    execution_date = current_execution_date()
+    print(execution_date)
+
+    metrics.init_metrics(config.metrics, config.progress, config.progress_interval)
+
+    configure(config)
+    if sinks.uses_database():
+        init_database(config)
+        prepare_database(config)
+    else:
+        # Sem banco: nenhuma conexão é aberta
+        prepare_reference(config)
 
     # Processa os arquivos ASC
     print("Iniciando processamento concorrente...")
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = {
-            executor.submit(
-                verify_file_type,
-                key,
-                value,
-                CONN,
-                CURSOR,
-                execution_date,
-                ASC_TABLE_NAME,
-                SHP_TABLE_NAME,
-                ASC_SAMPLING_STRIDE,
-                BATCH_SIZE,
-                SRID
-            ): key for key, value in FILES.items()
-        }
-        for future in futures:
-            future.result()
-
-    print("Processamento ASC concluído!")
-
-    # Fecha a conexão com o banco de dados
-    CURSOR.close()
-    CONN.close()
+    # Agrupa os arquivos ASC com a mesma grade
+    groups = []
+    if config.multi_layer and config.aggregation:
+        print("A agregação não é suportada no modo multicamada; os arquivos serão processados separadamente.")
+    elif config.multi_layer:
+        from .multi_layer import group_aligned_rasters
+
+        groups, files = group_aligned_rasters(files, config.raster_cache_dir)
+        if groups and config.execution_mode != "thread":
+            print(f"O modo multicamada usa sempre o pipeline de threads; o modo {config.execution_mode} "
+                  f"vale apenas para os arquivos fora dos grupos.")
+
+    try:
+        with ThreadPoolExecutor(max_workers=config.file_workers) as executor:
+            futures = [
+                executor.submit(
+                    verify_raster_group,
+                    group,
+                    execution_date,
+                    config.asc_table_name,
+                    config.shp_table_name,
+                    config.sampling_stride,
+                    config.batch_size,
+                    config.srid,
+                    config.clip_mode,
+                    config.chunk_workers,
+                    config.pipeline_options,
+                    config.force,
+                    config.resume,
+                    config.layout,
+                    config.roi
+                ) for group in groups
+            ]
+            futures += [
+                executor.submit(
+                    verify_file_type,
+                    key,
+                    value,
+                    execution_date,
+                    config.asc_table_name,
+                    config.shp_table_name,
+                    config.sampling_stride,
+                    config.batch_size,
+                    config.srid,
+                    config.clip_mode,
+                    config.chunk_workers,
+                    config.execution_mode,
+                    config.raster_workers,
+                    config.pipeline_options,
+                    config.raster_cache_dir,
+                    config.force,
+                    config.resume,
+                    config.layout,
+                    config.async_connections,
+                    config.aggregation,
+                    config.roi,
+                    config.shp_spacing_km
+                ) for key, value in files.items()
+            ]
+            for future in futures:
+                future.result()
+
+        # Grava os pontos ainda acumulados nos destinos em arquivo
+        sinks.flush_sink()
+        print("Processamento ASC concluído!")
+
+        if metrics.is_enabled():
+            metrics.write_run_report(
+                config.metrics_report_path,
+                execution_date=execution_date,
+                mode=config.execution_mode,
+                layout=config.layout,
+                multi_layer=config.multi_layer,
+                sink=config.sink,
+                id_scheme=config.id_scheme,
+                aggregation=config.aggregation,
+                roi=config.roi,
+                reference_code=config.reference_code_column
+            )
+            print(f"Relatório da execução gravado em {config.metrics_report_path}.")
+    finally:
+        # Encerra os processos do modo process, inclusive quando a carga falha
+        if config.execution_mode == "process":
+            from .raster_process_pool import shutdown_process_executor
+
+            shutdown_process_executor()
+        # Fecha as conexões com o banco de dados
+        close_pool()
+
+def main():
+    """
+    Mantém `python -m etl-dataforest.main [opções]` como atalho de `etl-dataforest run [opções]`.
+    """
+
+    from .cli import main as cli_main
+
+    cli_main(["run", *sys.argv[1:]])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,291 @@
+import hashlib
+import os
+
+
+# Arquivos auxiliares de um shapefile que também fazem parte da impressão digital
+SHAPEFILE_SIDECARS = (".shp", ".shx", ".dbf", ".prj", ".cpg")
+
+# Parâmetros da carga registrados no manifesto (ver `load_parameters`): se qualquer
+# um deles mudar, o conjunto de dados é carregado de novo
+LOAD_PARAMETERS = (
+    "sampling_stride", "srid", "storage_layout", "aggregation", "id_scheme", "reference_table", "shp_spacing_km"
+)
+
+
+def create_manifest_table(conn, cursor, schema='public'):
+    """
+    Cria a tabela de manifesto, que registra cada conjunto de dados já carregado.
+
+    :param conn: Conexão com o banco de dados.
+    :param cursor: Cursor do banco de dados.
+    :param schema: Esquema da tabela a ser criada.
+    """
+
+    creation_query = f"""
+        CREATE SCHEMA IF NOT EXISTS {schema};
+
+        CREATE TABLE IF NOT EXISTS {schema}.etl_manifest (
+            table_name TEXT NOT NULL,
+            dataset TEXT NOT NULL,
+            source_path TEXT NOT NULL,
+            source_size BIGINT NOT NULL,
+            source_mtime_ns BIGINT NOT NULL,
+            source_hash TEXT NOT NULL,
+            escala DOUBLE PRECISION,
+            medida TEXT,
+            sampling_stride INTEGER,
+            srid INTEGER,
+            storage_layout TEXT,
+            aggregation TEXT,
+            id_scheme TEXT,
+            reference_table TEXT,
+            shp_spacing_km DOUBLE PRECISION,
+            execution_date TEXT,
+            row_count BIGINT,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (table_name, dataset)
+        );
+
+        -- Manifestos criados antes do registro do layout, da agregação, dos ids e da referência;
+        -- as entradas antigas ficam com esses campos nulos e são recarregadas uma vez
+        ALTER TABLE {schema}.etl_manifest
+            ADD COLUMN IF NOT EXISTS storage_layout TEXT,
+            ADD COLUMN IF NOT EXISTS aggregation TEXT,
+            ADD COLUMN IF NOT EXISTS id_scheme TEXT,
+            ADD COLUMN IF NOT EXISTS reference_table TEXT,
+            ADD COLUMN IF NOT EXISTS shp_spacing_km DOUBLE PRECISION;
+    """
+
+    try:
+        cursor.execute(creation_query)
+        conn.commit()
+    except Exception as e:
+        print(f"Erro ao criar tabela de manifesto: {e}")
+        conn.rollback()
+        exit(1)
+
+def source_files(path):
+    """
+    Lista os arquivos que compõem uma fonte de dados.
+
+    Para shapefiles inclui os arquivos auxiliares (.dbf, .shx, ...), que guardam
+    os atributos e o índice das geometrias.
+
+    :param path: Caminho do arquivo de origem.
+    :return: Lista de caminhos existentes.
+    """
+
+    stem, ext = os.path.splitext(path)
+    if ext.lower() != ".shp":
+        return [path]
+
+    return [
+        stem + sidecar
+        for sidecar in SHAPEFILE_SIDECARS
+        if os.path.exists(stem + sidecar)
+    ]
+
+def file_fingerprint(path, previous=None):
+    """
+    Calcula a impressão digital (tamanho, data de modificação e hash) de uma fonte de dados.
+
+    Se o tamanho e a data de modificação forem os mesmos do manifesto anterior,
+    o hash registrado é reaproveitado sem reler o arquivo.
+
+    :param path: Caminho do arquivo de origem.
+    :param previous: Entrada anterior do manifesto (ver `get_manifest_entry`), opcional.
+    :return: Dicionário com source_size, source_mtime_ns e source_hash.
+    """
+
+    # Verifica se o arquivo existe
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Arquivo não encontrado: {path}")
+
+    files = source_files(path)
+    stats = [os.stat(file) for file in files]
+    size = sum(stat.st_size for stat in stats)
+    mtime_ns = max(stat.st_mtime_ns for stat in stats)
+
+    if previous and previous["source_size"] == size and previous["source_mtime_ns"] == mtime_ns:
+        return {
+            "source_size": size,
+            "source_mtime_ns": mtime_ns,
+            "source_hash": previous["source_hash"],
+        }
+
+    digest = hashlib.sha256()
+    for file in files:
+        with open(file, "rb") as source:
+            for block in iter(lambda: source.read(1024 * 1024), b""):
+                digest.update(block)
+
+    return {
+        "source_size": size,
+        "source_mtime_ns": mtime_ns,
+        "source_hash": digest.hexdigest(),
+    }
+
+def load_parameters(
+        path,
+        sampling_stride,
+        srid,
+        layout="jsonb",
+        aggregation=None,
+        id_scheme="text",
+        reference_table=None,
+        shp_spacing_km=None
+):
+    """
+    Reúne os parâmetros de uma carga que mudam os pontos gravados, para registrá-los
+    no manifesto e compará-los com os da carga anterior.
+
+    Os arquivos ASC não usam o espaçamento dos contornos, e os SHP não usam o
+    passo de amostragem nem a agregação: esses campos ficam None.
+
+    :param path: Caminho do arquivo de origem.
+    :param sampling_stride: Passo de amostragem dos arquivos ASC.
+    :param srid: SRID do sistema de referência espacial.
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    :param aggregation: Método de agregação dos arquivos ASC, ou None para amostrar.
+    :param id_scheme: Identificação dos pontos (ver `grid_ids.id_scheme_signature`).
+    :param reference_table: Nome da tabela de polígonos de referência.
+    :param shp_spacing_km: Espaçamento, em km, da reamostragem dos contornos dos arquivos SHP (None mantém os vértices).
+    :return: Dicionário com os campos de `LOAD_PARAMETERS`.
+    """
+
+    is_shapefile = os.path.splitext(path)[1].lower() == ".shp"
+    return {
+        "sampling_stride": None if is_shapefile else int(sampling_stride),
+        "srid": int(srid),
+        "storage_layout": layout,
+        "aggregation": None if is_shapefile else aggregation,
+        "id_scheme": id_scheme,
+        "reference_table": reference_table,
+        "shp_spacing_km": float(shp_spacing_km) if is_shapefile and shp_spacing_km else None,
+    }
+
+def get_manifest_entry(cursor, table_name, dataset):
+    """
+    Busca a entrada do manifesto de um conjunto de dados.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela onde os dados são inseridos.
+    :param dataset: Nome do conjunto de dados (chave do files.json).
+    :return: Dicionário com as colunas do manifesto, ou None se o conjunto nunca foi carregado.
+    """
+
+    columns = [
+        "source_path", "source_size", "source_mtime_ns", "source_hash", "escala", "medida",
+        *LOAD_PARAMETERS, "execution_date", "row_count"
+    ]
+    cursor.execute(f"""
+        SELECT {", ".join(columns)}
+        FROM etl_manifest
+        WHERE table_name = %s AND dataset = %s
+    """, (table_name, dataset))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+
+    return dict(zip(columns, row))
+
+def list_manifest(cursor, table_name):
+    """
+    Lista as cargas registradas no manifesto de uma tabela.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela onde os dados são inseridos.
+    :return: Lista de tuplas (conjunto de dados, data de execução, quantidade de pontos, atualização).
+    """
+
+    cursor.execute("""
+        SELECT dataset, execution_date, row_count, updated_at
+        FROM etl_manifest
+        WHERE table_name = %s
+        ORDER BY dataset
+    """, (table_name,))
+    return cursor.fetchall()
+
+def is_dataset_unchanged(entry, source_path, fingerprint, escala, medida, parameters):
+    """
+    Verifica se um conjunto de dados já foi carregado com a mesma fonte e os mesmos parâmetros.
+
+    :param entry: Entrada do manifesto (ou None).
+    :param source_path: Caminho do arquivo de origem.
+    :param fingerprint: Impressão digital atual (ver `file_fingerprint`).
+    :param escala: Fator de escala para o valor.
+    :param medida: Unidade de medida do dado.
+    :param parameters: Parâmetros da carga (ver `load_parameters`).
+    :return: True se o carregamento pode ser pulado.
+    """
+
+    if entry is None:
+        return False
+
+    return (
+        entry["source_path"] == source_path
+        and entry["source_hash"] == fingerprint["source_hash"]
+        and entry["escala"] == float(escala)
+        and entry["medida"] == medida
+        and all(entry.get(name) == parameters[name] for name in LOAD_PARAMETERS)
+    )
+
+def record_manifest(
+        conn,
+        cursor,
+        table_name,
+        dataset,
+        source_path,
+        fingerprint,
+        escala,
+        medida,
+        parameters,
+        execution_date,
+        row_count
+):
+    """
+    Registra no manifesto um conjunto de dados carregado com sucesso.
+
+    :param conn: Conexão com o banco de dados.
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela onde os dados foram inseridos.
+    :param dataset: Nome do conjunto de dados (chave do files.json).
+    :param source_path: Caminho do arquivo de origem.
+    :param fingerprint: Impressão digital da fonte (ver `file_fingerprint`).
+    :param escala: Fator de escala para o valor.
+    :param medida: Unidade de medida do dado.
+    :param parameters: Parâmetros da carga (ver `load_parameters`).
+    :param execution_date: Data de execução do carregamento.
+    :param row_count: Quantidade de pontos gravados (na retomada, incluindo os das janelas já gravadas antes).
+    """
+
+    columns = [
+        "table_name", "dataset", "source_path", "source_size", "source_mtime_ns", "source_hash",
+        "escala", "medida", *LOAD_PARAMETERS, "execution_date", "row_count"
+    ]
+    updates = ",\n                ".join(f"{column} = EXCLUDED.{column}" for column in columns[2:])
+
+    try:
+        cursor.execute(f"""
+            INSERT INTO etl_manifest ({", ".join(columns)})
+            VALUES ({", ".join(["%s"] * len(columns))})
+            ON CONFLICT (table_name, dataset) DO UPDATE SET
+                {updates},
+                updated_at = now();
+        """, (
+            table_name,
+            dataset,
+            source_path,
+            fingerprint["source_size"],
+            fingerprint["source_mtime_ns"],
+            fingerprint["source_hash"],
+            float(escala),
+            medida,
+            *(parameters[name] for name in LOAD_PARAMETERS),
+            execution_date,
+            row_count
+        ))
+        conn.commit()
+    except Exception as e:
+        print(f"Erro ao registrar manifesto de {dataset}: {e}")
+        conn.rollback()
@@ -0,0 +1,251 @@
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+# Métricas desligadas por padrão: `stage` e `count` retornam sem registrar nada
+_ENABLED = False
+_PROGRESS = False
+_PROGRESS_INTERVAL = 10
+
+_LOCK = threading.Lock()
+_DATASETS = {}
+_RUN_STARTED = None
+
+_NULL_STAGE = nullcontext()
+
+
+def init_metrics(enabled=False, progress=False, progress_interval=10):
+    """
+    Liga ou desliga a coleta de métricas e o acompanhamento de progresso.
+
+    :param enabled: Se True, registra tempos por etapa e contadores de cada conjunto de dados.
+    :param progress: Se True, imprime periodicamente o progresso e a estimativa de término de cada conjunto.
+    :param progress_interval: Intervalo mínimo, em segundos, entre duas impressões de progresso do mesmo conjunto.
+    """
+
+    global _ENABLED, _PROGRESS, _PROGRESS_INTERVAL, _RUN_STARTED
+
+    with _LOCK:
+        _ENABLED = enabled or progress
+        _PROGRESS = progress
+        _PROGRESS_INTERVAL = progress_interval
+        _RUN_STARTED = time.time()
+        _DATASETS.clear()
+
+def is_enabled():
+    """
+    Indica se a coleta de métricas está ligada, para repassá-la aos processos filhos.
+    """
+
+    return _ENABLED
+
+def _entry(dataset):
+    """
+    Retorna as métricas de um conjunto de dados, criando-as no primeiro uso. Deve ser chamada com `_LOCK`.
+    """
+
+    now = time.time()
+    entry = _DATASETS.get(dataset)
+    if entry is None:
+        entry = _DATASETS[dataset] = {
+            "stages": {},
+            "counters": {},
+            "started": now,
+            "finished": now,
+            "windows_total": 0,
+            "windows_done": 0,
+            "last_progress": 0.0,
+        }
+    entry["finished"] = now
+    return entry
+
+@contextmanager
+def _timed(dataset, name):
+    """
+    Soma à etapa o tempo gasto dentro do contexto.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _LOCK:
+            stages = _entry(dataset)["stages"]
+            stages[name] = stages.get(name, 0.0) + elapsed
+
+def stage(dataset, name):
+    """
+    Mede o tempo de uma etapa do processamento de um conjunto de dados.
+
+    Os tempos de uma mesma etapa são somados entre chamadas e threads. Com as
+    métricas desligadas retorna um contexto vazio.
+
+    :param dataset: Nome do conjunto de dados.
+    :param name: Nome da etapa (ex.: "read", "sample", "clip", "upsert").
+    :return: Gerenciador de contexto.
+    """
+
+    if not _ENABLED:
+        return _NULL_STAGE
+    return _timed(dataset, name)
+
+def count(dataset, name, amount=1):
+    """
+    Soma um valor a um contador de um conjunto de dados.
+
+    :param dataset: Nome do conjunto de dados.
+    :param name: Nome do contador (ex.: "points_written", "batches_failed").
+    :param amount: Valor a somar.
+    """
+
+    if not _ENABLED:
+        return
+
+    with _LOCK:
+        counters = _entry(dataset)["counters"]
+        counters[name] = counters.get(name, 0) + int(amount)
+
+def set_total(dataset, windows_total):
+    """
+    Define a quantidade de janelas a processar de um conjunto de dados, usada na estimativa de término.
+
+    :param dataset: Nome do conjunto de dados.
+    :param windows_total: Quantidade de janelas.
+    """
+
+    if not _ENABLED:
+        return
+
+    with _LOCK:
+        _entry(dataset)["windows_total"] += windows_total
+
+def advance(dataset, windows=1):
+    """
+    Registra janelas concluídas de um conjunto de dados e, com o progresso
+    ligado, imprime o andamento e a estimativa de término.
+
+    :param dataset: Nome do conjunto de dados.
+    :param windows: Quantidade de janelas concluídas.
+    """
+
+    if not _ENABLED:
+        return
+
+    with _LOCK:
+        entry = _entry(dataset)
+        entry["windows_done"] += windows
+        done = entry["windows_done"]
+        total = entry["windows_total"]
+        now = time.time()
+        if not _PROGRESS or (now - entry["last_progress"] < _PROGRESS_INTERVAL and done < total):
+            return
+        entry["last_progress"] = now
+        elapsed = now - entry["started"]
+        written = entry["counters"].get("points_written", 0)
+
+    message = f"[progresso] {dataset}: {done}/{total or '?'} janelas"
+    if total:
+        message += f" ({done / total:.0%})"
+    if elapsed > 0:
+        message += f", {written / elapsed:.0f} pontos/s"
+    if total and done:
+        message += f", ETA {elapsed / done * (total - done):.0f}s"
+    print(message)
+
+def take_snapshot():
+    """
+    Retira as métricas acumuladas neste processo, para enviá-las ao processo principal.
+
+    :return: Dicionário serializável (ver `merge_snapshot`); vazio com as métricas desligadas.
+    """
+
+    if not _ENABLED:
+        return {}
+
+    with _LOCK:
+        snapshot = {
+            dataset: {
+                "stages": dict(entry["stages"]),
+                "counters": dict(entry["counters"]),
+                "started": entry["started"],
+                "finished": entry["finished"],
+            }
+            for dataset, entry in _DATASETS.items()
+        }
+        _DATASETS.clear()
+    return snapshot
+
+def merge_snapshot(snapshot):
+    """
+    Soma às métricas deste processo as métricas retiradas de um processo filho.
+
+    :param snapshot: Dicionário retornado por `take_snapshot`.
+    """
+
+    if not _ENABLED or not snapshot:
+        return
+
+    with _LOCK:
+        for dataset, metrics in snapshot.items():
+            entry = _entry(dataset)
+            for name, elapsed in metrics["stages"].items():
+                entry["stages"][name] = entry["stages"].get(name, 0.0) + elapsed
+            for name, amount in metrics["counters"].items():
+                entry["counters"][name] = entry["counters"].get(name, 0) + amount
+            entry["started"] = min(entry["started"], metrics["started"])
+            entry["finished"] = max(entry["finished"], metrics["finished"])
+
+def run_report(**extra):
+    """
+    Monta o relatório da execução: tempos por etapa, contadores e vazão de cada conjunto de dados.
+
+    Os tempos das etapas são somados entre threads e processos, então podem
+    ultrapassar a duração do conjunto, que é medida do primeiro ao último registro.
+
+    :param extra: Campos adicionais do relatório (ex.: data de execução, modo).
+    :return: Dicionário serializável em JSON.
+    """
+
+    with _LOCK:
+        finished = time.time()
+        datasets = {}
+        totals = {}
+        for dataset, entry in _DATASETS.items():
+            duration = entry["finished"] - entry["started"]
+            written = entry["counters"].get("points_written", 0)
+            datasets[dataset] = {
+                "duration_s": round(duration, 3),
+                "stages_s": {name: round(elapsed, 3) for name, elapsed in entry["stages"].items()},
+                "counters": dict(entry["counters"]),
+                "rows_per_s": round(written / duration, 1) if duration > 0 else None,
+            }
+            for name, amount in entry["counters"].items():
+                totals[name] = totals.get(name, 0) + amount
+
+        duration = finished - _RUN_STARTED if _RUN_STARTED else None
+        return {
+            **extra,
+            "started_at": _RUN_STARTED,
+            "finished_at": finished,
+            "duration_s": round(duration, 3) if duration is not None else None,
+            "totals": totals,
+            "rows_per_s": round(totals.get("points_written", 0) / duration, 1) if duration else None,
+            "datasets": datasets,
+        }
+
+def write_run_report(path, **extra):
+    """
+    Grava o relatório da execução em JSON.
+
+    :param path: Caminho do arquivo do relatório.
+    :param extra: Campos adicionais do relatório (ver `run_report`).
+    :return: Relatório gravado.
+    """
+
+    report = run_report(**extra)
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    return report
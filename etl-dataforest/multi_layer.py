@@ -0,0 +1,311 @@
+import os
+import threading
+from collections import namedtuple
+from contextlib import ExitStack
+import numpy as np
+import rasterio
+from .asc_functions import (
+    sampling_offsets, sampled_coordinates, check_cell_collisions, raster_windows, load_roi, pipeline_queue_size
+)
+from .bulk_loader import upsert_layered_points
+from .checkpoint import prepare_checkpoints, mark_window_committed
+from .clip_mask import build_raster_clip_mask, window_clip_mask, mask_codes
+from .connection_pool import get_connection
+from .pipeline import run_pipeline
+from .raster_cache import get_cached_raster
+from .verify_point_locale import points_in_polygon, locate_points
+from .reference_cache import get_reference_code_column
+from . import metrics
+from . import sinks
+
+
+# Lote colunar de pontos com vários dados: para cada dado, um array de valores e um de validade,
+# e o código do polígono de referência de cada ponto (opcional)
+LayeredBatch = namedtuple("LayeredBatch", ["x", "y", "values", "valid", "code"], defaults=(None,))
+
+
+def grid_signature(raster_path):
+    """
+    Descreve a grade de um raster: dimensões, transformação e sistema de referência.
+
+    :param raster_path: Caminho do arquivo raster.
+    :return: Tupla comparável entre rasters.
+    """
+
+    with rasterio.open(raster_path) as src:
+        crs = src.crs.to_string() if src.crs else None
+        return src.width, src.height, tuple(src.transform)[:6], crs
+
+def group_aligned_rasters(files, raster_cache_dir=None):
+    """
+    Agrupa os arquivos ASC que compartilham a mesma grade.
+
+    :param files: Dicionário do files.json (nome do dado -> informações do arquivo).
+    :param raster_cache_dir: Diretório do cache de GeoTIFF dos arquivos ASC (opcional).
+    :return: Tupla (grupos, demais), em que cada grupo é uma lista de tuplas
+        (nome, informações, caminho do raster) com pelo menos dois rasters e
+        `demais` é um dicionário com os arquivos que não fazem parte de um grupo
+        (entre eles os arquivos com agregação própria, na chave "agregacao").
+    """
+
+    by_grid = {}
+    others = {}
+    for key, value in files.items():
+        if os.path.splitext(value['path'])[1].lower() != '.asc' or value.get('agregacao'):
+            others[key] = value
+            continue
+
+        raster_path = value['path']
+        if raster_cache_dir:
+            raster_path = get_cached_raster(raster_path, raster_cache_dir)
+        by_grid.setdefault(grid_signature(raster_path), []).append((key, value, raster_path))
+
+    groups = []
+    for members in by_grid.values():
+        if len(members) > 1:
+            groups.append(members)
+        else:
+            key, value, _ = members[0]
+            others[key] = value
+
+    return groups, others
+
+def read_layers_in_blocks(raster_paths, skip_windows=None, name=None, roi=None):
+    """
+    Lê a mesma janela de vários rasters alinhados.
+
+    :param raster_paths: Caminhos dos rasters, todos com a mesma grade.
+    :param skip_windows: Identificadores de janelas que não devem ser lidas (ver `checkpoint.window_id`).
+    :param name: Nome do grupo de dados, usado nas métricas (opcional).
+    :param roi: Polígonos de referência (ver `asc_functions.load_roi`); se informado, lê só as janelas que os tocam.
+    :return: Um gerador que produz tuplas (lista de dados, transformação, janela, lista de nodata).
+    """
+
+    with ExitStack() as stack:
+        sources = [stack.enter_context(rasterio.open(path)) for path in raster_paths]
+        first = sources[0]
+        nodatas = [src.nodata for src in sources]
+        windows = raster_windows(first, skip_windows=skip_windows, roi=roi)
+        metrics.set_total(name, len(windows))
+        for window in windows:
+            with metrics.stage(name, "read"):
+                blocks = [src.read(1, window=window) for src in sources]
+            yield blocks, first.transform, window, nodatas
+
+def sample_layers(blocks, transform, window, scales, sampling_stride=10, nodatas=None, clip_mask=None):
+    """
+    Amostra a mesma janela de vários rasters de forma vetorizada.
+
+    Um ponto é mantido quando pelo menos um dos dados é válido nele; a validade
+    de cada dado em cada ponto vai junto no lote.
+
+    :param blocks: Lista com os dados do bloco de cada raster.
+    :param transform: Transformação dos rasters.
+    :param window: Janela dos rasters.
+    :param scales: Fator de escala de cada raster.
+    :param sampling_stride: Passo de amostragem para os dados.
+    :param nodatas: Valor de nodata de cada raster (None se não houver).
+    :param clip_mask: Máscara de recorte de todo o raster (opcional).
+    :return: LayeredBatch com os pontos válidos do bloco.
+    """
+
+    row_start, col_start = sampling_offsets(window, sampling_stride)
+    nodatas = nodatas or [None] * len(blocks)
+
+    sampled_layers = []
+    valid_layers = []
+    for values, nodata in zip(blocks, nodatas):
+        sampled = values[row_start::sampling_stride, col_start::sampling_stride]
+        valid = ~np.isnan(sampled)
+        if nodata is not None:
+            valid &= sampled != nodata
+        sampled_layers.append(sampled)
+        valid_layers.append(valid)
+
+    keep = np.logical_or.reduce(valid_layers)
+    if clip_mask is not None:
+        block_mask = window_clip_mask(clip_mask, window, blocks[0].shape)
+        keep &= block_mask[row_start::sampling_stride, col_start::sampling_stride]
+
+    rows, cols = np.nonzero(keep)
+    x, y = sampled_coordinates(rows, cols, transform, window, sampling_stride)
+
+    return LayeredBatch(
+        x,
+        y,
+        [sampled[keep] * scale for sampled, scale in zip(sampled_layers, scales)],
+        [valid[keep] for valid in valid_layers],
+        mask_codes(clip_mask, window, rows * sampling_stride + row_start, cols * sampling_stride + col_start)
+    )
+
+def filter_layered_batch_by_query(cursor, batch, shp_table, srid=4326):
+    """
+    Mantém apenas os pontos do lote que estão dentro dos polígonos, com uma consulta ao banco por lote.
+
+    :param cursor: Cursor do banco de dados.
+    :param batch: LayeredBatch a ser filtrado.
+    :param shp_table: Nome da tabela de polígonos para verificação espacial.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :return: LayeredBatch com os pontos dentro dos polígonos.
+    """
+
+    code_column = get_reference_code_column()
+    if code_column is None:
+        inside = points_in_polygon(cursor, batch.x, batch.y, shp_table, srid)
+        codes = None
+    else:
+        inside, codes = locate_points(cursor, batch.x, batch.y, shp_table, code_column, srid)
+    return LayeredBatch(
+        batch.x[inside],
+        batch.y[inside],
+        [values[inside] for values in batch.values],
+        [valid[inside] for valid in batch.valid],
+        codes[inside] if codes is not None else None
+    )
+
+def process_raster_group(
+        group,
+        table_name,
+        shp_table,
+        execution_date,
+        sampling_stride=10,
+        batch_size=1000,
+        srid=4326,
+        clip_mode="mask",
+        chunk_workers=8,
+        transform_workers=2,
+        queue_size=8,
+        resume=False,
+        layout="jsonb",
+        roi=False,
+        max_memory_mb=None
+    ):
+    """
+    Processa juntos vários rasters alinhados, gravando cada ponto uma única vez.
+
+    Lê a mesma janela de todos os rasters, monta o documento do ponto com
+    todos os dados e o grava de uma vez, em vez de um upsert (e um
+    `jsonb_deep_merge`) por dado.
+
+    :param group: Lista de tuplas (nome, informações, caminho do raster) com a mesma grade.
+    :param table_name: Nome da tabela onde os dados serão inseridos.
+    :param shp_table: Nome da tabela de polígonos para verificação espacial.
+    :param execution_date: Data de execução para o registro.
+    :param sampling_stride: Passo de amostragem para os dados.
+    :param batch_size: Tamanho do lote para inserção no banco de dados.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param clip_mode: "mask" para recortar com a máscara em memória ou "query" para consultar os pontos no banco, uma consulta por lote.
+    :param chunk_workers: Quantidade de threads que gravam os pontos, cada uma com sua conexão.
+    :param transform_workers: Quantidade de threads que amostram e recortam os blocos.
+    :param queue_size: Capacidade de cada fila do pipeline.
+    :param resume: Se True, pula as janelas já gravadas em uma execução anterior da mesma data.
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    :param roi: Se True, lê apenas as janelas que tocam os polígonos de referência.
+    :param max_memory_mb: Teto de memória, em MB, para os blocos em fila, somadas as camadas. Se definido,
+        substitui `queue_size`.
+    :return: Tupla (pontos gravados por dado, pontos cujo lote falhou).
+    """
+
+    names = [key for key, _, _ in group]
+    measures = [value['medida'] for _, value, _ in group]
+    scales = [value['escala'] for _, value, _ in group]
+    raster_paths = [raster_path for _, _, raster_path in group]
+    group_name = "+".join(names)
+
+    print(f"Iniciando processamento conjunto de {', '.join(names)}...")
+
+    # Os rasters têm a mesma grade, então uma única máscara serve para todos
+    clip_mask = None
+    if clip_mode == "mask":
+        with metrics.stage(group_name, "clip_mask"), sinks.sink_connection() as (conn, cursor):
+            clip_mask = build_raster_clip_mask(conn, cursor, raster_paths[0], shp_table)
+
+    # Janelas já gravadas, na retomada
+    skip_windows = prepare_checkpoints(table_name, group_name, execution_date, resume)
+
+    # Polígonos de referência, para ler só as janelas que os tocam
+    reference = load_roi(shp_table) if roi else None
+
+    def transform_block(item):
+        blocks, transform, window, nodatas = item
+        with metrics.stage(group_name, "sample"):
+            batch = sample_layers(blocks, transform, window, scales, sampling_stride, nodatas, clip_mask)
+        metrics.count(group_name, "points_sampled", len(batch.x))
+        check_cell_collisions(batch, group_name, srid)
+
+        # Sem máscara, os pontos são verificados no banco
+        if clip_mask is None and len(batch.x):
+            sampled = len(batch.x)
+            with metrics.stage(group_name, "clip"), get_connection() as (conn, cursor):
+                batch = filter_layered_batch_by_query(cursor, batch, shp_table, srid)
+            metrics.count(group_name, "points_clipped", sampled - len(batch.x))
+
+        return window, batch
+
+    totals = {"written": dict.fromkeys(names, 0), "failed": 0}
+    totals_lock = threading.Lock()
+
+    def write_block(item):
+        window, batch = item
+        if not sinks.uses_database():
+            written = sinks.write_layered_points(batch, names, measures, execution_date, group_name, srid)
+            with totals_lock:
+                for name in names:
+                    totals["written"][name] += written[name]
+            metrics.advance(group_name)
+            return
+
+        xs = batch.x.tolist()
+        ys = batch.y.tolist()
+        values = [layer.tolist() for layer in batch.values]
+        valid = [layer.tolist() for layer in batch.valid]
+        codes = batch.code.tolist() if batch.code is not None else None
+        written = dict.fromkeys(names, 0)
+        failed = 0
+
+        with get_connection() as (conn, cursor):
+            for start in range(0, len(xs), batch_size):
+                end = start + batch_size
+                layers = [
+                    (name, measure, layer_values[start:end], layer_valid[start:end])
+                    for name, measure, layer_values, layer_valid in zip(names, measures, values, valid)
+                ]
+                try:
+                    with metrics.stage(group_name, "upsert"):
+                        batch_written = upsert_layered_points(
+                            cursor, table_name, xs[start:end], ys[start:end], layers, execution_date, srid, layout,
+                            codes[start:end] if codes is not None else None
+                        )
+                        conn.commit()
+                    for name, _, _, layer_valid in layers:
+                        written[name] += sum(layer_valid)
+                    metrics.count(group_name, "points_written", batch_written)
+                    metrics.count(group_name, "batches_committed")
+                except Exception as e:
+                    print(f"Erro ao inserir no PostGIS: {e}")
+                    conn.rollback()
+                    failed += len(xs[start:end])
+                    metrics.count(group_name, "points_failed", len(xs[start:end]))
+                    metrics.count(group_name, "batches_failed")
+
+            if not failed:
+                with metrics.stage(group_name, "checkpoint"):
+                    mark_window_committed(conn, cursor, table_name, group_name, execution_date, window, written)
+
+        with totals_lock:
+            for name in names:
+                totals["written"][name] += written[name]
+            totals["failed"] += failed
+        metrics.advance(group_name)
+
+    run_pipeline(
+        read_layers_in_blocks(raster_paths, skip_windows, group_name, reference),
+        transform_block,
+        write_block,
+        transform_workers=transform_workers,
+        write_workers=chunk_workers,
+        queue_size=pipeline_queue_size(raster_paths, max_memory_mb, queue_size, sampling_stride)
+    )
+
+    print(f"Finalizado processamento conjunto de {', '.join(names)}.")
+    return totals["written"], totals["failed"]
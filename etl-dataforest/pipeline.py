@@ -0,0 +1,126 @@
+import queue
+import threading
+
+
+# Marca o fim dos itens de uma fila
+_END = object()
+
+# Intervalo, em segundos, para as threads bloqueadas verificarem se o pipeline foi interrompido
+_POLL_INTERVAL = 0.5
+
+
+def _put(target_queue, item, stop_event):
+    """
+    Coloca um item na fila, esperando enquanto ela estiver cheia.
+
+    :return: False se o pipeline foi interrompido antes de conseguir colocar o item.
+    """
+
+    while not stop_event.is_set():
+        try:
+            target_queue.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(source_queue, stop_event):
+    """
+    Retira um item da fila, esperando enquanto ela estiver vazia.
+
+    :return: O item, ou _END se o pipeline foi interrompido.
+    """
+
+    while not stop_event.is_set():
+        try:
+            return source_queue.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+    return _END
+
+def run_pipeline(source, transform, write, transform_workers=1, write_workers=1, queue_size=8):
+    """
+    Executa um pipeline produtor/consumidor em três estágios: leitura, transformação e escrita.
+
+    Os estágios são ligados por filas limitadas a `queue_size` itens. Quando
+    um estágio mais lento não acompanha o anterior, a fila enche e o estágio
+    anterior espera, então no máximo `2 * queue_size` itens (mais os itens em
+    processamento) ficam em memória, independente do tamanho da entrada.
+
+    Se algum estágio falhar, o pipeline é interrompido e o erro é relançado.
+
+    :param source: Iterável que produz os itens de entrada (estágio de leitura).
+    :param transform: Função aplicada a cada item lido. Se retornar None, o item é descartado.
+    :param write: Função que recebe cada item transformado.
+    :param transform_workers: Quantidade de threads de transformação.
+    :param write_workers: Quantidade de threads de escrita.
+    :param queue_size: Capacidade de cada fila entre os estágios.
+    """
+
+    read_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    errors = []
+
+    def fail(error):
+        errors.append(error)
+        stop_event.set()
+
+    def read_stage():
+        try:
+            for item in source:
+                if not _put(read_queue, item, stop_event):
+                    return
+        except Exception as e:
+            fail(e)
+        finally:
+            for _ in range(transform_workers):
+                _put(read_queue, _END, stop_event)
+
+    def transform_stage():
+        try:
+            while True:
+                item = _get(read_queue, stop_event)
+                if item is _END:
+                    return
+                result = transform(item)
+                if result is not None and not _put(write_queue, result, stop_event):
+                    return
+        except Exception as e:
+            fail(e)
+
+    def write_stage():
+        try:
+            while True:
+                item = _get(write_queue, stop_event)
+                if item is _END:
+                    return
+                write(item)
+        except Exception as e:
+            fail(e)
+
+    reader = threading.Thread(target=read_stage, name="pipeline-leitura")
+    transformers = [
+        threading.Thread(target=transform_stage, name=f"pipeline-transformacao-{i}")
+        for i in range(transform_workers)
+    ]
+    writers = [
+        threading.Thread(target=write_stage, name=f"pipeline-escrita-{i}")
+        for i in range(write_workers)
+    ]
+
+    for thread in [reader, *transformers, *writers]:
+        thread.start()
+
+    reader.join()
+    for thread in transformers:
+        thread.join()
+
+    # Só depois que todas as transformações terminaram a escrita pode ser encerrada
+    for _ in range(write_workers):
+        _put(write_queue, _END, stop_event)
+    for thread in writers:
+        thread.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,81 @@
+import glob
+import hashlib
+import os
+import threading
+import rasterio
+from rasterio.shutil import copy as raster_copy
+
+
+# Tamanho dos blocos (tiles) do GeoTIFF gerado
+CACHE_TILE_SIZE = 256
+
+
+def cache_key(path):
+    """
+    Gera a chave de cache de um arquivo a partir do caminho, data de modificação e tamanho.
+
+    :param path: Caminho do arquivo de origem.
+    :return: Tupla (hash do caminho, hash da versão do arquivo).
+    """
+
+    absolute_path = os.path.abspath(path)
+    stat = os.stat(absolute_path)
+    path_hash = hashlib.sha1(absolute_path.encode("utf-8")).hexdigest()[:16]
+    version_hash = hashlib.sha1(
+        f"{absolute_path}|{stat.st_mtime_ns}|{stat.st_size}".encode("utf-8")
+    ).hexdigest()[:16]
+    return path_hash, version_hash
+
+def get_cached_raster(path, cache_dir):
+    """
+    Retorna o caminho de uma cópia em GeoTIFF tiled e comprimido do arquivo ASC.
+
+    Na primeira execução o ASC é convertido e salvo em `cache_dir`; nas
+    seguintes, enquanto o arquivo de origem não mudar (caminho, data de
+    modificação e tamanho), a cópia é reutilizada sem reprocessar o texto.
+    Versões antigas do mesmo arquivo são removidas do cache.
+
+    :param path: Caminho do arquivo ASC.
+    :param cache_dir: Diretório do cache.
+    :return: Caminho do GeoTIFF em cache.
+    """
+
+    # Verifica se o arquivo existe
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Arquivo não encontrado: {path}")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path_hash, version_hash = cache_key(path)
+    cached_path = os.path.join(cache_dir, f"{path_hash}-{version_hash}.tif")
+
+    if os.path.exists(cached_path):
+        return cached_path
+
+    print(f"Convertendo {path} para GeoTIFF em cache...")
+
+    # Escreve em um arquivo temporário e renomeia, para nunca deixar um cache incompleto
+    temp_path = f"{cached_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with rasterio.open(path) as src:
+            predictor = 3 if src.dtypes[0].startswith("float") else 2
+            raster_copy(
+                src,
+                temp_path,
+                driver="GTiff",
+                tiled=True,
+                blockxsize=CACHE_TILE_SIZE,
+                blockysize=CACHE_TILE_SIZE,
+                compress="deflate",
+                predictor=predictor
+            )
+        os.replace(temp_path, cached_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    # Remove versões antigas do mesmo arquivo de origem
+    for old_path in glob.glob(os.path.join(cache_dir, f"{path_hash}-*.tif")):
+        if old_path != cached_path:
+            os.remove(old_path)
+
+    return cached_path
@@ -0,0 +1,304 @@
+import multiprocessing
+import os
+import threading
+import rasterio
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .asc_functions import process_chunk, raster_windows, load_roi
+from .clip_mask import build_raster_clip_mask
+from .checkpoint import prepare_checkpoints, mark_window_committed
+from .connection_pool import init_pool, get_connection_settings
+from .reference_cache import init_reference_cache, get_reference_cache_dir, get_reference_code_column
+from . import metrics
+from . import sinks
+from .grid_ids import init_id_scheme, get_id_settings
+
+
+# Executor compartilhado por todos os arquivos processados no modo "process"
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+# Máscara de recorte já construída no processo filho: tupla ((raster, tabela), máscara).
+# Cada máscara cobre o raster inteiro, então o processo guarda só a do último raster
+# (LRU de tamanho 1) em vez de acumular uma por arquivo ao longo da carga
+_CLIP_MASK = None
+
+
+def init_worker(
+        connection_settings,
+        reference_cache_dir=None,
+        metrics_enabled=False,
+        sink_settings=("postgis", None),
+        id_settings=("text", {}),
+        reference_code_column=None
+):
+    """
+    Inicializa um processo filho com a sua própria conexão com o banco.
+
+    :param connection_settings: Parâmetros de conexão (ver `get_connection_settings`), ou None nos destinos sem banco.
+    :param reference_cache_dir: Diretório do cache dos polígonos de referência.
+    :param metrics_enabled: Se True, o processo coleta métricas e as devolve com o resultado de cada tarefa.
+    :param sink_settings: Destino dos pontos e diretório de saída (ver `sinks.get_sink_settings`).
+    :param id_settings: Esquema de ids e grade de referência (ver `grid_ids.get_id_settings`).
+    :param reference_code_column: Coluna do código dos polígonos de referência (ver `reference_cache.init_reference_cache`).
+    """
+
+    id_scheme, grid = id_settings
+    init_id_scheme(id_scheme, **grid)
+    sinks.init_sink(*sink_settings)
+    if connection_settings is not None:
+        init_pool(1, **connection_settings)
+    init_reference_cache(reference_cache_dir, reference_code_column)
+    metrics.init_metrics(metrics_enabled)
+
+def get_process_executor(workers):
+    """
+    Retorna o pool de processos compartilhado, criando-o na primeira chamada.
+
+    Os processos são iniciados com "spawn" para não herdar threads nem
+    conexões abertas do processo principal.
+
+    :param workers: Quantidade de processos.
+    :return: ProcessPoolExecutor.
+    """
+
+    global _EXECUTOR
+
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(
+                    get_connection_settings() if sinks.uses_database() else None,
+                    get_reference_cache_dir(),
+                    metrics.is_enabled(),
+                    sinks.get_sink_settings(),
+                    get_id_settings(),
+                    get_reference_code_column()
+                )
+            )
+        return _EXECUTOR
+
+def shutdown_process_executor():
+    """
+    Encerra o pool de processos compartilhado, se existir.
+
+    As tarefas ainda na fila são canceladas, para que uma carga que falhou não
+    espere pelos arquivos restantes; ao fim de uma carga bem-sucedida a fila
+    já está vazia.
+    """
+
+    global _EXECUTOR
+
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is not None:
+            _EXECUTOR.shutdown(cancel_futures=True)
+        _EXECUTOR = None
+
+def _get_clip_mask(conn, cursor, raster_path, shp_table):
+    """
+    Constrói a máscara de recorte uma única vez por processo filho e raster,
+    descartando a do raster anterior.
+    """
+
+    global _CLIP_MASK
+
+    key = (raster_path, shp_table)
+    if _CLIP_MASK is None or _CLIP_MASK[0] != key:
+        # Libera a máscara anterior antes de construir a nova
+        _CLIP_MASK = None
+        _CLIP_MASK = (key, build_raster_clip_mask(conn, cursor, raster_path, shp_table))
+    return _CLIP_MASK[1]
+
+def process_window_range(
+        windows,
+        raster_path,
+        name,
+        scale,
+        measure,
+        table_name,
+        shp_table,
+        execution_date,
+        sampling_stride=10,
+        batch_size=1000,
+        srid=4326,
+        clip_mode="mask",
+        layout="jsonb",
+        aggregation=None
+    ):
+    """
+    Processa, dentro de um processo filho, um intervalo de janelas do raster.
+
+    O próprio processo abre o raster e lê as janelas, então nenhum array
+    precisa ser serializado entre processos.
+
+    :param windows: Lista de janelas (rasterio.windows.Window) a processar.
+    :param raster_path: Caminho do arquivo raster.
+    :param name: Nome do dado a ser inserido.
+    :param scale: Fator de escala para o valor.
+    :param measure: Unidade de medida do dado.
+    :param table_name: Nome da tabela onde os dados serão inseridos.
+    :param shp_table: Nome da tabela de polígonos para verificação espacial.
+    :param execution_date: Data de execução para o registro.
+    :param sampling_stride: Passo de amostragem para os dados.
+    :param batch_size: Tamanho do lote para inserção no banco de dados.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param clip_mode: "mask" para recortar com a máscara em memória ou "query" para consultar os pontos no banco, uma consulta por lote.
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    :param aggregation: Método de agregação das células (ver `asc_functions.aggregate_block`), ou None para amostrar.
+    :return: Tupla (pontos gravados, pontos cujo lote falhou, métricas do processo; ver `metrics.take_snapshot`).
+    """
+
+    written = 0
+    failed = 0
+    with sinks.sink_connection() as (conn, cursor):
+        clip_mask = None
+        if clip_mode == "mask":
+            with metrics.stage(name, "clip_mask"):
+                clip_mask = _get_clip_mask(conn, cursor, raster_path, shp_table)
+
+        with rasterio.open(raster_path) as src:
+            for window in windows:
+                with metrics.stage(name, "read"):
+                    values = src.read(1, window=window)
+                chunk_written, chunk_failed = process_chunk(
+                    cursor,
+                    conn,
+                    table_name,
+                    values,
+                    src.transform,
+                    window,
+                    name,
+                    scale,
+                    measure,
+                    execution_date,
+                    shp_table,
+                    sampling_stride,
+                    batch_size,
+                    srid,
+                    clip_mask,
+                    src.nodata,
+                    layout,
+                    aggregation
+                )
+                written += chunk_written
+                failed += chunk_failed
+
+                if not chunk_failed and sinks.uses_database():
+                    with metrics.stage(name, "checkpoint"):
+                        mark_window_committed(
+                            conn, cursor, table_name, name, execution_date, window, {name: chunk_written}
+                        )
+
+    # Os pontos acumulados no processo são gravados ao final de cada tarefa
+    sinks.flush_sink()
+    return written, failed, metrics.take_snapshot()
+
+def process_raster_in_processes(
+        name,
+        raster_path,
+        scale,
+        measure,
+        table_name,
+        shp_table,
+        execution_date,
+        sampling_stride=10,
+        batch_size=1000,
+        srid=4326,
+        clip_mode="mask",
+        workers=None,
+        windows_per_task=16,
+        resume=False,
+        layout="jsonb",
+        aggregation=None,
+        roi=False
+    ):
+    """
+    Processa um arquivo raster distribuindo intervalos de janelas entre processos.
+
+    A quantidade de tarefas em andamento é limitada ao dobro da quantidade de
+    processos, para que a fila de tarefas não cresça com o tamanho do arquivo.
+
+    :param name: Nome do dado a ser inserido.
+    :param raster_path: Caminho do arquivo raster.
+    :param scale: Fator de escala para o valor.
+    :param measure: Unidade de medida do dado.
+    :param table_name: Nome da tabela onde os dados serão inseridos.
+    :param shp_table: Nome da tabela de polígonos para verificação espacial.
+    :param execution_date: Data de execução para o registro.
+    :param sampling_stride: Passo de amostragem para os dados.
+    :param batch_size: Tamanho do lote para inserção no banco de dados.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param clip_mode: "mask" para recortar com a máscara em memória ou "query" para consultar os pontos no banco, uma consulta por lote.
+    :param workers: Quantidade de processos (default é a quantidade de núcleos).
+    :param windows_per_task: Quantidade de janelas enviadas a cada tarefa.
+    :param resume: Se True, pula as janelas já gravadas em uma execução anterior da mesma data.
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    :param aggregation: Método de agregação das células ("mean", "min", "max" ou "majority"), ou None para amostrar.
+    :param roi: Se True, lê apenas as janelas que tocam os polígonos de referência.
+    :return: Tupla (pontos gravados, pontos cujo lote falhou).
+    """
+
+    # Verifica se o arquivo existe
+    if not os.path.exists(raster_path):
+        raise FileNotFoundError(f"Arquivo não encontrado: {raster_path}")
+
+    workers = workers or os.cpu_count()
+    executor = get_process_executor(workers)
+    max_in_flight = workers * 2
+
+    print(f"Iniciando processamento de {name} com {workers} processos...")
+
+    # Janelas já gravadas, na retomada
+    skip_windows = prepare_checkpoints(table_name, name, execution_date, resume)
+
+    reference = load_roi(shp_table) if roi else None
+    with rasterio.open(raster_path) as src:
+        windows = raster_windows(src, sampling_stride, aggregation, skip_windows, reference)
+
+    metrics.set_total(name, len(windows))
+
+    written = 0
+    failed = 0
+    in_flight = {}
+
+    def collect(future):
+        nonlocal written, failed
+        task_written, task_failed, task_metrics = future.result()
+        written += task_written
+        failed += task_failed
+        metrics.merge_snapshot(task_metrics)
+        metrics.advance(name, in_flight.pop(future))
+
+    for start in range(0, len(windows), windows_per_task):
+        if len(in_flight) >= max_in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future)
+
+        task_windows = windows[start:start + windows_per_task]
+        future = executor.submit(
+            process_window_range,
+            task_windows,
+            raster_path,
+            name,
+            scale,
+            measure,
+            table_name,
+            shp_table,
+            execution_date,
+            sampling_stride,
+            batch_size,
+            srid,
+            clip_mode,
+            layout,
+            aggregation
+        )
+        in_flight[future] = len(task_windows)
+
+    for future in list(in_flight):
+        collect(future)
+
+    print(f"Finalizado processamento de {name}.")
+    return written, failed
@@ -0,0 +1,420 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import numpy as np
+import shapely
+
+
+# Diretório do cache dos polígonos de referência (None desativa o cache em disco)
+_CACHE_DIR = None
+
+# Coluna da tabela de referência com o código de cada polígono (ex.: o código do município),
+# gravado em cada ponto; None desativa a atribuição
+_CODE_COLUMN = None
+
+# Polígonos e índices espaciais já carregados neste processo, por tabela
+_LOADED = {}
+# Códigos dos polígonos já carregados, na mesma ordem das geometrias, por tabela
+_CODES = {}
+_LOCK = threading.Lock()
+
+INDEX_FILE = "index.json"
+
+
+def init_reference_cache(cache_dir, code_column=None):
+    """
+    Define o diretório do cache dos polígonos de referência.
+
+    :param cache_dir: Diretório do cache, ou None para buscar os polígonos no banco a cada execução.
+    :param code_column: Coluna da tabela de referência com o código de cada polígono, atribuído aos
+        pontos que ele contém (None para não atribuir).
+    """
+
+    global _CACHE_DIR, _CODE_COLUMN
+
+    with _LOCK:
+        _CACHE_DIR = cache_dir
+        _CODE_COLUMN = code_column.lower() if code_column else None
+        _LOADED.clear()
+        _CODES.clear()
+
+def get_reference_cache_dir():
+    """
+    Retorna o diretório do cache dos polígonos de referência, para repassá-lo aos processos filhos.
+
+    :return: Diretório do cache, ou None.
+    """
+
+    return _CACHE_DIR
+
+def get_reference_code_column():
+    """
+    Retorna a coluna do código dos polígonos de referência, para repassá-la aos processos filhos.
+
+    :return: Nome da coluna, ou None se a atribuição estiver desativada.
+    """
+
+    return _CODE_COLUMN
+
+def _read_index(cache_dir):
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, "r") as file:
+        return json.load(file)
+
+def _write_index(cache_dir, index):
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    temp_path = f"{index_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(index, file, indent=2)
+    os.replace(temp_path, index_path)
+
+def _write_wkb(path, wkbs):
+    """
+    Grava as geometrias em WKB, cada uma precedida do seu tamanho em bytes.
+    """
+
+    temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as file:
+        for wkb in wkbs:
+            file.write(struct.pack("<I", len(wkb)))
+            file.write(wkb)
+    os.replace(temp_path, path)
+
+def _read_wkb(path):
+    """
+    Lê as geometrias gravadas por `_write_wkb`.
+    """
+
+    with open(path, "rb") as file:
+        data = file.read()
+
+    wkbs = []
+    offset = 0
+    while offset < len(data):
+        (size,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        wkbs.append(data[offset:offset + size])
+        offset += size
+    return wkbs
+
+def _write_codes(path, codes):
+    """
+    Grava os códigos dos polígonos em JSON, na ordem das geometrias.
+    """
+
+    temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(codes, file)
+    os.replace(temp_path, path)
+
+def _cache_files(entry):
+    """
+    Lista os arquivos de uma versão da tabela no cache.
+    """
+
+    return [entry["file"]] + ([entry["codes_file"]] if entry.get("codes_file") else [])
+
+def reference_source(cursor, table_name):
+    """
+    Identifica a origem atual dos polígonos de referência no banco.
+
+    A identidade do banco (host, porta e nome) e uma assinatura barata da
+    tabela (quantidade de polígonos, extensão e total de vértices) são
+    gravadas com cada versão do cache e conferidas ao carregá-lo, para que
+    polígonos exportados de outro banco, ou de uma tabela recarregada por
+    fora do ETL, não sejam reaproveitados.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela que contém os polígonos.
+    :return: Dicionário com database, count, extent e vertices.
+    """
+
+    info = cursor.connection.info
+    cursor.execute(f"""
+        SELECT count(*), ST_Extent(geom)::text, COALESCE(sum(ST_NPoints(geom)), 0)
+        FROM {table_name}
+        WHERE geom IS NOT NULL
+    """)
+    count, extent, vertices = cursor.fetchone()
+    return {
+        "database": f"{info.host}:{info.port}/{info.dbname}",
+        "count": int(count),
+        "extent": extent,
+        "vertices": int(vertices),
+    }
+
+def fetch_reference_wkb(cursor, table_name, code_column=None):
+    """
+    Busca no banco os polígonos da tabela de referência em WKB.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela que contém os polígonos.
+    :param code_column: Coluna com o código de cada polígono (opcional).
+    :return: Tupla (lista de geometrias em WKB, lista de códigos em texto ou None).
+    """
+
+    code_select = f', "{code_column}"::text' if code_column else ""
+    cursor.execute(f"""
+        SELECT ST_AsBinary(geom){code_select}
+        FROM {table_name}
+        WHERE geom IS NOT NULL
+    """)
+    rows = cursor.fetchall()
+    wkbs = [bytes(row[0]) for row in rows]
+    codes = [row[1] for row in rows] if code_column else None
+    return wkbs, codes
+
+def export_reference_cache(cursor, table_name, cache_dir, code_column=None, source=None):
+    """
+    Exporta os polígonos da tabela de referência para o cache em disco.
+
+    O arquivo é identificado pelo nome da tabela e pelo hash do conteúdo; o
+    `index.json` do cache aponta para a versão atual de cada tabela e guarda
+    a sua origem (ver `reference_source`).
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela que contém os polígonos.
+    :param cache_dir: Diretório do cache.
+    :param code_column: Coluna com o código de cada polígono (opcional).
+    :param source: Origem já calculada com `reference_source` (opcional).
+    :return: Tupla (lista de geometrias em WKB, lista de códigos ou None).
+    """
+
+    source = source or reference_source(cursor, table_name)
+    wkbs, codes = fetch_reference_wkb(cursor, table_name, code_column)
+    _store_reference_cache(table_name, cache_dir, wkbs, codes, code_column, source)
+    return wkbs, codes
+
+def _store_reference_cache(table_name, cache_dir, wkbs, codes=None, code_column=None, source=None):
+    """
+    Grava as geometrias (e os códigos, se houver) de uma tabela no cache e atualiza o `index.json`.
+    """
+
+    digest = hashlib.sha256()
+    for wkb in wkbs:
+        digest.update(wkb)
+    if codes is not None:
+        digest.update(json.dumps([code_column, codes]).encode())
+    content_hash = digest.hexdigest()[:16]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    file_name = f"{table_name}-{content_hash}.wkb"
+    _write_wkb(os.path.join(cache_dir, file_name), wkbs)
+    entry = {"hash": content_hash, "file": file_name, "count": len(wkbs), "source": source}
+    if codes is not None:
+        entry["code_column"] = code_column
+        entry["codes_file"] = f"{table_name}-{content_hash}.codes.json"
+        _write_codes(os.path.join(cache_dir, entry["codes_file"]), codes)
+
+    with _LOCK:
+        index = _read_index(cache_dir)
+        previous = index.get(table_name)
+        index[table_name] = entry
+        _write_index(cache_dir, index)
+
+    # Remove a versão anterior da mesma tabela
+    if previous and previous["file"] != file_name:
+        for previous_file in _cache_files(previous):
+            old_path = os.path.join(cache_dir, previous_file)
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+def export_reference_shapefile(table_name, path, srid=4326):
+    """
+    Carrega os polígonos de referência direto do shapefile, sem passar pelo banco.
+
+    Usada pelos destinos que não gravam no PostGIS. Com o cache em disco
+    ligado, os polígonos são gravados nele com o nome da tabela, para que os
+    processos filhos os encontrem.
+
+    :param table_name: Nome da tabela de referência a que os polígonos correspondem.
+    :param path: Caminho do arquivo shapefile.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :return: Quantidade de polígonos carregados.
+    """
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Arquivo não encontrado: {path}")
+
+    # O GeoPandas só é carregado quando o shapefile é lido
+    import geopandas as gpd
+
+    gdf = gpd.read_file(path)
+    if gdf.crs is None:
+        gdf = gdf.set_crs(epsg=int(srid))
+    elif gdf.crs.to_epsg() != int(srid):
+        gdf = gdf.to_crs(epsg=int(srid))
+    gdf = gdf[gdf.geometry.notna()]
+    geometries = gdf.geometry.to_numpy()
+    wkbs = [bytes(wkb) for wkb in shapely.to_wkb(geometries)]
+
+    with _LOCK:
+        cache_dir = _CACHE_DIR
+        code_column = _CODE_COLUMN
+        _LOADED.pop(table_name, None)
+
+    codes = None
+    if code_column:
+        # As colunas da tabela ficam em minúsculas (ver `send_shp_files_to_postgis.attribute_columns`)
+        columns = {column.lower(): column for column in gdf.columns if column != gdf.geometry.name}
+        if code_column not in columns:
+            raise ValueError(f"Coluna {code_column} não encontrada no shapefile {path}.")
+        codes = [None if code is None else str(code) for code in gdf[columns[code_column]].astype(object)]
+    if cache_dir:
+        source = {"shapefile": os.path.abspath(path)}
+        _store_reference_cache(table_name, cache_dir, wkbs, codes, code_column, source)
+
+    shapely.prepare(geometries)
+    with _LOCK:
+        _LOADED[table_name] = (geometries, shapely.STRtree(geometries))
+        _CODES[table_name] = None if codes is None else np.array(codes, dtype=object)
+    return len(wkbs)
+
+def invalidate_reference_cache(table_name):
+    """
+    Descarta os polígonos em cache de uma tabela, depois que o shapefile de
+    referência é carregado novamente.
+
+    :param table_name: Nome da tabela que contém os polígonos.
+    """
+
+    with _LOCK:
+        _LOADED.pop(table_name, None)
+        _CODES.pop(table_name, None)
+        if not _CACHE_DIR:
+            return
+
+        index = _read_index(_CACHE_DIR)
+        entry = index.pop(table_name, None)
+        if entry is None:
+            return
+        _write_index(_CACHE_DIR, index)
+
+    for old_file in _cache_files(entry):
+        old_path = os.path.join(_CACHE_DIR, old_file)
+        if os.path.exists(old_path):
+            os.remove(old_path)
+
+def get_reference_index(cursor, table_name):
+    """
+    Retorna os polígonos de referência preparados e o seu índice espacial.
+
+    Os polígonos são lidos do cache em disco quando existe uma versão da
+    tabela; caso contrário são buscados no banco uma única vez e exportados.
+    Com um cursor, a versão em cache só é usada se tiver vindo do mesmo banco
+    e a tabela não tiver mudado desde a exportação (ver `reference_source`);
+    sem cursor (destinos sem banco), a versão em cache é usada como está.
+    Dentro do processo o resultado é reaproveitado entre arquivos e threads.
+    Com a coluna de código definida (ver `init_reference_cache`), os códigos
+    dos polígonos são carregados junto (ver `get_reference_codes`).
+
+    :param cursor: Cursor do banco de dados (usado apenas se a tabela não estiver em cache).
+    :param table_name: Nome da tabela que contém os polígonos.
+    :return: Tupla (array de geometrias, STRtree).
+    """
+
+    with _LOCK:
+        if table_name in _LOADED:
+            return _LOADED[table_name]
+        cache_dir = _CACHE_DIR
+        code_column = _CODE_COLUMN
+        entry = _read_index(cache_dir).get(table_name) if cache_dir else None
+
+    # Origem atual da tabela, para conferir a versão em cache
+    source = reference_source(cursor, table_name) if cursor is not None and cache_dir else None
+
+    wkbs = None
+    codes = None
+    # A versão em cache só serve se tiver sido exportada com a mesma coluna de código e da mesma origem
+    if (
+        entry is not None
+        and entry.get("code_column") == code_column
+        and (source is None or entry.get("source") == source)
+    ):
+        cached_files = [os.path.join(cache_dir, file) for file in _cache_files(entry)]
+        if all(os.path.exists(path) for path in cached_files):
+            wkbs = _read_wkb(cached_files[0])
+            if code_column:
+                with open(cached_files[1], "r") as file:
+                    codes = json.load(file)
+
+    if wkbs is None:
+        if cache_dir:
+            wkbs, codes = export_reference_cache(cursor, table_name, cache_dir, code_column, source)
+        else:
+            wkbs, codes = fetch_reference_wkb(cursor, table_name, code_column)
+
+    geometries = shapely.from_wkb(np.array(wkbs, dtype=object))
+    shapely.prepare(geometries)
+    reference = (geometries, shapely.STRtree(geometries))
+
+    with _LOCK:
+        if table_name not in _LOADED:
+            _LOADED[table_name] = reference
+            _CODES[table_name] = None if codes is None else np.array(codes, dtype=object)
+        return _LOADED[table_name]
+
+def get_reference_codes(cursor, table_name):
+    """
+    Retorna os códigos dos polígonos de referência, na mesma ordem das geometrias de `get_reference_index`.
+
+    :param cursor: Cursor do banco de dados (usado apenas se a tabela não estiver em cache).
+    :param table_name: Nome da tabela que contém os polígonos.
+    :return: Array de códigos (texto), ou None se a atribuição estiver desativada.
+    """
+
+    get_reference_index(cursor, table_name)
+    with _LOCK:
+        return _CODES.get(table_name)
+
+def points_in_reference(x, y, reference):
+    """
+    Verifica, de forma vetorizada, quais pontos estão dentro dos polígonos de referência.
+
+    Usa o mesmo critério do `ST_Contains`: pontos sobre a borda ficam de fora.
+
+    :param x: Array de coordenadas x (longitude).
+    :param y: Array de coordenadas y (latitude).
+    :param reference: Tupla (geometrias, STRtree) retornada por `get_reference_index`.
+    :return: Array booleano, verdadeiro para os pontos dentro de algum polígono.
+    """
+
+    inside, _ = locate_in_reference(x, y, reference)
+    return inside
+
+def locate_in_reference(x, y, reference, codes=None):
+    """
+    Localiza, de forma vetorizada, o polígono de referência que contém cada ponto.
+
+    É a mesma consulta de `points_in_reference`: o STRtree já informa qual
+    polígono contém cada ponto, então o código vem sem custo adicional.
+
+    O STRtree é consultado só pelas caixas envolventes, e os pares candidatos
+    são conferidos com `shapely.contains` nos polígonos preparados. Consultar
+    com `predicate="within"` testaria cada ponto contra o polígono inteiro,
+    sem a preparação, e seria ordens de grandeza mais lento.
+
+    :param x: Array de coordenadas x (longitude).
+    :param y: Array de coordenadas y (latitude).
+    :param reference: Tupla (geometrias, STRtree) retornada por `get_reference_index`.
+    :param codes: Códigos dos polígonos (ver `get_reference_codes`), ou None.
+    :return: Tupla (array booleano dos pontos dentro de algum polígono, array de códigos de cada ponto ou None).
+    """
+
+    geometries, tree = reference
+    points = shapely.points(x, y)
+    point_index, polygon_index = tree.query(points)
+    contained = shapely.contains(geometries[polygon_index], points[point_index])
+    point_index, polygon_index = point_index[contained], polygon_index[contained]
+    inside = np.zeros(len(points), dtype=bool)
+    inside[point_index] = True
+    if codes is None:
+        return inside, None
+
+    point_codes = np.full(len(points), None, dtype=object)
+    point_codes[point_index] = codes[polygon_index]
+    return inside, point_codes
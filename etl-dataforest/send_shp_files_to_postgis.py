@@ -1,32 +1,146 @@
-import subprocess
+import csv
+import io
+import os
+import geopandas as gpd
+import pandas as pd
+import shapely
 
-def send_shp_files_to_postgis(path, table_name, db_host, db_name, db_port, db_user, db_password, srid=4326):
+
+# Quantidade de feições enviadas em cada COPY
+COPY_CHUNK_SIZE = 5000
+
+
+def column_type(dtype):
+    """
+    Converte o tipo de uma coluna do GeoDataFrame para o tipo equivalente no PostgreSQL.
+
+    :param dtype: Tipo da coluna (pandas).
+    :return: Nome do tipo no PostgreSQL.
+    """
+
+    if pd.api.types.is_bool_dtype(dtype):
+        return "BOOLEAN"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "BIGINT"
+    if pd.api.types.is_float_dtype(dtype):
+        return "DOUBLE PRECISION"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+def attribute_columns(gdf):
+    """
+    Define as colunas de atributos da tabela, com nomes em minúsculas como no shp2pgsql.
+
+    :param gdf: GeoDataFrame do shapefile.
+    :return: Lista de tuplas (coluna no GeoDataFrame, coluna na tabela, tipo).
+    """
+
+    columns = []
+    used = {"gid", "geom"}
+    for column in gdf.columns:
+        if column == gdf.geometry.name:
+            continue
+        name = column.lower()
+        while name in used:
+            name = f"{name}_1"
+        used.add(name)
+        columns.append((column, name, column_type(gdf[column].dtype)))
+    return columns
+
+def copy_features(cursor, table_name, gdf, columns, srid=4326):
+    """
+    Envia as feições para a tabela com COPY, em partes, com a geometria em EWKB hexadecimal.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela de destino.
+    :param gdf: GeoDataFrame do shapefile.
+    :param columns: Colunas de atributos (ver `attribute_columns`).
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :return: Quantidade de feições enviadas.
+    """
+
+    column_names = ", ".join(f'"{name}"' for _, name, _ in columns)
+    target_columns = f"{column_names}, geom" if columns else "geom"
+
+    count = 0
+    for start in range(0, len(gdf), COPY_CHUNK_SIZE):
+        chunk = gdf.iloc[start:start + COPY_CHUNK_SIZE]
+        geoms = shapely.set_srid(chunk.geometry.to_numpy(), srid)
+        wkbs = shapely.to_wkb(geoms, hex=True, include_srid=True)
+        attributes = chunk[[column for column, _, _ in columns]].astype(object)
+        attributes = attributes.where(attributes.notna(), None)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for values, wkb in zip(attributes.itertuples(index=False, name=None), wkbs):
+            writer.writerow((*values, wkb))
+        buffer.seek(0)
+
+        cursor.copy_expert(
+            f"COPY {table_name} ({target_columns}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+        count += len(chunk)
+    return count
+
+def send_shp_files_to_postgis(conn, cursor, path, table_name, srid=4326):
     """
     Envia arquivos shapefile para o banco de dados PostGIS.
-    
+
+    O shapefile é lido com GeoPandas e enviado com COPY pela conexão já
+    aberta; a tabela é recriada a cada carga e o índice GIST é construído
+    depois da carga. Tudo ocorre em uma única transação.
+
+    Os polígonos são mantidos inteiros: a versão subdividida, usada nas
+    verificações de ponto no polígono, fica na tabela à parte criada por
+    `create_table.create_subdivided_table`.
+
+    :param conn: Conexão com o banco de dados.
+    :param cursor: Cursor do banco de dados.
     :param path: Caminho do arquivo shapefile.
     :param table_name: Nome da tabela onde os dados serão inseridos.
-    :param db_host: Host do banco de dados.
-    :param db_name: Nome do banco de dados.
-    :param db_port: Porta do banco de dados.
-    :param db_user: Usuário do banco de dados.
-    :param db_password: Senha do banco de dados.
     :param srid: SRID do sistema de referência espacial (default é 4326).
+    :return: True se o shapefile foi carregado.
     """
-    # Comando para carregar o shapefile no banco de dados
-    sh_command = (
-        f"PGPASSWORD={db_password} "
-        f"shp2pgsql -s {srid} -I {path} {db_name} > {table_name}.sql && "
-        f"PGPASSWORD={db_password} "
-        f"psql -U {db_user} -d {db_name} -h {db_host} -p {db_port} < {table_name}.sql && "
-        f"PGPASSWORD={db_password} "
-        f"psql -U {db_user} -d {db_name} -h {db_host} -p {db_port} -c \"CREATE INDEX IF NOT EXISTS idx_{db_name}_geom ON {db_name} USING GIST (geom);\""
-        f" && "
-        f"rm {table_name}.sql"
-    )
-
-    result = subprocess.run(sh_command, shell=True)
-    if result.returncode != 0:
-        print("❌ Erro ao carregar shapefile para o banco!")
-    else:
-        print("✅ Shapefile carregado com sucesso.")
+
+    # Verifica se o arquivo existe
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Arquivo não encontrado: {path}")
+
+    srid = int(srid)
+    try:
+        gdf = gpd.read_file(path)
+        # Sem .prj o shapefile é considerado no SRID informado, como no shp2pgsql -s
+        if gdf.crs is None:
+            gdf = gdf.set_crs(epsg=srid)
+        elif gdf.crs.to_epsg() != srid:
+            gdf = gdf.to_crs(epsg=srid)
+        gdf = gdf[gdf.geometry.notna()]
+
+        columns = attribute_columns(gdf)
+        column_definitions = "".join(f',\n"{name}" {type_}' for _, name, type_ in columns)
+
+        cursor.execute(f"""
+            DROP TABLE IF EXISTS {table_name};
+
+            CREATE TABLE {table_name} (
+                gid SERIAL PRIMARY KEY{column_definitions},
+                geom geometry(Geometry, {srid})
+            );
+        """)
+
+        count = copy_features(cursor, table_name, gdf, columns, srid)
+
+        cursor.execute(f"""
+            CREATE INDEX idx_{table_name}_geom ON {table_name} USING GIST (geom);
+            ANALYZE {table_name};
+        """)
+        conn.commit()
+    except Exception as e:
+        print(f"❌ Erro ao carregar shapefile para o banco: {e}")
+        conn.rollback()
+        return False
+
+    print(f"✅ Shapefile carregado com sucesso ({count} feições).")
+    return True
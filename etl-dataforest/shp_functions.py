@@ -2,33 +2,159 @@ import geopandas as gpd
 import pandas as pd
 import numpy as np
 import os
-import json
-import psycopg2
-from psycopg2.extras import execute_batch
-from shapely.geometry import Point, Polygon, MultiPolygon
-from .verify_point_locale import is_point_in_polygon
+import shapely
+from .asc_functions import PointBatch, filter_batch_by_query, write_point_batch
+from .reference_cache import get_reference_index, get_reference_codes, locate_in_reference
+from . import metrics
 
 
+# Quilômetros por grau de latitude, usado para converter o espaçamento em CRS geográficos
+KM_PER_DEGREE = 111.32
+
+# Menor cosseno da latitude usado no espaçamento em longitude, para que as células perto dos polos não explodam
+MIN_LATITUDE_COSINE = 0.01
+
+
+def shapefile_vertices(gdf, value):
+    """
+    Extrai de uma vez os vértices de todas as geometrias do GeoDataFrame.
+
+    Pontos são usados diretamente; de polígonos e multipolígonos são usados os
+    vértices do anel externo de cada parte.
+
+    :param gdf: GeoDataFrame do shapefile.
+    :param value: Atributo a ser processado.
+    :return: Tupla (geometrias, valores), com uma geometria (ponto ou anel) por parte.
+    """
+
+    parts = gdf[[value, "geometry"]].explode(index_parts=False, ignore_index=True)
+    geom_types = parts.geometry.geom_type
+
+    unsupported = ~geom_types.isin(["Point", "Polygon"])
+    for geom_type in geom_types[unsupported].unique():
+        print(f"Geometria não suportada: {geom_type}")
+    parts = parts[~unsupported]
+    geom_types = geom_types[~unsupported]
+
+    geoms = np.array(parts.geometry.to_numpy(), dtype=object)
+    polygons = (geom_types == "Polygon").to_numpy()
+    geoms[polygons] = shapely.get_exterior_ring(geoms[polygons])
+    return geoms, parts[value].to_numpy()
+
+def resample_vertices(geoms, values, spacing, geographic=False):
+    """
+    Reamostra os vértices para o espaçamento pedido.
+
+    Os anéis são densificados para que nenhum segmento seja maior que o
+    espaçamento e os pontos resultantes são reduzidos a um por célula de uma
+    grade com esse espaçamento. Cada geometria tem a sua própria grade, então
+    polígonos vizinhos com valores diferentes não disputam a mesma célula.
+
+    Em CRS geográficos o espaçamento é dado em graus de latitude; em
+    longitude, a célula é alargada por 1 / cos(latitude do centroide da
+    geometria), para que o espaçamento em km seja o mesmo nos dois eixos.
+
+    :param geoms: Array de geometrias (pontos ou anéis).
+    :param values: Array com o valor de cada geometria.
+    :param spacing: Espaçamento nas unidades do CRS; se não for positivo, os vértices são mantidos.
+    :param geographic: Se True, as coordenadas são longitude e latitude em graus.
+    :return: Tupla (x, y, valores) com um ponto por vértice mantido.
+    """
+
+    if not spacing or spacing <= 0:
+        coords, index = shapely.get_coordinates(geoms, return_index=True)
+        return coords[:, 0], coords[:, 1], values[index]
+
+    # Em graus, o segmento limitado pelo espaçamento em latitude também respeita o espaçamento em km na longitude
+    geoms = shapely.segmentize(geoms, spacing)
+    coords, index = shapely.get_coordinates(geoms, return_index=True)
+    x = coords[:, 0]
+    y = coords[:, 1]
+
+    x_spacing = np.full(len(geoms), float(spacing))
+    if geographic and len(geoms):
+        latitudes = shapely.get_y(shapely.centroid(geoms))
+        x_spacing /= np.maximum(np.cos(np.radians(latitudes)), MIN_LATITUDE_COSINE)
+
+    cells = np.column_stack([
+        index,
+        np.floor(x / x_spacing[index]).astype(np.int64),
+        np.floor(y / spacing).astype(np.int64)
+    ])
+    _, keep = np.unique(cells, axis=0, return_index=True)
+    keep.sort()
+    return x[keep], y[keep], values[index[keep]]
+
+def clip_to_reference(cursor, batch, refer_shapefile_table):
+    """
+    Mantém os pontos do lote que estão dentro dos polígonos de referência.
+
+    A junção espacial é feita de uma vez pelo STRtree dos polígonos em cache,
+    consultado pelas caixas envolventes e conferido com `shapely.contains` nos
+    polígonos preparados (ver `reference_cache.locate_in_reference`), com o
+    mesmo critério do `ST_Contains`: pontos
+    sobre a borda ficam de fora. Com a coluna de código dos polígonos definida,
+    o código do polígono de cada ponto vai junto no lote.
+
+    :param cursor: Cursor do banco de dados (usado apenas se os polígonos não estiverem em cache).
+    :param batch: PointBatch a ser recortado.
+    :param refer_shapefile_table: Nome da tabela com o polígono usado como referência.
+    :return: PointBatch com os pontos dentro dos polígonos.
+    """
+
+    reference = get_reference_index(cursor, refer_shapefile_table)
+    codes = get_reference_codes(cursor, refer_shapefile_table)
+    inside, point_codes = locate_in_reference(batch.x, batch.y, reference, codes)
+    return PointBatch(
+        batch.x[inside],
+        batch.y[inside],
+        batch.value[inside],
+        point_codes[inside] if point_codes is not None else None
+    )
+
+def scale_values(values, escala):
+    """
+    Aplica o fator de escala aos valores numéricos; os demais são convertidos para texto.
+
+    :param values: Array com os valores do atributo.
+    :param escala: Fator de escala para o valor.
+    :return: Array com os valores a inserir.
+    """
+
+    series = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy() * escala
+
+    return np.array([
+        value * escala if isinstance(value, (int, float, np.number)) else str(value)
+        for value in values
+    ], dtype=object)
 
 def process_shapefile(
-        conn, 
+        conn,
         cursor,
         table_name,
-        name, 
-        shp_path, 
+        name,
+        shp_path,
         value,
         refer_shapefile_table,
         execution_date,
-        escala=1, 
-        medida="", 
-        spacing_km=10,
+        escala=1,
+        medida="",
+        spacing_km=0,
         srid=4326,
+        layout="jsonb",
+        batch_size=1000,
+        clip_mode="mask"
     ):
     """
     Processa um shapefile e insere os dados no PostGIS.
 
-    :param conn: Conexão com o banco de dados PostGIS.
-    :param cursor: Cursor do banco de dados.
+    Os vértices de todas as geometrias são extraídos e reamostrados de forma
+    vetorizada, recortados com uma única junção espacial e gravados em lotes.
+
+    :param conn: Conexão com o banco de dados PostGIS (None nos destinos sem banco).
+    :param cursor: Cursor do banco de dados (None nos destinos sem banco).
     :param table_name: Nome da tabela onde os dados serão inseridos.
     :param name: Nome do shapefile.
     :param shp_path: Caminho para o shapefile.
@@ -37,88 +163,60 @@ def process_shapefile(
     :param execution_date: Data de execução para o registro.
     :param escala: Fator de escala para o valor.
     :param medida: Unidade de medida.
-    :param spacing_km: Espaçamento em km para amostragem.
+    :param spacing_km: Espaçamento em km para amostragem (0 mantém apenas os vértices originais).
     :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    :param batch_size: Tamanho do lote para inserção no banco de dados.
+    :param clip_mode: "mask" para recortar em memória ou "query" para consultar os pontos no banco, uma consulta por lote.
+    :return: Tupla (pontos gravados, pontos cujo lote falhou).
     """
 
     # Verifica se o arquivo existe
     if not os.path.exists(shp_path):
         raise FileNotFoundError(f"Arquivo não encontrado: {shp_path}")
-    
+
     # Verifica se a tabela existe
-    cursor.execute(f"""
-        SELECT EXISTS (
-            SELECT 1
-            FROM information_schema.tables
-            WHERE table_name = '{table_name}'
-        );
-    """)
-    table_exists = cursor.fetchone()[0]
-    if not table_exists:
-        raise ValueError(f"Tabela {table_name} não existe no banco de dados.")
+    if cursor is not None:
+        cursor.execute(f"""
+            SELECT EXISTS (
+                SELECT 1
+                FROM information_schema.tables
+                WHERE table_name = '{table_name}'
+            );
+        """)
+        table_exists = cursor.fetchone()[0]
+        if not table_exists:
+            raise ValueError(f"Tabela {table_name} não existe no banco de dados.")
 
     print(f"Processando shapefile: {name}")
 
     # Lè o shapefile
-    gdf = gpd.read_file(shp_path)
-    # Ajusta o CRS
-    gdf = gdf.to_crs(epsg=srid)
-
-    inserts = []
-
-    for idx, row in gdf.iterrows():
-        geom = row.geometry
-
-        if geom.geom_type == "Point":
-            points = [geom]
-        elif isinstance(geom, Polygon):
-            points = [coord for coord in geom.exterior.coords]
-        elif isinstance(geom, MultiPolygon):
-            points = []
-            for poly in geom.geoms:
-                points.extend(list(poly.exterior.coords))
+    with metrics.stage(name, "read"):
+        gdf = gpd.read_file(shp_path)
+        # Ajusta o CRS
+        gdf = gdf.to_crs(epsg=srid)
+        # Descarta as feições sem valor
+        gdf = gdf[gdf[value].notna()]
+
+    # Espaçamento nas unidades do CRS: graus de latitude em CRS geográficos, metros nos demais
+    spacing = spacing_km / KM_PER_DEGREE if gdf.crs.is_geographic else spacing_km * 1000
+
+    with metrics.stage(name, "sample"):
+        geoms, values = shapefile_vertices(gdf, value)
+        x, y, values = resample_vertices(geoms, values, spacing, gdf.crs.is_geographic)
+        batch = PointBatch(x, y, scale_values(values, escala))
+    metrics.count(name, "points_sampled", len(batch.x))
+
+    sampled = len(batch.x)
+    with metrics.stage(name, "clip"):
+        if clip_mode == "mask":
+            batch = clip_to_reference(cursor, batch, refer_shapefile_table)
         else:
-            print(f"Geometria não suportada: {geom.geom_type}")
-            continue
-
-        for point in points:
-            if isinstance(point, tuple):
-                x, y = point
-            else:
-                x, y = point.x, point.y
-
-
-            if not is_point_in_polygon(cursor, x, y, refer_shapefile_table, srid):
-                continue
-
-            valor = row[value]
-            if pd.isna(valor):
-                continue
-
-            valor = valor * escala if isinstance(valor, (int, float, np.number)) else str(valor)
-            doc_id = f"{x},{y}"
-            new_data = {
-                execution_date: {
-                    name: {
-                        "valor": valor,
-                        "medida": medida
-                    }
-                }
-            }
-
-            inserts.append((doc_id, f"SRID=4326;POINT({x} {y})", json.dumps(new_data)))
-
-    try:
-        execute_batch(cursor, f"""
-            INSERT INTO {table_name} (id, geom, raster)
-            VALUES (%s, ST_GeomFromText(%s, 4326), %s)
-            ON CONFLICT (id) DO UPDATE SET
-            raster = jsonb_strip_nulls(
-                jsonb_deep_merge({table_name}.raster, EXCLUDED.raster)
-            );
-        """, inserts)
-        conn.commit()
-        print(f"Finalizado processamento de {name} com múltiplos pontos.")
-    except Exception as e:
-        print(f"Erro ao inserir shapefile no PostGIS: {e}")
-        conn.rollback()
+            batch = filter_batch_by_query(cursor, batch, refer_shapefile_table, srid)
+    metrics.count(name, "points_clipped", sampled - len(batch.x))
+
+    written, failed = write_point_batch(
+        cursor, conn, table_name, batch, name, medida, execution_date, batch_size, srid, layout
+    )
+    print(f"Finalizado processamento de {name} com múltiplos pontos.")
+    return written, failed
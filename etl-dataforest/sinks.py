@@ -0,0 +1,149 @@
+import threading
+from contextlib import nullcontext
+from .connection_pool import get_connection
+from . import metrics
+from .config import SINKS
+
+
+# Quantidade de pontos acumulados de um conjunto antes de gravar um arquivo GeoParquet
+ROWS_PER_FILE = 1_000_000
+
+_SINK = "postgis"
+_OUTPUT_DIR = None
+_LOCK = threading.Lock()
+# Pontos acumulados por (conjunto de dados, data de execução) no destino "geoparquet"
+_BUFFERS = {}
+
+
+def init_sink(sink="postgis", output_dir=None):
+    """
+    Define o destino dos pontos processados.
+
+    :param sink: "postgis", "geoparquet" ou "null".
+    :param output_dir: Diretório raiz dos arquivos GeoParquet (obrigatório no destino "geoparquet").
+    """
+
+    global _SINK, _OUTPUT_DIR
+
+    if sink not in SINKS:
+        raise ValueError(f"Destino não suportado: {sink}")
+    if sink == "geoparquet" and not output_dir:
+        raise ValueError("O destino geoparquet exige um diretório de saída.")
+
+    with _LOCK:
+        _SINK = sink
+        _OUTPUT_DIR = output_dir
+        _BUFFERS.clear()
+
+def get_sink_settings():
+    """
+    Retorna o destino e o diretório de saída, para repassá-los aos processos filhos.
+
+    :return: Tupla (destino, diretório de saída).
+    """
+
+    return _SINK, _OUTPUT_DIR
+
+def uses_database():
+    """
+    Indica se o destino grava no banco. Nos demais destinos o ETL não precisa
+    de conexão: manifesto e checkpoints não são usados.
+    """
+
+    return _SINK == "postgis"
+
+def sink_connection():
+    """
+    Empresta uma conexão do pool quando o destino é o PostGIS.
+
+    :return: Gerenciador de contexto com a tupla (conexão, cursor), ou (None, None) nos destinos sem banco.
+    """
+
+    if uses_database():
+        return get_connection()
+    return nullcontext((None, None))
+
+def _append(dataset, execution_date, table, srid):
+    """
+    Acumula um lote no destino "geoparquet", gravando um arquivo quando o conjunto atinge `ROWS_PER_FILE` pontos.
+    """
+
+    key = (dataset, execution_date)
+    with _LOCK:
+        buffer = _BUFFERS.setdefault(key, {"tables": [], "rows": 0, "srid": srid})
+        buffer["tables"].append(table)
+        buffer["rows"] += len(table)
+        if buffer["rows"] < ROWS_PER_FILE:
+            return
+        del _BUFFERS[key]
+
+    from .geoparquet import write_geoparquet
+    write_geoparquet(_OUTPUT_DIR, dataset, execution_date, buffer["tables"], srid)
+
+def write_points(batch, name, measure, execution_date, srid=4326):
+    """
+    Grava um PointBatch em um destino sem banco.
+
+    :param batch: PointBatch com os pontos.
+    :param name: Nome do dado (partição `dataset` no GeoParquet).
+    :param measure: Unidade de medida do dado.
+    :param execution_date: Data de execução (partição `execution_date` no GeoParquet).
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :return: Tupla (pontos gravados, pontos com erro).
+    """
+
+    count = len(batch.x)
+    if not count:
+        return 0, 0
+
+    with metrics.stage(name, "upsert"):
+        if _SINK == "geoparquet":
+            from .geoparquet import points_table
+            table = points_table(batch.x, batch.y, batch.value, measure, srid, batch.code)
+            _append(name, execution_date, table, srid)
+    metrics.count(name, "points_written", count)
+    metrics.count(name, "batches_committed")
+    return count, 0
+
+def write_layered_points(batch, names, measures, execution_date, group_name, srid=4326):
+    """
+    Grava um LayeredBatch em um destino sem banco, com os pontos de cada dado na sua própria partição.
+
+    :param batch: LayeredBatch com os pontos.
+    :param names: Nomes dos dados, na ordem das camadas.
+    :param measures: Unidades de medida, na ordem das camadas.
+    :param execution_date: Data de execução (partição `execution_date` no GeoParquet).
+    :param group_name: Nome do grupo, usado nas métricas.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :return: Dicionário com os pontos gravados por dado.
+    """
+
+    written = {}
+    with metrics.stage(group_name, "upsert"):
+        for name, measure, values, valid in zip(names, measures, batch.values, batch.valid):
+            written[name] = int(valid.sum())
+            if _SINK == "geoparquet" and written[name]:
+                from .geoparquet import points_table
+                codes = batch.code[valid] if batch.code is not None else None
+                table = points_table(batch.x[valid], batch.y[valid], values[valid], measure, srid, codes)
+                _append(name, execution_date, table, srid)
+    metrics.count(group_name, "points_written", len(batch.x))
+    metrics.count(group_name, "batches_committed")
+    return written
+
+def flush_sink():
+    """
+    Grava os pontos ainda acumulados no destino "geoparquet". Deve ser chamada
+    ao final da carga (e ao final de cada tarefa nos processos filhos).
+    """
+
+    with _LOCK:
+        buffers = list(_BUFFERS.items())
+        _BUFFERS.clear()
+
+    if not buffers:
+        return
+
+    from .geoparquet import write_geoparquet
+    for (dataset, execution_date), buffer in buffers:
+        write_geoparquet(_OUTPUT_DIR, dataset, execution_date, buffer["tables"], buffer["srid"])
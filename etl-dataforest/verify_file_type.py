@@ -1,65 +1,338 @@
 import os
-from .asc_functions import process_raster_in_chunks
-from .shp_functions import process_shapefile
+from .connection_pool import get_connection
+from .manifest import get_manifest_entry, file_fingerprint, is_dataset_unchanged, record_manifest, load_parameters
+from .checkpoint import load_checkpointed_counts
+from .grid_ids import id_scheme_signature
+from . import sinks
+
+
+def check_manifest(key, value, table_name, parameters, force=False):
+    """
+    Consulta o manifesto para decidir se um conjunto de dados precisa ser carregado.
+
+    :param key: Nome do atributo.
+    :param value: Dicionário com informações do arquivo.
+    :param table_name: Nome da tabela onde os dados serão inseridos.
+    :param parameters: Parâmetros da carga (ver `manifest.load_parameters`).
+    :param force: Se True, carrega o conjunto mesmo que ele não tenha mudado.
+    :return: Impressão digital da fonte, ou None se o conjunto já foi carregado e não mudou
+        (string vazia nos destinos sem banco).
+    """
+
+    # Sem banco não há manifesto: o conjunto é sempre processado
+    if not sinks.uses_database():
+        return ""
+
+    with get_connection() as (conn, cursor):
+        entry = get_manifest_entry(cursor, table_name, key)
+    fingerprint = file_fingerprint(value['path'], entry)
+
+    if not force and is_dataset_unchanged(
+        entry, value['path'], fingerprint, value['escala'], value['medida'], parameters
+    ):
+        print(f"{key} não mudou desde a carga de {entry['execution_date']}, pulando...")
+        return None
+
+    return fingerprint
+
+def finish_manifest(key, value, table_name, fingerprint, execution_date, written, failed, parameters):
+    """
+    Registra no manifesto uma carga concluída. Cargas com lotes com erro não
+    são registradas, para que sejam refeitas na próxima execução.
+
+    :param key: Nome do atributo.
+    :param value: Dicionário com informações do arquivo.
+    :param table_name: Nome da tabela onde os dados foram inseridos.
+    :param fingerprint: Impressão digital da fonte (ver `check_manifest`).
+    :param execution_date: Data de execução da carga.
+    :param written: Quantidade de pontos gravados, incluindo os das janelas puladas na retomada.
+    :param failed: Quantidade de pontos cujo lote falhou.
+    :param parameters: Parâmetros da carga (ver `manifest.load_parameters`).
+    """
+
+    if failed:
+        print(f"{key}: {failed} pontos não foram gravados, o manifesto não será atualizado.")
+        return
+
+    if not sinks.uses_database():
+        return
+
+    with get_connection() as (conn, cursor):
+        record_manifest(
+            conn,
+            cursor,
+            table_name,
+            key,
+            value['path'],
+            fingerprint,
+            value['escala'],
+            value['medida'],
+            parameters,
+            execution_date,
+            written
+        )
 
 def verify_file_type(
         key, 
         value, 
-        conn, 
-        cursor, 
         execution_date, 
         table_name,
         shp_table,
         sampling_stride=10,
         batch_size=1000,
-        srid=4326
+        srid=4326,
+        clip_mode="mask",
+        chunk_workers=8,
+        execution_mode="thread",
+        raster_workers=None,
+        pipeline_options=None,
+        raster_cache_dir=None,
+        force=False,
+        resume=False,
+        layout="jsonb",
+        async_connections=4,
+        aggregation=None,
+        roi=False,
+        shp_spacing_km=0
     ):
     """
     Verifica o tipo de arquivo e processa conforme necessário.
+
+    As conexões com o banco de dados são emprestadas do pool de conexões. Nos
+    destinos sem banco (ver `sinks`), o manifesto não é consultado e nenhuma
+    conexão é aberta.
+
+    Os módulos de cada tipo de arquivo (rasterio para ASC, GeoPandas para SHP)
+    só são importados quando um arquivo desse tipo é processado.
     
     :param key: Nome do atributo.
     :param value: Dicionário com informações do arquivo.
-    :param conn: Conexão com o banco de dados.
-    :param cursor: Cursor do banco de dados.
     :param execution_date: Data de execução para o registro.
     :param table_name: Nome da tabela onde os dados serão inseridos.
     :param shp_table: Nome da tabela de polígonos para verificação espacial.
     :param sampling_stride: Passo de amostragem para os dados.
     :param batch_size: Tamanho do lote para inserção no banco de dados.
     :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param clip_mode: Modo de recorte dos arquivos ASC ("mask" ou "query").
+    :param chunk_workers: Quantidade de threads que processam os blocos de um arquivo ASC.
+    :param execution_mode: "thread" para processar os blocos ASC em threads, "process" para usar processos
+        ou "async" para enviar vários lotes ao mesmo tempo com asyncpg enquanto as threads decodificam os próximos.
+    :param raster_workers: Quantidade de processos no modo "process" (default é a quantidade de núcleos).
+    :param pipeline_options: Dicionário com transform_workers, queue_size e max_memory_mb do pipeline do modo "thread".
+    :param raster_cache_dir: Diretório do cache de GeoTIFF dos arquivos ASC. Se None, o ASC é lido diretamente.
+    :param force: Se True, processa o arquivo mesmo que o manifesto indique que ele não mudou.
+    :param resume: Se True, retoma a carga dos arquivos ASC a partir das janelas já gravadas na mesma data.
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    :param async_connections: Quantidade de conexões asyncpg no modo "async".
+    :param aggregation: Método de agregação das células dos arquivos ASC ("mean", "min", "max" ou "majority"),
+        ou None para amostrar. A chave "agregacao" do arquivo, se existir, tem precedência.
+    :param roi: Se True, lê dos arquivos ASC apenas as janelas que tocam os polígonos de referência.
+    :param shp_spacing_km: Espaçamento, em km, da reamostragem dos contornos dos arquivos SHP
+        (0 mantém apenas os vértices originais).
     """
 
     ext = os.path.splitext(value['path'])[1].lower()
+    aggregation = value.get('agregacao', aggregation)
 
-    if ext == '.asc':
-        # Processa arquivo ASC
-        process_raster_in_chunks(
+    # Consulta o manifesto para pular conjuntos já carregados e sem alterações
+    parameters = load_parameters(
+        value['path'], sampling_stride, srid, layout, aggregation, id_scheme_signature(), shp_table, shp_spacing_km
+    )
+    fingerprint = check_manifest(key, value, table_name, parameters, force)
+    if fingerprint is None:
+        return
+
+    # Na retomada, os pontos das janelas já gravadas entram na contagem do manifesto
+    previous = 0
+    if ext == '.asc' and resume and sinks.uses_database():
+        previous = load_checkpointed_counts(table_name, key, execution_date).get(key, 0)
+
+    raster_path = value['path']
+    if ext == '.asc' and raster_cache_dir:
+        from .raster_cache import get_cached_raster
+
+        # Lê a cópia em GeoTIFF tiled em vez de reprocessar o texto do ASC
+        raster_path = get_cached_raster(raster_path, raster_cache_dir)
+
+    if ext == '.asc' and execution_mode == 'process':
+        # Processa arquivo ASC em processos
+        from .raster_process_pool import process_raster_in_processes
+
+        written, failed = process_raster_in_processes(
             name=key,
-            raster_path=value['path'],
+            raster_path=raster_path,
             scale=value['escala'],
             measure=value['medida'],
             table_name=table_name,
             shp_table=shp_table,
             execution_date=execution_date,
-            conn=conn,
-            cursor=cursor,
+            sampling_stride=sampling_stride,
+            batch_size=batch_size,
+            srid=srid,
+            clip_mode=clip_mode,
+            workers=raster_workers,
+            resume=resume,
+            layout=layout,
+            aggregation=aggregation,
+            roi=roi
         )
 
-    elif ext == '.shp':
-        # Processa arquivo SHP
-        process_shapefile(
-            conn=conn,
-            cursor=cursor,
-            table_name=shp_table,
+    elif ext == '.asc' and execution_mode == 'async' and sinks.uses_database():
+        # Processa arquivo ASC com asyncpg, sobrepondo a decodificação e a escrita
+        from .async_loader import process_raster_async
+
+        pipeline_options = pipeline_options or {}
+        written, failed = process_raster_async(
+            name=key,
+            raster_path=raster_path,
+            scale=value['escala'],
+            measure=value['medida'],
+            table_name=table_name,
+            shp_table=shp_table,
+            execution_date=execution_date,
+            sampling_stride=sampling_stride,
+            batch_size=batch_size,
+            srid=srid,
+            clip_mode=clip_mode,
+            connections=async_connections,
+            decode_workers=pipeline_options.get("transform_workers", 2),
+            queue_size=pipeline_options.get("queue_size", 8),
+            resume=resume,
+            layout=layout,
+            aggregation=aggregation,
+            roi=roi
+        )
+
+    elif ext == '.asc':
+        # Processa arquivo ASC
+        from .asc_functions import process_raster_in_chunks
+
+        written, failed = process_raster_in_chunks(
             name=key,
-            shp_path=value['path'],
-            value=value['atributo'],
-            refer_shapefile_table=shp_table,
+            raster_path=raster_path,
+            scale=value['escala'],
+            measure=value['medida'],
+            table_name=table_name,
+            shp_table=shp_table,
             execution_date=execution_date,
-            escala=value['escala'],
-            medida=value['medida'],
-            spacing_km=sampling_stride,
-            srid=srid
+            sampling_stride=sampling_stride,
+            batch_size=batch_size,
+            srid=srid,
+            clip_mode=clip_mode,
+            chunk_workers=chunk_workers,
+            resume=resume,
+            layout=layout,
+            aggregation=aggregation,
+            roi=roi,
+            **(pipeline_options or {})
         )
+
+    elif ext == '.shp':
+        # Processa arquivo SHP
+        from .shp_functions import process_shapefile
+
+        with sinks.sink_connection() as (conn, cursor):
+            written, failed = process_shapefile(
+                conn=conn,
+                cursor=cursor,
+                table_name=table_name,
+                name=key,
+                shp_path=value['path'],
+                value=value['atributo'],
+                refer_shapefile_table=shp_table,
+                execution_date=execution_date,
+                escala=value['escala'],
+                medida=value['medida'],
+                spacing_km=shp_spacing_km,
+                srid=srid,
+                layout=layout,
+                batch_size=batch_size,
+                clip_mode=clip_mode
+            )
     else:
         raise ValueError(f"Tipo de arquivo não suportado: {ext}")
+
+    finish_manifest(key, value, table_name, fingerprint, execution_date, previous + written, failed, parameters)
+
+def verify_raster_group(
+        group,
+        execution_date,
+        table_name,
+        shp_table,
+        sampling_stride=10,
+        batch_size=1000,
+        srid=4326,
+        clip_mode="mask",
+        chunk_workers=8,
+        pipeline_options=None,
+        force=False,
+        resume=False,
+        layout="jsonb",
+        roi=False
+    ):
+    """
+    Processa juntos os arquivos ASC de um grupo com a mesma grade, gravando cada ponto uma única vez.
+
+    Os arquivos que não mudaram desde a última carga são retirados do grupo.
+
+    :param group: Lista de tuplas (nome, informações, caminho do raster) (ver `multi_layer.group_aligned_rasters`).
+    :param execution_date: Data de execução para o registro.
+    :param table_name: Nome da tabela onde os dados serão inseridos.
+    :param shp_table: Nome da tabela de polígonos para verificação espacial.
+    :param sampling_stride: Passo de amostragem para os dados.
+    :param batch_size: Tamanho do lote para inserção no banco de dados.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param clip_mode: Modo de recorte dos arquivos ASC ("mask" ou "query").
+    :param chunk_workers: Quantidade de threads que gravam os pontos.
+    :param pipeline_options: Dicionário com transform_workers, queue_size e max_memory_mb do pipeline.
+    :param force: Se True, processa os arquivos mesmo que o manifesto indique que não mudaram.
+    :param resume: Se True, retoma a carga a partir das janelas já gravadas na mesma data.
+    :param layout: Layout de armazenamento ("jsonb" ou "narrow").
+    :param roi: Se True, lê apenas as janelas que tocam os polígonos de referência.
+    """
+
+    pending = []
+    fingerprints = {}
+    parameters = {}
+    for key, value, raster_path in group:
+        parameters[key] = load_parameters(value['path'], sampling_stride, srid, layout, None, id_scheme_signature(), shp_table)
+        fingerprint = check_manifest(key, value, table_name, parameters[key], force)
+        if fingerprint is not None:
+            pending.append((key, value, raster_path))
+            fingerprints[key] = fingerprint
+
+    if not pending:
+        return
+
+    from .multi_layer import process_raster_group
+
+    # Os checkpoints do grupo ficam sob o mesmo nome usado em `multi_layer.process_raster_group`
+    previous = {}
+    if resume and sinks.uses_database():
+        group_name = "+".join(key for key, _, _ in pending)
+        previous = load_checkpointed_counts(table_name, group_name, execution_date)
+
+    pipeline_options = pipeline_options or {}
+    written, failed = process_raster_group(
+        pending,
+        table_name,
+        shp_table,
+        execution_date,
+        sampling_stride=sampling_stride,
+        batch_size=batch_size,
+        srid=srid,
+        clip_mode=clip_mode,
+        chunk_workers=chunk_workers,
+        transform_workers=pipeline_options.get("transform_workers", 2),
+        queue_size=pipeline_options.get("queue_size", 8),
+        resume=resume,
+        layout=layout,
+        roi=roi,
+        max_memory_mb=pipeline_options.get("max_memory_mb")
+    )
+
+    for key, value, _ in pending:
+        finish_manifest(
+            key, value, table_name, fingerprints[key], execution_date, previous.get(key, 0) + written[key], failed,
+            parameters[key]
+        )
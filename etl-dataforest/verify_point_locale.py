@@ -1,7 +1,94 @@
+import threading
+import numpy as np
+
+
+# Tabelas de referência cuja tabela subdividida está em dia, verificadas uma vez por processo
+_SUBDIVIDED = {}
+_LOCK = threading.Lock()
+
+
+def subdivided_table_name(table_name):
+    """
+    Retorna o nome da tabela derivada com os polígonos subdivididos (ver `create_table.create_subdivided_table`).
+
+    :param table_name: Nome da tabela com os polígonos de referência.
+    """
+
+    return f"{table_name}_subdividida"
+
+def forget_subdivided_table(table_name):
+    """
+    Descarta a verificação da tabela subdividida, depois que ela é criada ou recriada.
+
+    :param table_name: Nome da tabela com os polígonos de referência.
+    """
+
+    with _LOCK:
+        _SUBDIVIDED.pop(table_name, None)
+
+def uses_subdivided_table(cursor, table_name):
+    """
+    Verifica se a tabela subdividida existe e cobre os mesmos polígonos da
+    tabela de referência. Sem ela (ou desatualizada), as consultas usam a
+    tabela de referência diretamente, em vez de descartar todos os pontos.
+
+    :param cursor: Cursor do banco de dados.
+    :param table_name: Nome da tabela com os polígonos de referência.
+    :return: True se a tabela subdividida pode ser usada.
+    """
+
+    with _LOCK:
+        if table_name in _SUBDIVIDED:
+            return _SUBDIVIDED[table_name]
+
+    subdivided_table = subdivided_table_name(table_name)
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (subdivided_table,))
+    current = cursor.fetchone()[0]
+    if current:
+        cursor.execute(f"""
+            SELECT (SELECT count(DISTINCT origem_gid) FROM {subdivided_table})
+                 = (SELECT count(*) FROM {table_name} WHERE geom IS NOT NULL)
+        """)
+        current = cursor.fetchone()[0]
+    if not current:
+        print(f"A tabela {subdivided_table} não existe ou está desatualizada; consultando {table_name} diretamente.")
+
+    with _LOCK:
+        _SUBDIVIDED[table_name] = current
+    return current
+
+def containment_sql(table_name, point, subdivided=True):
+    """
+    Monta o FROM e o WHERE que encontram os polígonos de referência (alias `o`) que contêm um ponto.
+
+    O critério é sempre o `ST_Contains` no polígono original, o mesmo da
+    máscara de recorte e de `reference_cache.locate_in_reference`: pontos
+    sobre o contorno ficam de fora. A tabela subdividida serve de filtro pelo
+    índice; um ponto no interior de uma parte está no interior do polígono,
+    então o polígono original só é consultado para os pontos sobre a borda de
+    uma parte (as linhas de corte ou o contorno).
+
+    :param table_name: Nome da tabela com os polígonos de referência.
+    :param point: Expressão SQL da geometria do ponto.
+    :param subdivided: Se True, usa a tabela subdividida como filtro (ver `uses_subdivided_table`).
+    :return: Tupla (FROM, WHERE).
+    """
+
+    if not subdivided:
+        return f"{table_name} o", f"ST_Contains(o.geom, {point})"
+
+    return (
+        f"{subdivided_table_name(table_name)} s JOIN {table_name} o ON o.gid = s.origem_gid",
+        f"ST_Intersects(s.geom, {point}) AND (ST_Contains(s.geom, {point}) OR ST_Contains(o.geom, {point}))"
+    )
+
 def is_point_in_polygon(cursor, x, y, table_name ,srid=4326):
     """
     Verifica se as coordenadas (x, y) estão dentro dos limites de outro polígono
 
+    A consulta usa a tabela subdividida derivada de `table_name` como filtro,
+    com o critério de `ST_Contains` no polígono original (ver `containment_sql`).
+
     :param cursor: Cursor do banco de dados.
     :param x: Coordenada x (longitude).
     :param y: Coordenada y (latitude).
@@ -10,13 +97,107 @@ def is_point_in_polygon(cursor, x, y, table_name ,srid=4326):
     """
 
     try:
+        source, condition = containment_sql(table_name, "pt.geom", uses_subdivided_table(cursor, table_name))
         cursor.execute(f"""
             SELECT EXISTS (
-                SELECT 1 FROM {table_name}
-                WHERE ST_Contains(geom, ST_SetSRID(ST_MakePoint(%s, %s), %s))
+                SELECT 1
+                FROM (SELECT ST_SetSRID(ST_MakePoint(%s, %s), %s) AS geom) pt, {source}
+                WHERE {condition}
             )
         """, (x, y, srid))
         result = cursor.fetchone()
         return result and result[0]
     except Exception as e:
+        print(f"Erro ao verificar ponto no polígono: {e}")
+        cursor.connection.rollback()
         return False
+
+def points_in_polygon(cursor, xs, ys, table_name, srid=4326, batch_size=10000):
+    """
+    Verifica de uma vez quais pontos de um lote estão dentro dos limites de outro polígono.
+
+    Usa uma única consulta a cada `batch_size` pontos: as coordenadas são
+    enviadas como arrays, expandidas com `unnest ... WITH ORDINALITY` e testadas
+    com o mesmo critério de `is_point_in_polygon`.
+
+    :param cursor: Cursor do banco de dados.
+    :param xs: Coordenadas x (longitude), em lista ou array.
+    :param ys: Coordenadas y (latitude), em lista ou array.
+    :param table_name: Nome da tabela que contém o polígono.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param batch_size: Quantidade máxima de pontos por consulta.
+    :return: Array booleano, verdadeiro para os pontos dentro do polígono.
+    """
+
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    inside = np.zeros(len(xs), dtype=bool)
+
+    for start in range(0, len(xs), batch_size):
+        end = start + batch_size
+        try:
+            source, condition = containment_sql(table_name, "pt.geom", uses_subdivided_table(cursor, table_name))
+            cursor.execute(f"""
+                SELECT p.ord
+                FROM unnest(%s::float8[], %s::float8[]) WITH ORDINALITY AS p(x, y, ord)
+                CROSS JOIN LATERAL (SELECT ST_SetSRID(ST_MakePoint(p.x, p.y), %s) AS geom) pt
+                WHERE EXISTS (
+                    SELECT 1 FROM {source}
+                    WHERE {condition}
+                )
+            """, (xs[start:end].tolist(), ys[start:end].tolist(), srid))
+            positions = np.fromiter((row[0] for row in cursor.fetchall()), dtype=np.int64)
+            inside[start + positions - 1] = True
+        except Exception as e:
+            # Mesmo comportamento de is_point_in_polygon: em caso de erro os pontos ficam de fora
+            print(f"Erro ao verificar pontos no polígono: {e}")
+            cursor.connection.rollback()
+
+    return inside
+
+def locate_points(cursor, xs, ys, table_name, code_column, srid=4326, batch_size=10000):
+    """
+    Localiza de uma vez o polígono que contém cada ponto de um lote e retorna o seu código.
+
+    É a mesma consulta de `points_in_polygon`, trazendo o código do polígono
+    original que contém o ponto.
+
+    :param cursor: Cursor do banco de dados.
+    :param xs: Coordenadas x (longitude), em lista ou array.
+    :param ys: Coordenadas y (latitude), em lista ou array.
+    :param table_name: Nome da tabela que contém os polígonos.
+    :param code_column: Coluna da tabela com o código de cada polígono.
+    :param srid: SRID do sistema de referência espacial (default é 4326).
+    :param batch_size: Quantidade máxima de pontos por consulta.
+    :return: Tupla (array booleano dos pontos dentro de algum polígono, array com o código de cada ponto).
+    """
+
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    inside = np.zeros(len(xs), dtype=bool)
+    codes = np.full(len(xs), None, dtype=object)
+
+    for start in range(0, len(xs), batch_size):
+        end = start + batch_size
+        try:
+            source, condition = containment_sql(table_name, "pt.geom", uses_subdivided_table(cursor, table_name))
+            cursor.execute(f"""
+                SELECT p.ord, r.codigo
+                FROM unnest(%s::float8[], %s::float8[]) WITH ORDINALITY AS p(x, y, ord)
+                CROSS JOIN LATERAL (SELECT ST_SetSRID(ST_MakePoint(p.x, p.y), %s) AS geom) pt
+                CROSS JOIN LATERAL (
+                    SELECT o."{code_column}"::text AS codigo
+                    FROM {source}
+                    WHERE {condition}
+                    LIMIT 1
+                ) r
+            """, (xs[start:end].tolist(), ys[start:end].tolist(), srid))
+            rows = cursor.fetchall()
+            positions = np.fromiter((row[0] for row in rows), dtype=np.int64) + start - 1
+            inside[positions] = True
+            codes[positions] = [row[1] for row in rows]
+        except Exception as e:
+            print(f"Erro ao verificar pontos no polígono: {e}")
+            cursor.connection.rollback()
+
+    return inside, codes
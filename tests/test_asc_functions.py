@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from etl_dataforest.asc_functions import (
+    _majority,
+    aggregate_block,
+    aggregation_window_size,
+    pipeline_queue_size,
+    sample_block
+)
+
+
+TRANSFORM = from_origin(-50.0, 0.0, 0.5, 0.5)
+
+
+def write_raster(path, shape, dtype="float32", block=256):
+    """
+    Grava um GeoTIFF tiled de teste, como os do cache de rasters.
+    """
+
+    with rasterio.open(
+        path, "w", driver="GTiff", height=shape[0], width=shape[1], count=1, dtype=dtype,
+        transform=from_origin(-50.0, 0.0, 1 / 120, 1 / 120), tiled=True, blockxsize=block, blockysize=block
+    ) as dst:
+        dst.write(np.zeros(shape, dtype=dtype), 1)
+    return str(path)
+
+def test_queue_size_without_memory_ceiling_uses_default(tmp_path):
+    assert pipeline_queue_size(write_raster(tmp_path / "a.tif", (512, 512)), None, 8) == 8
+
+def test_queue_size_counts_native_blocks(tmp_path):
+    path = write_raster(tmp_path / "a.tif", (2048, 2048))
+
+    # Blocos de 256 x 256 float32 = 256 KB; 4 MB divididos entre as duas filas
+    assert pipeline_queue_size(path, 4, 8) == 8
+
+def test_queue_size_counts_aggregation_windows(tmp_path):
+    path = write_raster(tmp_path / "a.tif", (2048, 2048))
+    size = aggregation_window_size(10)
+
+    assert size == 510
+    assert pipeline_queue_size(path, 4, 8, 10, "mean") == 4 * 1024 * 1024 // (2 * size * size * 4)
+
+def test_queue_size_adds_every_layer(tmp_path):
+    paths = [
+        write_raster(tmp_path / "a.tif", (2048, 2048)),
+        write_raster(tmp_path / "b.tif", (2048, 2048), dtype="float64"),
+    ]
+
+    assert pipeline_queue_size(paths, 6, 8) == 6 * 1024 * 1024 // (2 * 256 * 256 * (4 + 8))
+
+@pytest.mark.parametrize("stride", [1, 7, 600])
+def test_aggregation_window_is_a_multiple_of_the_stride(stride):
+    size = aggregation_window_size(stride)
+
+    assert size % stride == 0
+    assert size <= max(512, stride)
+
+def test_majority_ignores_nan_and_breaks_ties_by_the_smallest_value():
+    cells = np.array([
+        [3.0, 1.0, 3.0, np.nan],
+        [2.0, 5.0, 5.0, 2.0],
+        [np.nan, np.nan, np.nan, 7.0],
+        [np.nan, np.nan, np.nan, np.nan],
+    ])
+
+    result = _majority(cells)
+
+    np.testing.assert_array_equal(result[:3], [3.0, 2.0, 7.0])
+    assert np.isnan(result[3])
+
+@pytest.mark.parametrize("aggregation, reduce", [
+    ("mean", np.nanmean),
+    ("min", np.nanmin),
+    ("max", np.nanmax),
+])
+def test_aggregate_block_matches_each_cell(aggregation, reduce):
+    rng = np.random.default_rng(0)
+    # Bloco de 7 x 8 pixels em células de 3: a última linha e coluna de células ficam incompletas
+    values = rng.integers(0, 5, (7, 8)).astype(np.float32)
+    values[0, 0] = -9999
+    values[3:6, 6:8] = np.nan
+    window = Window(col_off=6, row_off=3, width=8, height=7)
+
+    batch = aggregate_block(values, TRANSFORM, window, 2.0, 3, -9999, aggregation=aggregation)
+
+    data = np.where(values == -9999, np.nan, values)
+    expected = [
+        (*TRANSFORM * (6 + col, 3 + row), reduce(data[row:row + 3, col:col + 3]) * 2.0)
+        for row in range(0, 7, 3) for col in range(0, 8, 3)
+        if not np.isnan(data[row:row + 3, col:col + 3]).all()
+    ]
+    assert len(expected) == 8
+    np.testing.assert_allclose(np.column_stack([batch.x, batch.y, batch.value]), expected)
+
+def test_aggregated_points_fall_on_the_sampled_points():
+    values = np.arange(60, dtype=np.float64).reshape(6, 10)
+    window = Window(col_off=5, row_off=5, width=10, height=6)
+
+    sampled = sample_block(values, TRANSFORM, window, 1.0, 5)
+    aggregated = aggregate_block(values, TRANSFORM, window, 1.0, 5, aggregation="majority")
+
+    np.testing.assert_array_equal(aggregated.x, sampled.x)
+    np.testing.assert_array_equal(aggregated.y, sampled.y)
+    # Sem valores repetidos, a moda de cada célula é o menor valor
+    np.testing.assert_array_equal(aggregated.value, [0.0, 5.0, 50.0, 55.0])
+
+def test_aggregate_block_keeps_only_cells_whose_point_is_in_the_mask():
+    values = np.ones((4, 4))
+    clip_mask = np.ones((4, 4), dtype=bool)
+    # Primeiro pixel da célula de cima à esquerda fora do recorte
+    clip_mask[0, 0] = False
+    # Célula de baixo à direita só com o primeiro pixel dentro
+    clip_mask[2:, 2:] = False
+    clip_mask[2, 2] = True
+    values[2, 2] = 9.0
+
+    batch = aggregate_block(values, TRANSFORM, Window(0, 0, 4, 4), 1.0, 2, clip_mask=clip_mask)
+
+    assert list(zip(batch.x, batch.y)) == [TRANSFORM * (2, 0), TRANSFORM * (0, 2), TRANSFORM * (2, 2)]
+    np.testing.assert_array_equal(batch.value, [1.0, 1.0, 9.0])
+
+def test_aggregate_block_rejects_unknown_method():
+    with pytest.raises(ValueError):
+        aggregate_block(np.ones((2, 2)), TRANSFORM, Window(0, 0, 2, 2), 1.0, 2, aggregation="median")
@@ -0,0 +1,100 @@
+import json
+from etl_dataforest import grid_ids
+from etl_dataforest.bulk_loader import copy_upsert, point_rows, staging_columns, staging_table_name, upsert_layered_points
+from etl_dataforest.create_table import create_narrow_tables, create_table
+
+
+def document(name, value, measure, date="2024-01-01"):
+    return json.dumps({date: {name: {"valor": value, "medida": measure}}})
+
+def test_staging_table_depends_on_layout_and_id_type():
+    scheme, grid = grid_ids.get_id_settings()
+    try:
+        assert staging_table_name("jsonb") == "etl_staging_jsonb_text"
+        grid_ids.init_id_scheme("cell")
+        assert staging_table_name("narrow") == "etl_staging_narrow_bigint"
+    finally:
+        grid_ids.init_id_scheme(scheme, grid["origin_x"], grid["origin_y"], grid["cell_size"], grid["srid"])
+
+def test_jsonb_rows_carry_one_document_per_point():
+    rows = list(point_rows([1.5, -2.0], [3.0, 4.25], [10.5, "alto"], "chuva", "mm", "2024-01-01", codes=["A", None]))
+
+    assert [len(row) for row in rows] == [len(staging_columns("jsonb"))] * 2
+    assert rows == [
+        ("1.5,3.0", 1.5, 3.0, document("chuva", 10.5, "mm"), "A"),
+        ("-2.0,4.25", -2.0, 4.25, document("chuva", "alto", "mm"), None),
+    ]
+
+def test_narrow_rows_split_numeric_and_text_values():
+    rows = list(point_rows([1.5, -2.0, 0.0], [3.0, 4.25, 1.0], [10.5, "alto", 7], "chuva", "mm", "2024-01-01", layout="narrow"))
+
+    assert [len(row) for row in rows] == [len(staging_columns("narrow"))] * 3
+    assert rows == [
+        ("1.5,3.0", 1.5, 3.0, "chuva", "2024-01-01", 10.5, None, "mm", None),
+        ("-2.0,4.25", -2.0, 4.25, "chuva", "2024-01-01", None, "alto", "mm", None),
+        ("0.0,1.0", 0.0, 1.0, "chuva", "2024-01-01", 7, None, "mm", None),
+    ]
+
+def test_point_rows_use_cell_ids_when_configured():
+    scheme, grid = grid_ids.get_id_settings()
+    try:
+        grid_ids.init_id_scheme("cell")
+        rows = list(point_rows([-74.0], [5.0], [1.0], "chuva", "mm", "2024-01-01", layout="narrow"))
+        assert rows[0][0] == grid_ids.cell_ids([-74.0], [5.0])[0]
+    finally:
+        grid_ids.init_id_scheme(scheme, grid["origin_x"], grid["origin_y"], grid["cell_size"], grid["srid"])
+
+def test_repeated_id_merges_the_documents_of_both_layers(postgis):
+    conn, cursor, schema = postgis
+    create_table(conn, cursor, "pontos", schema)
+
+    copy_upsert(cursor, "pontos", [
+        ("1,2", 1.0, 2.0, document("chuva", 10.5, "mm"), None),
+        ("1,2", 1.0, 2.0, document("temperatura", 21.0, "C"), "3550308"),
+        ("3,4", 3.0, 4.0, document("chuva", 7.0, "mm"), None),
+    ])
+    conn.commit()
+
+    cursor.execute("SELECT id, raster, ref_codigo FROM pontos ORDER BY id")
+    rows = cursor.fetchall()
+    assert [row[0] for row in rows] == ["1,2", "3,4"]
+    assert rows[0][1] == {"2024-01-01": {
+        "chuva": {"valor": 10.5, "medida": "mm"},
+        "temperatura": {"valor": 21.0, "medida": "C"},
+    }}
+    assert rows[0][2] == "3550308"
+
+def test_narrow_layers_sharing_an_id_keep_one_point_and_every_value(postgis):
+    conn, cursor, schema = postgis
+    create_narrow_tables(conn, cursor, "pontos", schema)
+
+    layers = [
+        ("chuva", "mm", [10.5, 7.0], [True, True]),
+        ("temperatura", "C", [21.0, 19.0], [True, False]),
+    ]
+    upsert_layered_points(cursor, "pontos", [1.0, 3.0], [2.0, 4.0], layers, "2024-01-01", layout="narrow")
+    conn.commit()
+
+    cursor.execute("SELECT count(*) FROM pontos_pontos")
+    assert cursor.fetchone()[0] == 2
+    cursor.execute("SELECT point_id, dataset, valor FROM pontos_valores ORDER BY point_id, dataset")
+    assert cursor.fetchall() == [("1.0,2.0", "chuva", 10.5), ("1.0,2.0", "temperatura", 21.0), ("3.0,4.0", "chuva", 7.0)]
+
+def test_staging_table_is_reused_between_batches(postgis):
+    conn, cursor, schema = postgis
+    create_table(conn, cursor, "pontos", schema)
+
+    # Dois lotes na mesma transação e um terceiro depois do commit
+    copy_upsert(cursor, "pontos", [("1,2", 1.0, 2.0, document("chuva", 1.0, "mm"), None)])
+    copy_upsert(cursor, "pontos", [("3,4", 3.0, 4.0, document("chuva", 2.0, "mm"), None)])
+    conn.commit()
+    copy_upsert(cursor, "pontos", [("1,2", 1.0, 2.0, document("chuva", 3.0, "mm"), None)])
+    conn.commit()
+
+    cursor.execute("SELECT id, raster -> '2024-01-01' -> 'chuva' ->> 'valor' FROM pontos ORDER BY id")
+    assert cursor.fetchall() == [("1,2", "3.0"), ("3,4", "2.0")]
+    cursor.execute("""
+        SELECT count(*) FROM pg_class
+        WHERE relname LIKE 'etl_staging_%' AND relkind = 'r' AND relnamespace = pg_my_temp_schema()
+    """)
+    assert cursor.fetchone()[0] == 1
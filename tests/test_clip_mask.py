@@ -0,0 +1,69 @@
+import numpy as np
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from shapely.geometry import Polygon, box
+from etl_dataforest.asc_functions import sample_block
+from etl_dataforest.clip_mask import LabelMask, build_clip_mask
+from etl_dataforest.reference_cache import locate_in_reference
+
+
+# Raster de 20 x 30 pixels de 0,5 unidade, com o canto superior esquerdo em (10, 50)
+TRANSFORM = from_origin(10.0, 50.0, 0.5, 0.5)
+SHAPE = (20, 30)
+# Vértices fora da grade, para que nenhum canto de pixel caia sobre uma borda
+POLYGONS = [
+    Polygon([(10.3, 40.2), (24.7, 41.1), (17.9, 49.6)]),
+    box(21.1, 44.1, 24.2, 49.3),
+]
+CODES = np.array(["tri", "ret"], dtype=object)
+
+
+def pixel_corners():
+    row, col = np.mgrid[0:SHAPE[0], 0:SHAPE[1]]
+    x = col * TRANSFORM.a + TRANSFORM.c
+    y = row * TRANSFORM.e + TRANSFORM.f
+    return x, y
+
+def test_mask_tests_the_sampled_corner_of_each_pixel(make_reference):
+    mask = build_clip_mask(POLYGONS, SHAPE, TRANSFORM)
+
+    x, y = pixel_corners()
+    inside, _ = locate_in_reference(x.ravel(), y.ravel(), make_reference(POLYGONS))
+    assert mask.dtype == bool
+    assert mask.any()
+    np.testing.assert_array_equal(mask, inside.reshape(SHAPE))
+
+def test_label_mask_matches_polygon_codes(make_reference):
+    labels = build_clip_mask(POLYGONS, SHAPE, TRANSFORM, labels=True)
+
+    x, y = pixel_corners()
+    _, codes = locate_in_reference(x.ravel(), y.ravel(), make_reference(POLYGONS), CODES)
+    expected = np.array([0 if code is None else CODES.tolist().index(code) + 1 for code in codes])
+    np.testing.assert_array_equal(labels, expected.reshape(SHAPE))
+
+def test_empty_reference_masks_everything():
+    assert not build_clip_mask([], SHAPE, TRANSFORM).any()
+
+def test_sample_block_keeps_the_raster_grid_and_the_mask(make_reference):
+    values = np.arange(SHAPE[0] * SHAPE[1], dtype=np.float64).reshape(SHAPE)
+    values[6, 14] = np.nan
+    values[8, 10] = -9999
+    mask = build_clip_mask(POLYGONS, SHAPE, TRANSFORM)
+    clip_mask = LabelMask(build_clip_mask(POLYGONS, SHAPE, TRANSFORM, labels=True), CODES)
+    x, y = pixel_corners()
+    _, corner_codes = locate_in_reference(x.ravel(), y.ravel(), make_reference(POLYGONS), CODES)
+    corner_codes = corner_codes.reshape(SHAPE)
+
+    # Bloco que não começa na grade de amostragem
+    window = Window(col_off=3, row_off=1, width=17, height=15)
+    block = values[1:16, 3:20]
+    batch = sample_block(block, TRANSFORM, window, 2.0, 2, -9999, clip_mask)
+
+    expected = [
+        (x[row, col], y[row, col], values[row, col] * 2.0, corner_codes[row, col])
+        for row in range(1, 16) for col in range(3, 20)
+        if row % 2 == 0 and col % 2 == 0 and mask[row, col]
+        and not np.isnan(values[row, col]) and values[row, col] != -9999
+    ]
+    assert expected
+    assert list(zip(batch.x, batch.y, batch.value, batch.code)) == expected
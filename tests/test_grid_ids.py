@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from etl_dataforest import grid_ids
+
+
+@pytest.fixture(autouse=True)
+def reference_grid():
+    """
+    Usa a grade padrão de 30 segundos de arco e restaura o esquema ao final.
+    """
+
+    scheme, grid = grid_ids.get_id_settings()
+    grid_ids.init_id_scheme("cell", -180.0, -90.0, 1 / 120, 4326)
+    yield
+    grid_ids.init_id_scheme(scheme, grid["origin_x"], grid["origin_y"], grid["cell_size"], grid["srid"])
+
+def raster_corners(x0, y0, cell_size, rows, cols):
+    """
+    Cantos superiores esquerdos dos pixels, como em `asc_functions.sampled_coordinates`.
+    """
+
+    row, col = np.mgrid[0:rows, 0:cols]
+    return (col * cell_size + x0).ravel(), (row * -cell_size + y0).ravel()
+
+def test_aligned_corners_have_unique_consecutive_ids():
+    x, y = raster_corners(-74.0, 5.0, 1 / 120, 200, 300)
+    ids = grid_ids.cell_ids(x, y)
+
+    assert grid_ids.count_cell_collisions(ids) == 0
+    columns = (ids % grid_ids.CELL_COLUMNS).reshape(200, 300)
+    rows = (ids // grid_ids.CELL_COLUMNS).reshape(200, 300)
+    assert (np.diff(columns, axis=1) == 1).all()
+    assert (np.diff(rows, axis=0) == -1).all()
+    assert columns[0, 0] == 106 * 120
+    assert rows[0, 0] == 95 * 120
+
+def test_truncated_cellsize_header_gives_same_ids():
+    # Cabeçalho ASC com "cellsize 0.0083333333" em vez de 1/120
+    exact = grid_ids.cell_ids(*raster_corners(-74.0, 5.0, 1 / 120, 50, 4000))
+    truncated = grid_ids.cell_ids(*raster_corners(-74.0, 5.0, 0.0083333333, 50, 4000))
+
+    np.testing.assert_array_equal(exact, truncated)
+
+def test_points_near_grid_lines_snap_and_interior_points_floor():
+    cell = 1 / 120
+    offsets = np.array([2.0, 3.0 - 1e-9, 2.0 + 1e-9, 2.5, 2.9995, 2.998])
+    ids = grid_ids.cell_ids(-180.0 + offsets * cell, np.full(len(offsets), -90.0))
+
+    np.testing.assert_array_equal(ids % grid_ids.CELL_COLUMNS, [2, 3, 2, 2, 3, 2])
+
+def test_rejects_points_outside_the_grid_or_in_another_srid():
+    with pytest.raises(ValueError):
+        grid_ids.cell_ids([-181.0], [0.0])
+    with pytest.raises(ValueError):
+        grid_ids.cell_ids([0.0], [0.0], srid=3857)
+
+def test_count_cell_collisions():
+    assert grid_ids.count_cell_collisions([]) == 0
+    assert grid_ids.count_cell_collisions([1, 2, 3]) == 0
+    assert grid_ids.count_cell_collisions([1, 2, 2, 3, 3, 3]) == 3
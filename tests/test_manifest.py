@@ -0,0 +1,69 @@
+import pytest
+from etl_dataforest.manifest import LOAD_PARAMETERS, is_dataset_unchanged, load_parameters
+
+
+FINGERPRINT = {"source_size": 10, "source_mtime_ns": 1, "source_hash": "abc"}
+ASC_DEFAULTS = dict(sampling_stride=10, srid=4326, layout="jsonb", aggregation=None,
+                    id_scheme="text", reference_table="brasil")
+
+
+def manifest_entry(path, parameters):
+    """
+    Entrada do manifesto como a devolvida por `get_manifest_entry` após `record_manifest`.
+    """
+
+    return {
+        "source_path": path, **FINGERPRINT, "escala": 1.0, "medida": "mm",
+        **parameters, "execution_date": "2024-01-01", "row_count": 100,
+    }
+
+def is_unchanged(path, previous, current):
+    return is_dataset_unchanged(manifest_entry(path, previous), path, FINGERPRINT, 1, "mm", current)
+
+def test_same_parameters_are_skipped():
+    parameters = load_parameters("dados/chuva.asc", **ASC_DEFAULTS)
+
+    assert set(parameters) == set(LOAD_PARAMETERS)
+    assert is_unchanged("dados/chuva.asc", parameters, load_parameters("dados/chuva.asc", **ASC_DEFAULTS))
+
+@pytest.mark.parametrize("change", [
+    {"layout": "narrow"},
+    {"aggregation": "mean"},
+    {"id_scheme": "cell:-180.0:-90.0:0.008333333333333333:4326"},
+    {"reference_table": "municipios"},
+    {"sampling_stride": 5},
+    {"srid": 4674},
+])
+def test_changed_raster_parameter_reloads(change):
+    previous = load_parameters("dados/chuva.asc", **ASC_DEFAULTS)
+    current = load_parameters("dados/chuva.asc", **{**ASC_DEFAULTS, **change})
+
+    assert not is_unchanged("dados/chuva.asc", previous, current)
+
+def test_shapefile_compares_spacing_instead_of_stride():
+    previous = load_parameters("dados/solos.shp", **ASC_DEFAULTS, shp_spacing_km=10)
+
+    assert previous["sampling_stride"] is None and previous["aggregation"] is None
+    assert is_unchanged("dados/solos.shp", previous, load_parameters(
+        "dados/solos.shp", **{**ASC_DEFAULTS, "sampling_stride": 5}, shp_spacing_km=10
+    ))
+    assert not is_unchanged("dados/solos.shp", previous, load_parameters(
+        "dados/solos.shp", **ASC_DEFAULTS, shp_spacing_km=5
+    ))
+    assert not is_unchanged("dados/solos.shp", previous, load_parameters("dados/solos.shp", **ASC_DEFAULTS))
+
+def test_entries_from_older_manifests_reload():
+    current = load_parameters("dados/chuva.asc", **ASC_DEFAULTS)
+    # Colunas acrescentadas depois ficam nulas nas entradas antigas
+    previous = {**current, "storage_layout": None, "id_scheme": None, "reference_table": None}
+
+    assert not is_unchanged("dados/chuva.asc", previous, current)
+
+def test_new_source_reloads():
+    parameters = load_parameters("dados/chuva.asc", **ASC_DEFAULTS)
+
+    assert not is_dataset_unchanged(None, "dados/chuva.asc", FINGERPRINT, 1, "mm", parameters)
+    assert not is_dataset_unchanged(
+        manifest_entry("dados/chuva.asc", parameters), "dados/chuva.asc",
+        {**FINGERPRINT, "source_hash": "def"}, 1, "mm", parameters
+    )
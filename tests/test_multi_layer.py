@@ -0,0 +1,58 @@
+import numpy as np
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from etl_dataforest.asc_functions import sample_block
+from etl_dataforest.clip_mask import LabelMask
+from etl_dataforest.multi_layer import sample_layers
+
+
+TRANSFORM = from_origin(-50.0, 0.0, 0.5, 0.5)
+# Janela que não começa na grade de amostragem
+WINDOW = Window(col_off=1, row_off=3, width=7, height=6)
+
+
+def layers():
+    """
+    Dois dados na mesma janela: nodata -9999 no primeiro e NaN no segundo, em pixels diferentes.
+    """
+
+    first = np.arange(42, dtype=np.float64).reshape(6, 7)
+    second = first * 10
+    first[1, 1] = -9999
+    second[1, 3] = np.nan
+    first[3, 5] = -9999
+    second[3, 5] = np.nan
+    return first, second
+
+def test_keeps_points_where_any_layer_is_valid():
+    first, second = layers()
+
+    batch = sample_layers([first, second], TRANSFORM, WINDOW, [1.0, 0.5], 2, [-9999, None])
+
+    # Só o ponto com os dois dados inválidos fica de fora
+    assert len(batch.x) == 8
+    sampled = [sample_block(values, TRANSFORM, WINDOW, scale, 2, nodata) for values, scale, nodata in
+               [(first, 1.0, -9999), (second, 0.5, None)]]
+    for layer, (values, valid) in enumerate(zip(batch.values, batch.valid)):
+        points = dict(zip(zip(sampled[layer].x, sampled[layer].y), sampled[layer].value))
+        assert valid.sum() == len(points)
+        for x, y, value, is_valid in zip(batch.x, batch.y, values, valid):
+            assert is_valid == ((x, y) in points)
+            if is_valid:
+                assert value == points[(x, y)]
+    assert batch.code is None
+
+def test_clip_mask_applies_to_every_layer():
+    first, second = layers()
+    labels = np.zeros((10, 10), dtype=np.int32)
+    # Só as duas primeiras colunas amostradas da janela ficam dentro do polígono
+    labels[:, :5] = 1
+    clip_mask = LabelMask(labels, np.array(["A"], dtype=object))
+
+    batch = sample_layers([first, second], TRANSFORM, WINDOW, [1.0, 1.0], 2, [-9999, None], clip_mask)
+
+    xs = sorted(set(batch.x))
+    assert xs == [TRANSFORM.c + 2 * 0.5, TRANSFORM.c + 4 * 0.5]
+    assert batch.code.tolist() == ["A"] * len(batch.x)
+    np.testing.assert_array_equal(batch.valid[0], [False, True, True, True, True, True])
+    np.testing.assert_array_equal(batch.valid[1], [True, False, True, True, True, True])
@@ -0,0 +1,52 @@
+import itertools
+import threading
+import pytest
+from etl_dataforest.pipeline import run_pipeline
+
+
+def test_writes_every_transformed_item():
+    written = []
+    lock = threading.Lock()
+
+    def write(item):
+        with lock:
+            written.append(item)
+
+    # Os ímpares são descartados pela transformação
+    run_pipeline(range(100), lambda item: item * 2 if item % 2 == 0 else None, write, 3, 2, 4)
+
+    assert sorted(written) == [item * 2 for item in range(0, 100, 2)]
+
+def test_reraises_source_error():
+    def source():
+        yield 1
+        raise OSError("falha na leitura")
+
+    with pytest.raises(OSError, match="falha na leitura"):
+        run_pipeline(source(), lambda item: item, lambda item: None)
+
+def test_reraises_transform_error():
+    def transform(item):
+        if item == 5:
+            raise ValueError("falha na transformação")
+        return item
+
+    with pytest.raises(ValueError, match="falha na transformação"):
+        run_pipeline(range(20), transform, lambda item: None, 2, 1, 2)
+
+def test_write_error_stops_an_endless_source():
+    read = []
+
+    def source():
+        for item in itertools.count():
+            read.append(item)
+            yield item
+
+    def write(item):
+        raise RuntimeError("falha na escrita")
+
+    # Com as filas cheias a leitura fica bloqueada até o pipeline ser interrompido
+    with pytest.raises(RuntimeError, match="falha na escrita"):
+        run_pipeline(source(), lambda item: item, write, 1, 1, 2)
+
+    assert len(read) < 20
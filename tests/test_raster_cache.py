@@ -0,0 +1,70 @@
+import os
+import numpy as np
+import pytest
+import rasterio
+from etl_dataforest import raster_cache
+from etl_dataforest.raster_cache import cache_key, get_cached_raster
+
+
+def write_asc(path, rows=3, cols=4, fill=1.5):
+    """
+    Grava um ASC de teste com valores `fill` e o último pixel nodata.
+    """
+
+    values = np.full((rows, cols), fill)
+    values[-1, -1] = -9999
+    header = f"ncols {cols}\nnrows {rows}\nxllcorner -50.0\nyllcorner -10.0\ncellsize 0.5\nNODATA_value -9999\n"
+    body = "\n".join(" ".join(str(value) for value in row) for row in values)
+    path.write_text(header + body + "\n")
+    return str(path)
+
+def test_converts_to_a_tiled_copy_with_the_same_data(tmp_path):
+    source = write_asc(tmp_path / "chuva.asc")
+
+    cached = get_cached_raster(source, tmp_path / "cache")
+
+    assert cached.endswith(".tif")
+    with rasterio.open(source) as asc, rasterio.open(cached) as tif:
+        assert tif.profile["tiled"]
+        assert tif.transform == asc.transform
+        assert tif.nodata == asc.nodata
+        np.testing.assert_array_equal(tif.read(1), asc.read(1))
+
+def test_reuses_the_copy_while_the_source_is_unchanged(tmp_path, monkeypatch):
+    source = write_asc(tmp_path / "chuva.asc")
+    cached = get_cached_raster(source, tmp_path / "cache")
+
+    def fail(*args, **kwargs):
+        raise AssertionError("o arquivo não deveria ser convertido de novo")
+
+    monkeypatch.setattr(raster_cache, "raster_copy", fail)
+    assert get_cached_raster(source, tmp_path / "cache") == cached
+
+def test_changed_source_replaces_the_old_copy(tmp_path):
+    source = write_asc(tmp_path / "chuva.asc")
+    old = get_cached_raster(source, tmp_path / "cache")
+    old_path_hash, old_version_hash = cache_key(source)
+
+    write_asc(tmp_path / "chuva.asc", fill=22.25)
+    # Garante uma data de modificação diferente mesmo em sistemas de arquivos com pouca resolução
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    path_hash, version_hash = cache_key(source)
+    new = get_cached_raster(source, tmp_path / "cache")
+
+    assert path_hash == old_path_hash
+    assert version_hash != old_version_hash
+    assert new != old
+    assert os.listdir(tmp_path / "cache") == [os.path.basename(new)]
+    with rasterio.open(new) as tif:
+        assert tif.read(1)[0, 0] == 22.25
+
+def test_key_depends_on_the_path(tmp_path):
+    first = write_asc(tmp_path / "a.asc")
+    second = write_asc(tmp_path / "b.asc")
+
+    assert cache_key(first)[0] != cache_key(second)[0]
+
+def test_missing_source_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        get_cached_raster(str(tmp_path / "inexistente.asc"), tmp_path / "cache")
@@ -0,0 +1,52 @@
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, Polygon, box
+from etl_dataforest.reference_cache import locate_in_reference, points_in_reference
+
+
+POLYGONS = [
+    box(0, 0, 4, 4),
+    # Polígono com buraco
+    Polygon([(5, 0), (9, 0), (9, 4), (5, 4)], holes=[[(6, 1), (8, 1), (8, 3), (6, 3)]]),
+    MultiPolygon([box(0, 5, 2, 7), box(3, 5, 5, 7)]),
+]
+CODES = np.array(["A", "B", "C"], dtype=object)
+
+def test_matches_brute_force_contains(make_reference):
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-1, 10, 5000)
+    y = rng.uniform(-1, 8, 5000)
+
+    inside, codes = locate_in_reference(x, y, make_reference(POLYGONS), CODES)
+
+    points = shapely.points(x, y)
+    expected = [
+        next((code for polygon, code in zip(POLYGONS, CODES) if polygon.contains(point)), None)
+        for point in points
+    ]
+    np.testing.assert_array_equal(inside, [code is not None for code in expected])
+    assert codes.tolist() == expected
+
+def test_boundary_and_hole_points_are_outside(make_reference):
+    # Sobre a borda (como no ST_Contains), dentro do buraco e entre as partes do multipolígono
+    x = np.array([4.0, 0.0, 7.0, 2.5, 1.0])
+    y = np.array([2.0, 0.0, 2.0, 6.0, 1.0])
+
+    inside, codes = locate_in_reference(x, y, make_reference(POLYGONS), CODES)
+
+    np.testing.assert_array_equal(inside, [False, False, False, False, True])
+    assert codes.tolist() == [None, None, None, None, "A"]
+
+def test_without_codes(make_reference):
+    reference = make_reference(POLYGONS)
+    inside, codes = locate_in_reference(np.array([1.0, 20.0]), np.array([1.0, 20.0]), reference)
+
+    assert codes is None
+    np.testing.assert_array_equal(inside, [True, False])
+    np.testing.assert_array_equal(points_in_reference(np.array([1.0, 20.0]), np.array([1.0, 20.0]), reference), inside)
+
+def test_empty_batch(make_reference):
+    inside, codes = locate_in_reference(np.array([]), np.array([]), make_reference(POLYGONS), CODES)
+
+    assert len(inside) == 0
+    assert len(codes) == 0
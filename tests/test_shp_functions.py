@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import LineString, box
+from etl_dataforest.shp_functions import KM_PER_DEGREE, resample_vertices
+
+
+def test_without_spacing_keeps_every_vertex():
+    geoms = np.array([box(0, 0, 1, 1).exterior, shapely.points(5, 5)], dtype=object)
+
+    x, y, values = resample_vertices(geoms, np.array(["a", "b"], dtype=object), 0)
+
+    assert len(x) == 6
+    assert values.tolist() == ["a"] * 5 + ["b"]
+
+@pytest.mark.parametrize("latitude", [0.0, -23.5, -60.0])
+def test_east_west_spacing_follows_the_latitude(latitude):
+    # Linha de 1000 km no sentido leste-oeste, reamostrada a cada 10 km
+    length = 1000 / (KM_PER_DEGREE * np.cos(np.radians(latitude)))
+    geoms = np.array([LineString([(-50.0, latitude), (-50.0 + length, latitude)])], dtype=object)
+
+    x, _, _ = resample_vertices(geoms, np.array([1.0]), 10 / KM_PER_DEGREE, geographic=True)
+
+    assert 99 <= len(x) <= 102
+
+def test_neighbouring_polygons_keep_their_own_points():
+    # Dois polígonos com valores diferentes e um lado em comum, com espaçamento maior que eles
+    geoms = np.array([box(0, 0, 1, 1).exterior, box(1, 0, 2, 1).exterior], dtype=object)
+
+    x, y, values = resample_vertices(geoms, np.array([1.0, 2.0]), 10.0)
+
+    assert sorted(values.tolist()) == [1.0, 2.0]